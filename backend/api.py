@@ -7,7 +7,9 @@ from pathlib import Path
 from fastapi import APIRouter, FastAPI, File, Form, HTTPException, Query, Request, UploadFile
 from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 
+from backend import metrics
 from backend.paths import FRONTEND_ASSETS_DIR, FRONTEND_DIST_DIR, FRONTEND_PUBLIC_DIR, ROOT_DIR, STATIC_DIR
+from backend.repositories.executor import DBTimeoutError, run_db
 from backend.services import app_service
 
 router = APIRouter()
@@ -37,6 +39,11 @@ async def api_latest():
     return JSONResponse(app_service.get_latest_payload())
 
 
+@router.get("/api/metrics")
+async def api_metrics():
+    return JSONResponse(metrics.snapshot())
+
+
 @router.get("/api/logs")
 async def api_logs(
     page: int = Query(1, ge=1),
@@ -44,8 +51,10 @@ async def api_logs(
     level: str | None = None,
     device_id: str | None = None,
     category: str | None = None,
+    before_id: int | None = Query(None, ge=1),
+    after_id: int | None = Query(None, ge=0),
 ):
-    return JSONResponse(app_service.get_logs_payload(page, page_size, level, device_id, category))
+    return JSONResponse(await run_db(app_service.get_logs_payload, page, page_size, level, device_id, category, before_id, after_id))
 
 
 @router.get("/api/biz_logs")
@@ -54,23 +63,39 @@ async def api_biz_logs(
     page_size: int = Query(20, ge=1, le=200),
     level: str | None = None,
     device_id: str | None = None,
+    before_id: int | None = Query(None, ge=1),
+    after_id: int | None = Query(None, ge=0),
 ):
-    return JSONResponse(app_service.get_logs_payload(page, page_size, level, device_id, "biz"))
+    return JSONResponse(await run_db(app_service.get_logs_payload, page, page_size, level, device_id, "biz", before_id, after_id))
+
+
+@router.get("/api/search")
+async def api_search(
+    q: str = Query(..., min_length=1, max_length=200),
+    scope: str = Query("logs", pattern="^(logs|images)$"),
+    start: str | None = None,
+    end: str | None = None,
+    device_id: str | None = None,
+    category: str | None = None,
+    cursor: str | None = None,
+    limit: int = Query(20, ge=1, le=100),
+):
+    return JSONResponse(await run_db(app_service.search_payload, q, scope, start, end, device_id, category, cursor, limit))
 
 
 @router.get("/api/device/{device_id}/history")
 async def api_device_history(device_id: str):
-    return JSONResponse(app_service.get_device_history_payload(device_id))
+    return JSONResponse(await run_db(app_service.get_device_history_payload, device_id))
 
 
 @router.get("/api/device/{device_id}/images")
 async def api_device_images(device_id: str, limit: int = Query(20, ge=1, le=200)):
-    return JSONResponse(app_service.get_device_images_payload(device_id, limit))
+    return JSONResponse(await run_db(app_service.get_device_images_payload, device_id, limit))
 
 
 @router.get("/api/device/{device_id}/latest-image")
 async def api_device_latest_image(device_id: str):
-    return JSONResponse(app_service.get_device_latest_image_payload(device_id))
+    return JSONResponse(await run_db(app_service.get_device_latest_image_payload, device_id))
 
 
 @router.post("/api/upload-image-legacy")
@@ -96,27 +121,27 @@ async def api_devices():
 
 @router.get("/api/recent-alarms")
 async def api_recent_alarms(limit: int = Query(10, ge=1, le=200)):
-    return JSONResponse(app_service.get_recent_alarms_payload(limit))
+    return JSONResponse(await run_db(app_service.get_recent_alarms_payload, limit))
 
 
 @router.get("/api/history")
 async def api_history(limit: int = Query(50, ge=1, le=500)):
-    return JSONResponse(app_service.get_history_payload(limit))
+    return JSONResponse(await run_db(app_service.get_history_payload, limit))
 
 
 @router.get("/api/dashboard/alarm-trend")
 async def api_dashboard_alarm_trend():
-    return JSONResponse(app_service.get_dashboard_alarm_trend_payload())
+    return JSONResponse(await run_db(app_service.get_dashboard_alarm_trend_payload))
 
 
 @router.get("/api/device/{device_id}/alarm-sessions")
 async def api_device_alarm_sessions(device_id: str, limit: int = Query(20, ge=1, le=200)):
-    return JSONResponse(app_service.get_device_alarm_sessions_payload(device_id, limit))
+    return JSONResponse(await run_db(app_service.get_device_alarm_sessions_payload, device_id, limit))
 
 
 @router.get("/api/trend")
 async def api_trend(type: str = Query("day")):
-    return JSONResponse(app_service.get_trend_payload(type))
+    return JSONResponse(await run_db(app_service.get_trend_payload, type))
 
 
 @router.get("/images/{file_path:path}")
@@ -164,7 +189,12 @@ async def serve_asset(asset_path: str):
     return FileResponse(file)
 
 
+async def _db_timeout_handler(request: Request, exc: DBTimeoutError):
+    return JSONResponse({"error": "数据库查询超时，请稍后重试"}, status_code=504)
+
+
 def register_routes(app: FastAPI):
     app.include_router(router)
+    app.add_exception_handler(DBTimeoutError, _db_timeout_handler)
     for route in SPA_ROUTES:
         app.add_api_route(route, _index_response, methods=["GET"], include_in_schema=False)
@@ -0,0 +1,31 @@
+"""In-process metrics registry exposed via ``/api/metrics``."""
+
+from __future__ import annotations
+
+import threading
+
+_providers = {}
+_lock = threading.Lock()
+
+
+def register(name, provider):
+    """Register a zero-argument callable returning a JSON-serializable dict."""
+    with _lock:
+        _providers[name] = provider
+
+
+def unregister(name):
+    with _lock:
+        _providers.pop(name, None)
+
+
+def snapshot():
+    with _lock:
+        providers = dict(_providers)
+    result = {}
+    for name, provider in providers.items():
+        try:
+            result[name] = provider()
+        except Exception as exc:
+            result[name] = {"error": str(exc)}
+    return result
@@ -2,18 +2,312 @@
 
 from __future__ import annotations
 
+import asyncio
+import time
+from collections import defaultdict
+
 import socketio
 
+from config import BROADCAST_INTERVAL_MS
 from logger import log_event
+from backend.services.positions import ZONES, zone_for
 
 sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins="*")
 
+# Clients start in the legacy room and receive full ``device_update`` payloads.
+# Emitting ``device_sync`` moves them to the delta room: one ``device_snapshot``
+# followed by versioned ``device_delta`` frames.
+LEGACY_ROOM = "devices:legacy"
+DELTA_ROOM = "devices:all"
+
+# Positions work the same way: JSON ``position_update`` lists by default,
+# ``position_sync`` switches to a ``position_index`` dictionary plus binary
+# ``position_frame`` payloads.
+POSITION_LEGACY_ROOM = "positions:legacy"
+POSITION_BINARY_ROOM = "positions:binary"
+
+# Targeted rooms: ``subscribe`` with ``{"devices": [...], "zones": [...]}`` joins
+# ``device:<id>`` / ``zone:<A-D>`` and leaves the two legacy rooms, so the
+# client only receives ``device_room_update`` / ``position_room_update`` for
+# what it asked for (plus whatever it opted into with device_sync/position_sync).
+MAX_SUBSCRIBED_DEVICES = 200
+
+
+def device_room(device_id):
+    return f"device:{device_id}"
+
+
+def zone_room(zone):
+    return f"zone:{zone}"
+
+
+def room_size(server, room, namespace="/"):
+    return sum(1 for _ in server.manager.get_participants(namespace, room))
+
 
 @sio.event
 async def connect(sid, environ, auth):
+    await sio.enter_room(sid, LEGACY_ROOM)
+    await sio.enter_room(sid, POSITION_LEGACY_ROOM)
     log_event("INFO", "socket.client.connected", "ops", "socketio", "SocketIO client connected", sid=sid)
 
 
 @sio.event
 async def disconnect(sid):
     log_event("INFO", "socket.client.disconnected", "ops", "socketio", "SocketIO client disconnected", sid=sid)
+
+
+class RoomFanout:
+    """Emit helper shared by the broadcasters that skips empty rooms and counts deliveries per room."""
+
+    def __init__(self, sio):
+        self.sio = sio
+        self._rooms = defaultdict(lambda: {"emits": 0, "deliveries": 0, "clients": 0})
+        self.sio.on("subscribe", self._on_subscribe)
+        self.sio.on("unsubscribe", self._on_unsubscribe)
+
+    @staticmethod
+    def _requested_rooms(data):
+        if not isinstance(data, dict):
+            raise ValueError("expected {devices: [...], zones: [...]}")
+        devices = data.get("devices") or []
+        zones = data.get("zones") or []
+        if not isinstance(devices, list) or not all(isinstance(d, str) and d for d in devices):
+            raise ValueError("devices must be a list of device ids")
+        if len(devices) > MAX_SUBSCRIBED_DEVICES:
+            raise ValueError(f"at most {MAX_SUBSCRIBED_DEVICES} devices per subscription")
+        if not isinstance(zones, list) or any(zone not in ZONES for zone in zones):
+            raise ValueError(f"zones must be a subset of {list(ZONES)}")
+        return [device_room(d) for d in devices] + [zone_room(z) for z in zones]
+
+    async def _on_subscribe(self, sid, data=None):
+        try:
+            rooms = self._requested_rooms(data)
+        except ValueError as exc:
+            return {"error": str(exc)}
+        for room in (LEGACY_ROOM, POSITION_LEGACY_ROOM):
+            await self.sio.leave_room(sid, room)
+        for room in rooms:
+            await self.sio.enter_room(sid, room)
+        return {"rooms": rooms}
+
+    async def _on_unsubscribe(self, sid, data=None):
+        try:
+            rooms = self._requested_rooms(data)
+        except ValueError as exc:
+            return {"error": str(exc)}
+        for room in rooms:
+            await self.sio.leave_room(sid, room)
+        return {"rooms": rooms}
+
+    def clients(self, room):
+        return room_size(self.sio, room)
+
+    async def emit(self, event, data, room):
+        """Emit to ``room`` if anyone is in it; returns the number of recipients."""
+        clients = self.clients(room)
+        if not clients:
+            return 0
+        await self.sio.emit(event, data, to=room)
+        stats = self._rooms[room]
+        stats["emits"] += 1
+        stats["deliveries"] += clients
+        stats["clients"] = clients
+        return clients
+
+    async def route(self, event, records, moved_from=None):
+        """Send each ``records`` entry to its device room and its zone room.
+
+        ``moved_from`` maps device ids to the zone they just left; those
+        zone rooms get the id in ``left`` so screens can drop the device.
+        """
+        by_room = defaultdict(lambda: {"devices": [], "left": []})
+        for record in records:
+            by_room[device_room(record["device_id"])]["devices"].append(record)
+            zone = zone_for(record.get("pos_x") or 0, record.get("pos_y") or 0)
+            if zone is not None:
+                by_room[zone_room(zone)]["devices"].append(record)
+        for device_id, zone in (moved_from or {}).items():
+            if zone is not None:
+                by_room[zone_room(zone)]["left"].append(device_id)
+        for room, data in by_room.items():
+            await self.emit(event, {"room": room, **data}, room)
+
+    def stats(self):
+        rooms = {room: dict(stats) for room, stats in self._rooms.items()}
+        return {
+            "emits": sum(stats["emits"] for stats in rooms.values()),
+            "deliveries": sum(stats["deliveries"] for stats in rooms.values()),
+            "rooms": rooms,
+        }
+
+
+class DeviceBroadcaster:
+    """Coalesce device broadcasts to at most one per interval.
+
+    Producers call :meth:`mark_dirty` from any thread. Ordinary changes are
+    flushed once per ``interval_ms``; ``urgent`` changes (alarm transitions)
+    flush immediately. Each flush bumps ``version`` and sends delta-mode
+    clients only the dirty device records plus the stat counters.
+    ``payload_factory(device_ids=None)`` returns ``{devices, stats}``, with
+    the device list limited to ``device_ids`` when given.
+    """
+
+    def __init__(self, sio, payload_factory, interval_ms=BROADCAST_INTERVAL_MS, event="device_update", fanout=None):
+        self.sio = sio
+        self.fanout = fanout or RoomFanout(sio)
+        self.payload_factory = payload_factory
+        self.interval_sec = max(0, interval_ms) / 1000.0
+        self.event = event
+        self.loop = None
+        self._task = None
+        self._wake = None
+        self._urgent_wake = None
+        self._dirty = set()
+        self._urgent = False
+        self._last_flush = 0.0
+        self.version = 0
+        self._stats = {"marks": 0, "flushes": 0, "urgent_flushes": 0, "last_flush_devices": 0, "snapshots": 0}
+        self.sio.on("device_sync", self._on_sync)
+
+    def start(self, loop=None):
+        self.loop = loop or asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._urgent_wake = asyncio.Event()
+        self._task = self.loop.create_task(self._run(), name="device-broadcast")
+        return self._task
+
+    def mark_dirty(self, device_ids=(), urgent=False):
+        """Thread-safe: schedule a broadcast covering ``device_ids``."""
+        if self.loop is None or self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self._mark, tuple(device_ids), urgent)
+
+    def _mark(self, device_ids, urgent):
+        self._stats["marks"] += 1
+        self._dirty.update(device_ids)
+        if urgent:
+            self._urgent = True
+            self._urgent_wake.set()
+        self._wake.set()
+
+    def stats(self):
+        data = dict(self._stats)
+        data["pending_devices"] = len(self._dirty)
+        data["interval_ms"] = int(self.interval_sec * 1000)
+        data["version"] = self.version
+        return data
+
+    async def _on_sync(self, sid, data=None):
+        """Switch ``sid`` to delta mode (or resync it) with a full versioned snapshot."""
+        await self.sio.leave_room(sid, LEGACY_ROOM)
+        await self.sio.enter_room(sid, DELTA_ROOM)
+        payload = self.payload_factory()
+        self._stats["snapshots"] += 1
+        await self.sio.emit("device_snapshot", {"version": self.version, **payload}, to=sid)
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            delay = self._last_flush + self.interval_sec - time.monotonic()
+            if not self._urgent and delay > 0:
+                try:
+                    await asyncio.wait_for(self._urgent_wake.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+            urgent = self._urgent
+            dirty = self._dirty
+            self._dirty = set()
+            self._urgent = False
+            self._wake.clear()
+            self._urgent_wake.clear()
+            self._last_flush = time.monotonic()
+            try:
+                await self.flush(dirty)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                log_event("ERROR", "socket.broadcast.device_update_failed", "ops", "socketio", "Device update broadcast failed", error=str(exc))
+                continue
+            self._stats["flushes"] += 1
+            self._stats["last_flush_devices"] = len(dirty)
+            if urgent:
+                self._stats["urgent_flushes"] += 1
+
+    async def flush(self, dirty):
+        # The full device list is only built while legacy clients are connected.
+        legacy = self.fanout.clients(LEGACY_ROOM)
+        payload = self.payload_factory() if legacy else self.payload_factory(dirty)
+        self.version += 1
+        delta = {
+            "version": self.version,
+            "base_version": self.version - 1,
+            "devices": [dev for dev in payload["devices"] if dev["device_id"] in dirty],
+            "stats": payload["stats"],
+        }
+        await self.fanout.emit("device_delta", delta, DELTA_ROOM)
+        if legacy:
+            await self.fanout.emit(self.event, payload, LEGACY_ROOM)
+        await self.fanout.route("device_room_update", delta["devices"])
+
+
+class PositionBroadcaster:
+    """Send each position tick as JSON to legacy clients and as a packed frame to binary ones.
+
+    ``store`` is the ``PositionStore``; ``payload_factory`` builds the legacy
+    device list and is only called while a legacy client is connected. The
+    device index is re-sent to the binary room whenever its generation moves.
+    """
+
+    def __init__(self, sio, store, payload_factory, fanout=None):
+        self.sio = sio
+        self.store = store
+        self.payload_factory = payload_factory
+        self.fanout = fanout or RoomFanout(sio)
+        self._index_generation = None
+        self._zones = {}
+        self._stats = {"ticks": 0, "frame_bytes": 0, "index_sends": 0}
+        self.sio.on("position_sync", self._on_sync)
+
+    def stats(self):
+        data = dict(self._stats)
+        data["binary_clients"] = room_size(self.sio, POSITION_BINARY_ROOM)
+        data["legacy_clients"] = room_size(self.sio, POSITION_LEGACY_ROOM)
+        return data
+
+    async def _on_sync(self, sid, data=None):
+        """Switch ``sid`` to binary frames (or resend the index after a generation mismatch)."""
+        await self.sio.leave_room(sid, POSITION_LEGACY_ROOM)
+        await self.sio.enter_room(sid, POSITION_BINARY_ROOM)
+        await self._send_index(to=sid)
+        await self.sio.emit("position_frame", self.store.pack_frame(), to=sid)
+
+    async def _send_index(self, to):
+        generation, device_ids = self.store.index()
+        self._stats["index_sends"] += 1
+        await self.sio.emit("position_index", {"generation": generation, "devices": device_ids}, to=to)
+        return generation
+
+    async def broadcast(self):
+        self._stats["ticks"] += 1
+        if room_size(self.sio, POSITION_BINARY_ROOM):
+            generation, _ = self.store.index()
+            if generation != self._index_generation:
+                self._index_generation = await self._send_index(to=POSITION_BINARY_ROOM)
+            frame = self.store.pack_frame()
+            self._stats["frame_bytes"] = len(frame)
+            await self.fanout.emit("position_frame", frame, POSITION_BINARY_ROOM)
+        if room_size(self.sio, POSITION_LEGACY_ROOM):
+            await self.fanout.emit("position_update", self.payload_factory(), POSITION_LEGACY_ROOM)
+        records = [
+            {"device_id": device_id, "pos_x": pos_x, "pos_y": pos_y}
+            for device_id, (pos_x, pos_y) in self.store.snapshot().items()
+        ]
+        zones = {record["device_id"]: zone_for(record["pos_x"], record["pos_y"]) for record in records}
+        moved_from = {
+            device_id: self._zones[device_id]
+            for device_id, zone in zones.items()
+            if device_id in self._zones and self._zones[device_id] != zone
+        }
+        self._zones = zones
+        await self.fanout.route("position_room_update", records, moved_from)
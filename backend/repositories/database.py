@@ -6,16 +6,30 @@ import base64
 import os
 import random
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from pathlib import Path
 
 from config import (
-    DB_BUSY_TIMEOUT_MS,
+    ALARM_STORAGE_MODE,
     DB_PATH,
+    HEARTBEAT_FLUSH_INTERVAL_SEC,
     HISTORY_LIMIT,
+    LLM_BURST_MAX_IMAGES,
+    LLM_BURST_WINDOW_SEC,
+    LLM_DEDUP_ENABLED,
+    LLM_DEDUP_MAX_DISTANCE,
+    LLM_DEDUP_WINDOW_SEC,
     LLM_RETRY_INTERVAL_SEC,
     TREND_LIMIT,
 )
-from backend.paths import ALARMS_IMAGE_DIR, IMAGES_DIR
+from fts import build_match_query, decode_cursor, encode_cursor, like_patterns
+from image_prep import hamming_distance, perceptual_hash
+from timeutil import format_ms, parse_ms
+from backend.paths import ALARMS_IMAGE_DIR, IMAGES_DIR, ROOT_DIR
+from backend.repositories.pool import ConnectionPool
 
 ALARMS_IMAGE_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -37,381 +51,914 @@ def is_safe_image_path(image_path: str) -> bool:
     return abs_path.startswith(base_dir + os.sep)
 
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL;")
-    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS};")
-    return conn
+_pool = ConnectionPool(DB_PATH)
+
+
+def get_pool():
+    return _pool
 
 
 def init_db():
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with _pool.writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS alarms (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                device_id TEXT,
+                alarm INTEGER,
+                timestamp INTEGER
+            )
+            """
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS devices (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                device_id TEXT UNIQUE,
+                alarm_status INTEGER DEFAULT 0,
+                error_count INTEGER DEFAULT 0,
+                boot_time INTEGER,
+                last_seen INTEGER,
+                online_status INTEGER DEFAULT 0,
+                update_time INTEGER,
+                pos_x REAL DEFAULT 0,
+                pos_y REAL DEFAULT 0
+            )
+            """
+        )
+        for stmt in (
+            "ALTER TABLE devices ADD COLUMN pos_x REAL DEFAULT 0",
+            "ALTER TABLE devices ADD COLUMN pos_y REAL DEFAULT 0",
+        ):
+            try:
+                cursor.execute(stmt)
+            except sqlite3.OperationalError:
+                pass
+
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS alarm_images (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                device_id TEXT,
+                image_path TEXT,
+                timestamp INTEGER
+            )
+            """
+        )
+        for stmt in (
+            "ALTER TABLE alarm_images ADD COLUMN description TEXT",
+            "ALTER TABLE alarm_images ADD COLUMN description_status TEXT",
+            "ALTER TABLE alarm_images ADD COLUMN description_model TEXT",
+            "ALTER TABLE alarm_images ADD COLUMN description_updated_at TEXT",
+            "ALTER TABLE alarm_images ADD COLUMN description_error TEXT",
+        ):
+            try:
+                cursor.execute(stmt)
+            except sqlite3.OperationalError:
+                pass
+
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS alarm_sessions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                device_id TEXT NOT NULL,
+                start_time INTEGER NOT NULL,
+                end_time INTEGER,
+                duration_sec REAL,
+                status INTEGER DEFAULT 0
+            )
+            """
+        )
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_alarm_sessions_device
+            ON alarm_sessions(device_id, status)
+            """
+        )
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_alarm_unique
+            ON alarm_images(device_id, timestamp)
+            """
+        )
+        cursor.execute(
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_alarm_unique_path
+            ON alarm_images(device_id, image_path)
+            """
+        )
+        _apply_migrations(conn)
+
+
+def _migrate_alarm_time_indexes(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_alarms_device_ts ON alarms(device_id, timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_alarms_alarm_ts ON alarms(alarm, timestamp)")
+
+
+# Rollup granularity -> (table, bucket key length). Buckets are prefixes of
+# the local "YYYY-MM-DD HH:MM:SS" time: "YYYY-MM-DD HH:MM", "YYYY-MM-DD HH", "YYYY-MM-DD".
+ROLLUP_TABLES = {
+    "minute": ("alarm_rollup_minute", 16),
+    "hour": ("alarm_rollup_hour", 13),
+    "day": ("alarm_rollup_day", 10),
+}
+
+
+def _migrate_alarm_rollups(cursor):
+    for table, _ in ROLLUP_TABLES.values():
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                device_id TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                samples INTEGER NOT NULL DEFAULT 0,
+                alarm_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (device_id, bucket)
+            ) WITHOUT ROWID
+            """
+        )
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_bucket ON {table}(bucket)")
+    # Backfilled by _migrate_epoch_timestamps once alarms.timestamp is numeric.
+
+
+def _text_to_ms(column):
+    """SQL expression converting a local 'YYYY-MM-DD HH:MM:SS' TEXT value to epoch ms."""
+    return (
+        f"CASE WHEN typeof({column}) = 'text' "
+        f"THEN CAST(strftime('%s', {column}, 'utc') AS INTEGER) * 1000 ELSE {column} END"
+    )
+
+
+def _rebuild_table(cursor, table, create_sql, columns, converted, where=None, indexes=()):
+    """Recreate ``table`` with ``create_sql`` and copy rows, converting ``converted`` columns to epoch ms.
+
+    TEXT-affinity columns would coerce integers back to text, so the column
+    types can only change by rebuilding the table.
+    """
+    select = ", ".join(f"{_text_to_ms(column)} AS {column}" if column in converted else column for column in columns)
+    column_list = ", ".join(columns)
+    cursor.execute(f"DROP TABLE IF EXISTS {table}_new")
+    cursor.execute(create_sql.format(table=f"{table}_new"))
     cursor.execute(
+        f"INSERT INTO {table}_new ({column_list}) SELECT {column_list} FROM (SELECT {select} FROM {table})"
+        + (f" WHERE {where}" if where else "")
+    )
+    cursor.execute(f"DROP TABLE {table}")
+    cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    for index_sql in indexes:
+        cursor.execute(index_sql)
+
+
+def _migrate_epoch_timestamps(cursor):
+    """Store event times as INTEGER epoch milliseconds instead of formatted TEXT."""
+    _rebuild_table(
+        cursor,
+        "alarms",
         """
-        CREATE TABLE IF NOT EXISTS alarms (
+        CREATE TABLE {table} (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             device_id TEXT,
             alarm INTEGER,
-            timestamp TEXT
+            timestamp INTEGER
         )
-        """
+        """,
+        ("id", "device_id", "alarm", "timestamp"),
+        ("timestamp",),
+        indexes=(
+            "CREATE INDEX idx_alarms_device_ts ON alarms(device_id, timestamp)",
+            "CREATE INDEX idx_alarms_alarm_ts ON alarms(alarm, timestamp)",
+        ),
     )
-    cursor.execute(
+    _rebuild_table(
+        cursor,
+        "devices",
         """
-        CREATE TABLE IF NOT EXISTS devices (
+        CREATE TABLE {table} (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             device_id TEXT UNIQUE,
             alarm_status INTEGER DEFAULT 0,
             error_count INTEGER DEFAULT 0,
-            boot_time TEXT,
-            last_seen TEXT,
+            boot_time INTEGER,
+            last_seen INTEGER,
             online_status INTEGER DEFAULT 0,
-            update_time TEXT,
+            update_time INTEGER,
             pos_x REAL DEFAULT 0,
             pos_y REAL DEFAULT 0
         )
-        """
-    )
-    for stmt in (
-        "ALTER TABLE devices ADD COLUMN pos_x REAL DEFAULT 0",
-        "ALTER TABLE devices ADD COLUMN pos_y REAL DEFAULT 0",
-    ):
-        try:
-            cursor.execute(stmt)
-        except sqlite3.OperationalError:
-            pass
-
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS biz_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ts TEXT,
-            level TEXT,
-            event TEXT,
-            device_id TEXT,
-            message TEXT,
-            extra TEXT
-        )
-        """
+        """,
+        ("id", "device_id", "alarm_status", "error_count", "boot_time", "last_seen", "online_status", "update_time", "pos_x", "pos_y"),
+        ("boot_time", "last_seen", "update_time"),
     )
-    cursor.execute(
+    _rebuild_table(
+        cursor,
+        "alarm_images",
         """
-        CREATE TABLE IF NOT EXISTS alarm_images (
+        CREATE TABLE {table} (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             device_id TEXT,
             image_path TEXT,
-            timestamp TEXT
+            timestamp INTEGER,
+            description TEXT,
+            description_status TEXT,
+            description_model TEXT,
+            description_updated_at TEXT,
+            description_error TEXT
         )
-        """
+        """,
+        (
+            "id", "device_id", "image_path", "timestamp", "description", "description_status",
+            "description_model", "description_updated_at", "description_error",
+        ),
+        ("timestamp",),
+        indexes=(
+            "CREATE INDEX idx_alarm_unique ON alarm_images(device_id, timestamp)",
+            "CREATE UNIQUE INDEX idx_alarm_unique_path ON alarm_images(device_id, image_path)",
+        ),
     )
-    for stmt in (
-        "ALTER TABLE alarm_images ADD COLUMN description TEXT",
-        "ALTER TABLE alarm_images ADD COLUMN description_status TEXT",
-        "ALTER TABLE alarm_images ADD COLUMN description_model TEXT",
-        "ALTER TABLE alarm_images ADD COLUMN description_updated_at TEXT",
-        "ALTER TABLE alarm_images ADD COLUMN description_error TEXT",
-    ):
-        try:
-            cursor.execute(stmt)
-        except sqlite3.OperationalError:
-            pass
-
-    cursor.execute(
+    _rebuild_table(
+        cursor,
+        "alarm_sessions",
         """
-        CREATE TABLE IF NOT EXISTS alarm_sessions (
+        CREATE TABLE {table} (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             device_id TEXT NOT NULL,
-            start_time TEXT NOT NULL,
-            end_time TEXT,
+            start_time INTEGER NOT NULL,
+            end_time INTEGER,
             duration_sec REAL,
             status INTEGER DEFAULT 0
         )
-        """
+        """,
+        ("id", "device_id", "start_time", "end_time", "duration_sec", "status"),
+        ("start_time", "end_time"),
+        where="start_time IS NOT NULL",
+        indexes=("CREATE INDEX idx_alarm_sessions_device ON alarm_sessions(device_id, status)",),
     )
+    _rebuild_alarm_rollups(cursor)
+
+
+def _migrate_image_description_fts(cursor):
+    """Trigram FTS5 index over alarm_images.description, kept in sync by triggers.
+
+    Skipped when SQLite lacks FTS5; search_alarm_images then falls back to LIKE.
+    """
+    try:
+        cursor.execute(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS alarm_images_fts USING fts5(
+                description, device_id,
+                content='alarm_images', content_rowid='id', tokenize='trigram'
+            )
+            """
+        )
+    except sqlite3.OperationalError:
+        return
     cursor.execute(
         """
-        CREATE INDEX IF NOT EXISTS idx_alarm_sessions_device
-        ON alarm_sessions(device_id, status)
+        CREATE TRIGGER IF NOT EXISTS alarm_images_fts_ai AFTER INSERT ON alarm_images BEGIN
+            INSERT INTO alarm_images_fts (rowid, description, device_id)
+            VALUES (new.id, new.description, new.device_id);
+        END
         """
     )
     cursor.execute(
         """
-        CREATE INDEX IF NOT EXISTS idx_alarm_unique
-        ON alarm_images(device_id, timestamp)
+        CREATE TRIGGER IF NOT EXISTS alarm_images_fts_ad AFTER DELETE ON alarm_images BEGIN
+            INSERT INTO alarm_images_fts (alarm_images_fts, rowid, description, device_id)
+            VALUES ('delete', old.id, old.description, old.device_id);
+        END
         """
     )
     cursor.execute(
         """
-        CREATE UNIQUE INDEX IF NOT EXISTS idx_alarm_unique_path
-        ON alarm_images(device_id, image_path)
+        CREATE TRIGGER IF NOT EXISTS alarm_images_fts_au AFTER UPDATE OF description, device_id ON alarm_images BEGIN
+            INSERT INTO alarm_images_fts (alarm_images_fts, rowid, description, device_id)
+            VALUES ('delete', old.id, old.description, old.device_id);
+            INSERT INTO alarm_images_fts (rowid, description, device_id)
+            VALUES (new.id, new.description, new.device_id);
+        END
         """
     )
-    conn.commit()
-    conn.close()
+    cursor.execute("INSERT INTO alarm_images_fts (alarm_images_fts) VALUES ('rebuild')")
 
 
-def update_device_data(device_id, alarm, mqtt_timestamp=None):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    changed = {}
+def _migrate_alarm_events(cursor):
+    """One row per alarm raise, linked to its session and images.
+
+    Backfilled from alarm_sessions; every existing image is attached to the
+    latest raise of its device at or before the image timestamp.
+    """
     cursor.execute(
         """
-        INSERT INTO alarms (device_id, alarm, timestamp)
-        VALUES (?, ?, ?)
-        """,
-        (device_id, alarm, now_str),
+        CREATE TABLE IF NOT EXISTS alarm_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            device_id TEXT NOT NULL,
+            session_id INTEGER,
+            timestamp INTEGER NOT NULL,
+            image_id INTEGER
+        )
+        """
     )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_alarm_events_ts ON alarm_events(timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_alarm_events_device_ts ON alarm_events(device_id, timestamp)")
+    try:
+        cursor.execute("ALTER TABLE alarm_images ADD COLUMN event_id INTEGER")
+    except sqlite3.OperationalError:
+        pass
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_alarm_images_event ON alarm_images(event_id)")
     cursor.execute(
-        "SELECT alarm_status, online_status, error_count, boot_time FROM devices WHERE device_id = ?",
-        (device_id,),
+        """
+        INSERT INTO alarm_events (device_id, session_id, timestamp)
+        SELECT device_id, id, start_time FROM alarm_sessions ORDER BY start_time, id
+        """
     )
-    row = cursor.fetchone()
-    if row:
-        old_alarm = row["alarm_status"]
-        old_online = row["online_status"]
-        error_count = row["error_count"]
-        boot_time = row["boot_time"]
-        if old_online == 0:
-            boot_time = now_str
-            changed["online_marked"] = True
-        if old_alarm == 0 and alarm == 1:
-            error_count += 1
-            changed["alarm_raised"] = True
-            cursor.execute(
-                """
-                INSERT INTO alarm_sessions (device_id, start_time, status)
-                VALUES (?, ?, 0)
-                """,
-                (device_id, mqtt_timestamp or now_str),
-            )
-        if old_alarm == 1 and alarm == 0:
-            changed["alarm_cleared"] = True
-            cursor.execute(
-                """
-                SELECT id, start_time FROM alarm_sessions
-                WHERE device_id = ? AND status = 0
-                ORDER BY id DESC LIMIT 1
-                """,
-                (device_id,),
-            )
-            active_session = cursor.fetchone()
-            if active_session:
-                end_time = mqtt_timestamp or now_str
-                start_dt = datetime.strptime(
-                    active_session["start_time"], "%Y-%m-%d %H:%M:%S"
-                )
-                end_dt = datetime.strptime(end_time, "%Y-%m-%d %H:%M:%S")
-                duration = (end_dt - start_dt).total_seconds()
-                cursor.execute(
-                    """
-                    UPDATE alarm_sessions
-                    SET end_time = ?, duration_sec = ?, status = 1
-                    WHERE id = ?
-                    """,
-                    (end_time, duration, active_session["id"]),
-                )
-        cursor.execute(
-            """
-            UPDATE devices SET
-                alarm_status = ?,
-                error_count = ?,
-                boot_time = ?,
-                last_seen = ?,
-                online_status = 1,
-                update_time = ?
-            WHERE device_id = ?
-            """,
-            (alarm, error_count, boot_time, now_str, now_str, device_id),
+    cursor.execute(
+        """
+        UPDATE alarm_images
+        SET event_id = (
+            SELECT e.id FROM alarm_events e
+            WHERE e.device_id = alarm_images.device_id AND e.timestamp <= alarm_images.timestamp
+            ORDER BY e.timestamp DESC
+            LIMIT 1
         )
-    else:
+        """
+    )
+    cursor.execute(
+        """
+        UPDATE alarm_events
+        SET image_id = (
+            SELECT ai.id FROM alarm_images ai
+            WHERE ai.event_id = alarm_events.id
+            ORDER BY ai.timestamp DESC, ai.id DESC
+            LIMIT 1
+        )
+        """
+    )
+
+
+def _migrate_alarm_timestamp_index(cursor):
+    """Plain timestamp index so retention can range-scan and delete the oldest raw rows."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_alarms_ts ON alarms(timestamp)")
+
+
+def _migrate_alarm_image_phash(cursor):
+    """Perceptual hash per image plus the image whose description a near-duplicate reuses."""
+    for stmt in (
+        "ALTER TABLE alarm_images ADD COLUMN phash INTEGER",
+        "ALTER TABLE alarm_images ADD COLUMN derived_from INTEGER",
+    ):
+        try:
+            cursor.execute(stmt)
+        except sqlite3.OperationalError:
+            pass
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_alarm_images_derived_from ON alarm_images(derived_from)")
+
+
+# Schema migrations, applied in order and tracked with PRAGMA user_version.
+# Append new steps at the end; never reorder or remove existing ones.
+_MIGRATIONS = (
+    _migrate_alarm_time_indexes,
+    _migrate_alarm_rollups,
+    _migrate_epoch_timestamps,
+    _migrate_image_description_fts,
+    _migrate_alarm_events,
+    _migrate_alarm_timestamp_index,
+    _migrate_alarm_image_phash,
+)
+
+
+def _apply_migrations(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(_MIGRATIONS, start=1):
+        if number <= version:
+            continue
+        migration(conn.cursor())
+        conn.execute(f"PRAGMA user_version={number}")
+        conn.commit()
+
+
+def _rebuild_alarm_rollups(cursor, merge=False):
+    """Recompute rollups from raw rows; with ``merge`` existing buckets are only ever raised."""
+    # Buckets older than the oldest raw row were archived by retention; keep them.
+    oldest = cursor.execute("SELECT MIN(timestamp) FROM alarms").fetchone()[0]
+    if oldest is None:
+        return
+    for table, key_length in ROLLUP_TABLES.values():
+        if not merge:
+            cursor.execute(f"DELETE FROM {table} WHERE bucket >= ?", (format_ms(oldest)[:key_length],))
         cursor.execute(
+            f"""
+            INSERT INTO {table} (device_id, bucket, samples, alarm_count)
+            SELECT device_id, substr(datetime(timestamp / 1000, 'unixepoch', 'localtime'), 1, {key_length}) AS bucket,
+                   COUNT(*), SUM(CASE WHEN alarm = 1 THEN 1 ELSE 0 END)
+            FROM alarms
+            WHERE timestamp IS NOT NULL
+            GROUP BY device_id, bucket
+            ON CONFLICT(device_id, bucket) DO UPDATE SET
+                samples = MAX(samples, excluded.samples),
+                alarm_count = MAX(alarm_count, excluded.alarm_count)
             """
-            INSERT INTO devices
-                (device_id, alarm_status, error_count, boot_time, last_seen, online_status, update_time)
-            VALUES (?, ?, ?, ?, ?, 1, ?)
+        )
+
+
+def rebuild_alarm_rollups():
+    """Recompute the rollup tables from the raw ``alarms`` rows still retained.
+
+    In ``transitions`` storage mode raw rows are only state edges, so buckets
+    are topped up from them but never lowered.
+    """
+    with _writer_with_heartbeats() as conn:
+        _rebuild_alarm_rollups(conn.cursor(), merge=ALARM_STORAGE_MODE == "transitions")
+        counts = {
+            granularity: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for granularity, (table, _) in ROLLUP_TABLES.items()
+        }
+    return counts
+
+
+def _update_alarm_rollups(cursor, samples):
+    """Fold ``(device_id, timestamp_ms, alarm)`` samples into the rollup tables."""
+    if not samples:
+        return
+    samples = [(device_id, format_ms(timestamp), alarm) for device_id, timestamp, alarm in samples]
+    for table, key_length in ROLLUP_TABLES.values():
+        buckets = {}
+        for device_id, local_time, alarm in samples:
+            key = (device_id, local_time[:key_length])
+            total, alarms = buckets.get(key, (0, 0))
+            buckets[key] = (total + 1, alarms + (1 if alarm == 1 else 0))
+        cursor.executemany(
+            f"""
+            INSERT INTO {table} (device_id, bucket, samples, alarm_count)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(device_id, bucket) DO UPDATE SET
+                samples = samples + excluded.samples,
+                alarm_count = alarm_count + excluded.alarm_count
             """,
-            (device_id, alarm, 1 if alarm == 1 else 0, now_str, now_str, now_str),
+            [(device_id, bucket, total, alarms) for (device_id, bucket), (total, alarms) in buckets.items()],
         )
-        changed["online_marked"] = True
-        if alarm == 1:
-            changed["alarm_raised"] = True
-            cursor.execute(
-                """
-                INSERT INTO alarm_sessions (device_id, start_time, status)
-                VALUES (?, ?, 0)
+
+
+def get_oldest_alarm_timestamp():
+    with _pool.reader() as conn:
+        return conn.execute("SELECT MIN(timestamp) FROM alarms").fetchone()[0]
+
+
+def get_alarm_rollup_buckets(start_ms, end_ms):
+    """Aggregate raw rows in ``[start_ms, end_ms)`` per rollup table: ``{table: [(device_id, bucket, samples, alarm_count)]}``."""
+    buckets = {}
+    with _pool.reader() as conn:
+        for table, key_length in ROLLUP_TABLES.values():
+            rows = conn.execute(
+                f"""
+                SELECT device_id, substr(datetime(timestamp / 1000, 'unixepoch', 'localtime'), 1, {key_length}) AS bucket,
+                       COUNT(*), SUM(CASE WHEN alarm = 1 THEN 1 ELSE 0 END)
+                FROM alarms
+                WHERE timestamp >= ? AND timestamp < ?
+                GROUP BY device_id, bucket
                 """,
-                (device_id, mqtt_timestamp or now_str),
-            )
-    conn.commit()
-    conn.close()
-    return changed
+                (start_ms, end_ms),
+            ).fetchall()
+            buckets[table] = [tuple(row) for row in rows]
+    return buckets
 
 
-def set_device_offline(device_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE devices SET online_status = 0 WHERE device_id = ?", (device_id,))
-    conn.commit()
-    conn.close()
+def merge_alarm_rollups(table, rows):
+    """Upsert recomputed buckets, never lowering counts already folded in at ingest."""
+    if table not in {name for name, _ in ROLLUP_TABLES.values()}:
+        raise ValueError(f"unknown rollup table: {table}")
+    with _pool.writer() as conn:
+        conn.executemany(
+            f"""
+            INSERT INTO {table} (device_id, bucket, samples, alarm_count)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(device_id, bucket) DO UPDATE SET
+                samples = MAX(samples, excluded.samples),
+                alarm_count = MAX(alarm_count, excluded.alarm_count)
+            """,
+            rows,
+        )
 
 
-def get_all_devices():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM devices")
-    rows = cursor.fetchall()
-    conn.close()
+def get_alarm_rows_before(end_ms, limit):
+    """Oldest raw alarm rows with ``timestamp < end_ms``, in time order."""
+    with _pool.reader() as conn:
+        rows = conn.execute(
+            """
+            SELECT id, device_id, alarm, timestamp
+            FROM alarms
+            WHERE timestamp < ?
+            ORDER BY timestamp, id
+            LIMIT ?
+            """,
+            (end_ms, limit),
+        ).fetchall()
     return _rows_to_dicts(rows)
 
 
-def get_latest_data_with_stats():
-    devices = get_all_devices()
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT device_id, start_time
-        FROM alarm_sessions
-        WHERE status = 0
-        """
-    )
-    active_rows = cursor.fetchall()
-    conn.close()
-    active_map = {row["device_id"]: row["start_time"] for row in active_rows}
-    now_dt = datetime.now()
-    for dev in devices:
-        start_time = active_map.get(dev.get("device_id"))
-        if dev.get("alarm_status") == 1 and start_time:
-            try:
-                start_dt = datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S")
-                dev["alarm_start_time"] = start_time
-                dev["current_duration_sec"] = max(0, (now_dt - start_dt).total_seconds())
-            except Exception:
-                dev["alarm_start_time"] = start_time
-                dev["current_duration_sec"] = None
-        else:
-            dev["alarm_start_time"] = None
-            dev["current_duration_sec"] = None
-    total = len(devices)
-    online = sum(1 for d in devices if d["online_status"] == 1)
-    alarm = sum(1 for d in devices if d["alarm_status"] == 1 and d["online_status"] == 1)
-    return {"devices": devices, "stats": {"total": total, "online": online, "alarm": alarm}}
+def delete_alarm_rows(ids):
+    with _pool.writer() as conn:
+        conn.executemany("DELETE FROM alarms WHERE id = ?", [(row_id,) for row_id in ids])
 
 
-def get_device_history_raw(device_id, limit=HISTORY_LIMIT):
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def delete_rollup_buckets_before(table, bucket, limit):
+    """Delete up to ``limit`` buckets older than ``bucket`` from a rollup table; returns the count."""
+    if table not in {name for name, _ in ROLLUP_TABLES.values()}:
+        raise ValueError(f"unknown rollup table: {table}")
+    with _pool.writer() as conn:
+        cursor = conn.execute(
+            f"""
+            DELETE FROM {table}
+            WHERE (device_id, bucket) IN (
+                SELECT device_id, bucket FROM {table} WHERE bucket < ? LIMIT ?
+            )
+            """,
+            (bucket, limit),
+        )
+        return cursor.rowcount
+
+
+_AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+
+
+def get_auto_vacuum():
+    """``(mode, free_pages)``; mode is ``none``/``full``/``incremental`` as the file was built."""
+    with _pool.reader() as conn:
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return _AUTO_VACUUM_MODES.get(mode, str(mode)), free
+
+
+def incremental_vacuum(pages):
+    """Release up to ``pages`` free pages; returns ``(released, still_free)``."""
+    with _pool.writer() as conn:
+        before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+        after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return before - after, after
+
+
+def load_device_state():
+    """Rows needed to seed the in-memory device state table."""
+    with _pool.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM devices")
+        devices = _rows_to_dicts(cursor.fetchall())
+        cursor.execute(
+            """
+            SELECT device_id, start_time
+            FROM alarm_sessions
+            WHERE status = 0
+            ORDER BY id ASC
+            """
+        )
+        active_sessions = _rows_to_dicts(cursor.fetchall())
+    return devices, active_sessions
+
+
+class _HeartbeatBuffer:
+    """Heartbeats deferred in ``transitions`` storage mode: rollup samples plus each device's latest row."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = []
+        self._devices = {}
+        self._since = None
+        self._stats = {"deferred": 0, "flushes": 0, "flushed_samples": 0}
+
+    def add(self, plans):
+        with self._lock:
+            if self._since is None:
+                self._since = time.monotonic()
+            for plan in plans:
+                self._samples.append((plan["device_id"], plan["now"], plan["alarm"]))
+                self._devices[plan["device_id"]] = plan["device"]
+            self._stats["deferred"] += len(plans)
+
+    def due(self):
+        with self._lock:
+            return self._since is not None and time.monotonic() - self._since >= HEARTBEAT_FLUSH_INTERVAL_SEC
+
+    def take(self, device_ids=None):
+        """Remove and return ``(samples, devices)``: everything, or only the device rows of ``device_ids``."""
+        with self._lock:
+            if device_ids is not None:
+                return [], {device_id: self._devices.pop(device_id) for device_id in device_ids if device_id in self._devices}
+            taken = (self._samples, self._devices)
+            self._samples, self._devices, self._since = [], {}, None
+        return taken
+
+    def restore(self, samples, devices):
+        """Put back heartbeats whose flush rolled back; anything buffered since is newer and wins."""
+        with self._lock:
+            self._samples[:0] = samples
+            for device_id, device in devices.items():
+                self._devices.setdefault(device_id, device)
+            if self._since is None and self._samples:
+                self._since = time.monotonic()
+
+    def record_flush(self, samples):
+        if samples:
+            with self._lock:
+                self._stats["flushes"] += 1
+                self._stats["flushed_samples"] += samples
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mode": ALARM_STORAGE_MODE,
+                "pending_samples": len(self._samples),
+                "pending_devices": len(self._devices),
+                **self._stats,
+            }
+
+
+_heartbeats = _HeartbeatBuffer()
+
+
+def heartbeat_stats():
+    return _heartbeats.stats()
+
+
+def _upsert_device(cursor, device_id, device):
     cursor.execute(
         """
-        SELECT alarm, timestamp
-        FROM alarms
-        WHERE device_id = ?
-        ORDER BY timestamp DESC
-        LIMIT ?
+        INSERT INTO devices
+            (device_id, alarm_status, error_count, boot_time, last_seen, online_status, update_time)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(device_id) DO UPDATE SET
+            alarm_status = excluded.alarm_status,
+            error_count = excluded.error_count,
+            boot_time = excluded.boot_time,
+            last_seen = excluded.last_seen,
+            online_status = excluded.online_status,
+            update_time = excluded.update_time
+        RETURNING id
         """,
-        (device_id, limit),
+        (
+            device_id,
+            device["alarm_status"],
+            device["error_count"],
+            device["boot_time"],
+            device["last_seen"],
+            device["online_status"],
+            device["update_time"],
+        ),
     )
-    rows = cursor.fetchall()
-    conn.close()
+    return cursor.fetchone()["id"]
+
+
+@contextmanager
+def _writer_with_heartbeats(flush=True, superseded=()):
+    """Writer transaction over the heartbeat buffer; whatever it takes is put back on rollback.
+
+    With ``flush`` every buffered heartbeat is written first. Otherwise only
+    the buffered device rows in ``superseded`` are dropped, because the
+    caller writes newer ones. The buffer is taken under the writer lock so an
+    older device row can never land on top of a newer committed one.
+    """
+    taken = None
+    try:
+        with _pool.writer() as conn:
+            taken = _heartbeats.take(None if flush else superseded)
+            if flush:
+                samples, devices = taken
+                cursor = conn.cursor()
+                for device_id, device in devices.items():
+                    _upsert_device(cursor, device_id, device)
+                _update_alarm_rollups(cursor, samples)
+            yield conn
+    except BaseException:
+        if taken is not None:
+            _heartbeats.restore(*taken)
+        raise
+    _heartbeats.record_flush(len(taken[0]))
+
+
+def flush_heartbeats():
+    """Write buffered heartbeat counters and device rows now."""
+    with _writer_with_heartbeats():
+        pass
+
+
+def write_mqtt_batch(plans):
+    """Persist precomputed device transitions in a single transaction (group commit).
+
+    ``plans`` come from the in-memory device state table, so no reads are
+    needed here. Returns ``{device_id: devices.id}`` for every touched device.
+
+    In ``transitions`` storage mode a plan that changes no state (a plain
+    heartbeat) gets no ``alarms`` row. Devices with only heartbeats in the
+    batch have their rollup samples and latest device row buffered until
+    ``HEARTBEAT_FLUSH_INTERVAL_SEC`` has passed; devices with a transition
+    (or images) are written now.
+    """
+    transitions_only = ALARM_STORAGE_MODE == "transitions"
+    flush = not transitions_only or _heartbeats.due()
+    if flush:
+        written = {plan["device_id"] for plan in plans}
+    else:
+        written = {plan["device_id"] for plan in plans if plan["transition"] or plan["image_paths"]}
+    deferred = [plan for plan in plans if plan["device_id"] not in written]
+    if not written:
+        _heartbeats.add(deferred)
+        return {}
+    latest = {plan["device_id"]: plan["device"] for plan in plans}
+    with _writer_with_heartbeats(flush=flush, superseded=written) as conn:
+        cursor = conn.cursor()
+        row_ids = {}
+        for plan in plans:
+            device_id = plan["device_id"]
+            if device_id not in written:
+                continue
+            if not transitions_only or plan["transition"]:
+                cursor.execute(
+                    """
+                    INSERT INTO alarms (device_id, alarm, timestamp)
+                    VALUES (?, ?, ?)
+                    """,
+                    (device_id, plan["alarm"], plan["now"]),
+                )
+            if plan["session_open"]:
+                cursor.execute(
+                    """
+                    INSERT INTO alarm_sessions (device_id, start_time, status)
+                    VALUES (?, ?, 0)
+                    """,
+                    (device_id, plan["session_open"]),
+                )
+                cursor.execute(
+                    """
+                    INSERT INTO alarm_events (device_id, session_id, timestamp)
+                    VALUES (?, ?, ?)
+                    """,
+                    (device_id, cursor.lastrowid, plan["session_open"]),
+                )
+                event_id = cursor.lastrowid
+            else:
+                event_id = None
+            if plan["session_close"]:
+                end_time, duration = plan["session_close"]
+                cursor.execute(
+                    """
+                    UPDATE alarm_sessions
+                    SET end_time = ?, duration_sec = ?, status = 1
+                    WHERE device_id = ? AND status = 0
+                    """,
+                    (end_time, duration, device_id),
+                )
+            for image_path in plan["image_paths"]:
+                _insert_alarm_image(cursor, device_id, image_path, plan["timestamp"], link=event_id is None)
+            if event_id is not None and plan["image_paths"]:
+                _attach_images_to_event(cursor, event_id, plan["image_paths"])
+        for device_id in written:
+            row_ids[device_id] = _upsert_device(cursor, device_id, latest[device_id])
+        _update_alarm_rollups(
+            cursor,
+            [(plan["device_id"], plan["now"], plan["alarm"]) for plan in plans if plan["device_id"] in written],
+        )
+    if deferred:
+        _heartbeats.add(deferred)
+    return row_ids
+
+
+def set_devices_offline(device_ids):
+    # Buffered heartbeats still carry online_status = 1 and must land first.
+    with _writer_with_heartbeats() as conn:
+        conn.executemany(
+            "UPDATE devices SET online_status = 0 WHERE device_id = ?",
+            [(device_id,) for device_id in device_ids],
+        )
+
+
+def get_all_devices():
+    with _pool.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM devices")
+        rows = cursor.fetchall()
     return _rows_to_dicts(rows)
 
 
-def get_device_alarm_trend(device_id, limit=TREND_LIMIT):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT strftime('%H:%M', timestamp) as minute,
-               SUM(CASE WHEN alarm = 1 THEN 1 ELSE 0 END) as alarm_count
-        FROM (
+def get_device_history_raw(device_id, limit=HISTORY_LIMIT):
+    """Latest samples for a device, newest first.
+
+    In ``transitions`` storage mode raw rows only hold state edges, so the
+    view is rebuilt per minute from the heartbeat counters instead: one
+    entry per active minute, alarming if any sample in it was.
+    """
+    if ALARM_STORAGE_MODE == "transitions":
+        with _pool.reader() as conn:
+            rows = conn.execute(
+                """
+                SELECT bucket, samples, alarm_count
+                FROM alarm_rollup_minute
+                WHERE device_id = ?
+                ORDER BY bucket DESC
+                LIMIT ?
+                """,
+                (device_id, limit),
+            ).fetchall()
+        return [
+            {
+                "alarm": 1 if row["alarm_count"] else 0,
+                "timestamp": parse_ms(row["bucket"]),
+                "samples": row["samples"],
+                "alarm_count": row["alarm_count"],
+            }
+            for row in rows
+        ]
+    with _pool.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
             SELECT alarm, timestamp
             FROM alarms
             WHERE device_id = ?
             ORDER BY timestamp DESC
             LIMIT ?
+            """,
+            (device_id, limit),
         )
-        GROUP BY minute
-        ORDER BY minute ASC
-        """,
-        (device_id, limit),
-    )
-    rows = cursor.fetchall()
-    conn.close()
+        rows = cursor.fetchall()
+    return _rows_to_dicts(rows)
+
+
+def get_device_alarm_trend(device_id, limit=TREND_LIMIT):
+    """Alarm counts for the device's ``limit`` most recent active minutes."""
+    with _pool.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT bucket, alarm_count
+            FROM alarm_rollup_minute
+            WHERE device_id = ?
+            ORDER BY bucket DESC
+            LIMIT ?
+            """,
+            (device_id, limit),
+        )
+        rows = cursor.fetchall()
+    rows = list(reversed(rows))
     return {
-        "labels": [row["minute"] for row in rows],
+        "labels": [row["bucket"][11:16] for row in rows],
         "counts": [row["alarm_count"] for row in rows],
     }
 
 
-def get_device_alarm_hourly_today(device_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT strftime('%H', timestamp) AS hour, COUNT(*) AS alarm_count
-        FROM alarms
-        WHERE device_id = ?
-          AND alarm = 1
-          AND date(timestamp) = date('now', 'localtime')
-        GROUP BY hour
-        ORDER BY hour ASC
-        """,
-        (device_id,),
-    )
-    rows = cursor.fetchall()
-    conn.close()
-    labels = [f"{h:02d}:00" for h in range(24)]
+def _hourly_counts(rows):
     counts = [0 for _ in range(24)]
     for row in rows:
         try:
-            hour_idx = int(row["hour"])
+            hour_idx = int(row["bucket"][11:13])
         except (TypeError, ValueError):
             continue
         if 0 <= hour_idx <= 23:
             counts[hour_idx] = int(row["alarm_count"] or 0)
-    return {"labels": labels, "counts": counts}
+    return counts
+
+
+def _bucket_range(day, days=1):
+    """Half-open ``[start, end)`` rollup bucket keys covering ``days`` local days from ``day``."""
+    return day.strftime("%Y-%m-%d"), (day + timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+def get_device_alarm_hourly_today(device_id):
+    start, end = _bucket_range(datetime.now().date())
+    with _pool.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT bucket, alarm_count
+            FROM alarm_rollup_hour
+            WHERE device_id = ?
+              AND bucket >= ? AND bucket < ?
+            """,
+            (device_id, start, end),
+        )
+        rows = cursor.fetchall()
+    labels = [f"{h:02d}:00" for h in range(24)]
+    return {"labels": labels, "counts": _hourly_counts(rows)}
 
 
 def get_alarm_hourly_today_yesterday():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT strftime('%H', timestamp) AS hour, COUNT(*) AS alarm_count
-        FROM alarms
-        WHERE alarm = 1
-          AND date(timestamp) = date('now', 'localtime')
-        GROUP BY hour
-        ORDER BY hour ASC
-        """
-    )
-    today_rows = cursor.fetchall()
-    cursor.execute(
-        """
-        SELECT strftime('%H', timestamp) AS hour, COUNT(*) AS alarm_count
-        FROM alarms
-        WHERE alarm = 1
-          AND date(timestamp) = date('now', 'localtime', '-1 day')
-        GROUP BY hour
-        ORDER BY hour ASC
-        """
-    )
-    yesterday_rows = cursor.fetchall()
-    conn.close()
+    today = datetime.now().date()
+    start, end = _bucket_range(today - timedelta(days=1), days=2)
+    with _pool.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT bucket, SUM(alarm_count) AS alarm_count
+            FROM alarm_rollup_hour
+            WHERE bucket >= ? AND bucket < ?
+            GROUP BY bucket
+            """,
+            (start, end),
+        )
+        rows = cursor.fetchall()
+    today_key = today.strftime("%Y-%m-%d")
     labels = [f"{h:02d}:00" for h in range(24)]
-    today_counts = [0 for _ in range(24)]
-    yesterday_counts = [0 for _ in range(24)]
-    for rows, counts in ((today_rows, today_counts), (yesterday_rows, yesterday_counts)):
-        for row in rows:
-            try:
-                hour_idx = int(row["hour"])
-            except (TypeError, ValueError):
-                continue
-            if 0 <= hour_idx <= 23:
-                counts[hour_idx] = int(row["alarm_count"] or 0)
+    today_counts = _hourly_counts(row for row in rows if row["bucket"][:10] == today_key)
+    yesterday_counts = _hourly_counts(row for row in rows if row["bucket"][:10] != today_key)
     return {"labels": labels, "today_counts": today_counts, "yesterday_counts": yesterday_counts}
 
 
@@ -421,76 +968,70 @@ def get_alarm_trend_multi_device(range_type, device_ids):
     range_type = (range_type or "day").lower()
     if range_type not in ("day", "week", "month"):
         range_type = "day"
-    conn = get_db_connection()
-    cursor = conn.cursor()
     placeholders = ",".join(["?"] * len(device_ids))
     series = {device_id: [] for device_id in device_ids}
+    end_date = datetime.now().date()
     if range_type == "day":
         labels = [f"{h}:00" for h in range(24)]
+        start, end = _bucket_range(end_date)
+        with _pool.reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT device_id, bucket, alarm_count
+                FROM alarm_rollup_hour
+                WHERE device_id IN ({placeholders})
+                  AND bucket >= ? AND bucket < ?
+                """,
+                tuple(device_ids) + (start, end),
+            )
+            rows = cursor.fetchall()
         for device_id in device_ids:
-            series[device_id] = [0 for _ in range(24)]
-        cursor.execute(
-            f"""
-            SELECT device_id, strftime('%H', timestamp) AS hour, COUNT(*) AS alarm_count
-            FROM alarms
-            WHERE alarm = 1
-              AND device_id IN ({placeholders})
-              AND date(timestamp) = date('now', 'localtime')
-            GROUP BY device_id, hour
-            ORDER BY device_id, hour ASC
-            """,
-            tuple(device_ids),
-        )
-        rows = cursor.fetchall()
-        conn.close()
-        for row in rows:
-            try:
-                hour_idx = int(row["hour"])
-            except (TypeError, ValueError):
-                continue
-            if 0 <= hour_idx <= 23:
-                series[row["device_id"]][hour_idx] = int(row["alarm_count"] or 0)
+            series[device_id] = _hourly_counts(row for row in rows if row["device_id"] == device_id)
         return {"labels": labels, "series": series}
     days = 7 if range_type == "week" else 30
-    end_date = datetime.now().date()
     start_date = end_date - timedelta(days=days - 1)
     date_keys = [(start_date + timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(days)]
     labels = [(start_date + timedelta(days=offset)).strftime("%m-%d") for offset in range(days)]
     for device_id in device_ids:
         series[device_id] = [0 for _ in range(days)]
-    cursor.execute(
-        f"""
-        SELECT device_id, date(timestamp) AS day, COUNT(*) AS alarm_count
-        FROM alarms
-        WHERE alarm = 1
-          AND device_id IN ({placeholders})
-          AND date(timestamp) >= ?
-        GROUP BY device_id, day
-        ORDER BY device_id, day ASC
-        """,
-        tuple(device_ids) + (start_date.strftime("%Y-%m-%d"),),
-    )
-    rows = cursor.fetchall()
-    conn.close()
+    start, end = _bucket_range(start_date, days=days)
+    with _pool.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""
+            SELECT device_id, bucket, alarm_count
+            FROM alarm_rollup_day
+            WHERE device_id IN ({placeholders})
+              AND bucket >= ? AND bucket < ?
+            """,
+            tuple(device_ids) + (start, end),
+        )
+        rows = cursor.fetchall()
     index_by_day = {d: i for i, d in enumerate(date_keys)}
     for row in rows:
-        idx = index_by_day.get(row["day"])
+        idx = index_by_day.get(row["bucket"])
         if idx is not None:
             series[row["device_id"]][idx] = int(row["alarm_count"] or 0)
     return {"labels": labels, "series": series}
 
 
-def save_alarm_image(device_id, image_path, timestamp):
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def _insert_alarm_image(cursor, device_id, image_path, timestamp, phash=None, link=True):
     cursor.execute(
         """
         INSERT OR IGNORE INTO alarm_images
             (device_id, image_path, timestamp, description_status)
         VALUES (?, ?, ?, ?)
+        RETURNING id
         """,
         (device_id, image_path, timestamp, "pending"),
     )
+    row = cursor.fetchone()
+    if row:
+        if link:
+            _link_image_to_event(cursor, row["id"], device_id, timestamp)
+        if phash is not None:
+            _link_duplicate_image(cursor, row["id"], device_id, timestamp, phash)
     cursor.execute(
         """
         UPDATE alarm_images
@@ -500,114 +1041,373 @@ def save_alarm_image(device_id, image_path, timestamp):
         """,
         (image_path,),
     )
-    conn.commit()
-    conn.close()
 
 
-def mark_alarm_image_description(image_id, description, model_name):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def _link_image_to_event(cursor, image_id, device_id, timestamp):
+    """Attach a new image to the device's latest alarm raise at or before ``timestamp``.
+
+    Only a guess for images no raise has claimed yet: devices upload a
+    burst before the raise that lists it, and ``_attach_images_to_event``
+    moves such images once that raise arrives.
+    """
     cursor.execute(
         """
-        UPDATE alarm_images
-        SET description = ?,
-            description_status = 'done',
-            description_model = ?,
-            description_updated_at = ?,
-            description_error = NULL
-        WHERE id = ?
+        SELECT e.id, e.image_id, ai.timestamp AS image_ts
+        FROM alarm_events e
+        LEFT JOIN alarm_images ai ON ai.id = e.image_id
+        WHERE e.device_id = ? AND e.timestamp <= ?
+        ORDER BY e.timestamp DESC
+        LIMIT 1
         """,
-        (description, model_name, now_str, image_id),
+        (device_id, timestamp),
     )
-    conn.commit()
-    conn.close()
+    event = cursor.fetchone()
+    if event is None:
+        return
+    cursor.execute("UPDATE alarm_images SET event_id = ? WHERE id = ?", (event["id"], image_id))
+    if event["image_id"] is None or (event["image_ts"] or 0) <= timestamp:
+        cursor.execute("UPDATE alarm_events SET image_id = ? WHERE id = ?", (image_id, event["id"]))
 
 
-def mark_alarm_image_failed(image_id, error_msg, model_name):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute(
+def _attach_images_to_event(cursor, event_id, image_paths):
+    """Link the images a raise carries to its event, including rows that already exist.
+
+    Images the timestamp guess had attached to an earlier raise are moved,
+    and ``image_id`` is recomputed for every event involved.
+    """
+    placeholders = ",".join("?" for _ in image_paths)
+    rows = cursor.execute(
+        f"SELECT id, event_id FROM alarm_images WHERE image_path IN ({placeholders})",
+        list(image_paths),
+    ).fetchall()
+    if not rows:
+        return
+    event_ids = {event_id} | {row["event_id"] for row in rows if row["event_id"] is not None}
+    cursor.executemany(
+        "UPDATE alarm_images SET event_id = ? WHERE id = ?",
+        [(event_id, row["id"]) for row in rows],
+    )
+    cursor.executemany(
         """
-        UPDATE alarm_images
-        SET description_status = 'failed',
-            description_model = ?,
-            description_updated_at = ?,
-            description_error = ?
+        UPDATE alarm_events
+        SET image_id = (
+            SELECT ai.id FROM alarm_images ai
+            WHERE ai.event_id = alarm_events.id
+            ORDER BY ai.timestamp DESC, ai.id DESC
+            LIMIT 1
+        )
         WHERE id = ?
         """,
-        (model_name, now_str, error_msg, image_id),
+        [(eid,) for eid in event_ids],
     )
-    conn.commit()
-    conn.close()
 
 
-def get_pending_alarm_images(limit=10):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    retry_before_str = (datetime.now() - timedelta(seconds=LLM_RETRY_INTERVAL_SEC)).strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute(
+class _DedupStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {"hashed": 0, "unhashable": 0, "reused": 0, "linked": 0, "propagated": 0, "released": 0}
+
+    def add(self, key, count=1):
+        if count:
+            with self._lock:
+                self._stats[key] += count
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+        data["enabled"] = LLM_DEDUP_ENABLED
+        data["max_distance"] = LLM_DEDUP_MAX_DISTANCE
+        data["window_sec"] = LLM_DEDUP_WINDOW_SEC
+        return data
+
+
+_dedup = _DedupStats()
+
+
+def image_dedup_stats():
+    return _dedup.stats()
+
+
+def _link_duplicate_image(cursor, image_id, device_id, timestamp, phash):
+    """Point a new image at a near-identical earlier frame of the same burst.
+
+    If that frame is already described the description is copied now;
+    otherwise the image waits (excluded from the pending queue) until
+    ``mark_alarm_image_description`` propagates it.
+    """
+    cursor.execute("UPDATE alarm_images SET phash = ? WHERE id = ?", (phash, image_id))
+    window_ms = LLM_DEDUP_WINDOW_SEC * 1000
+    event_id = cursor.execute("SELECT event_id FROM alarm_images WHERE id = ?", (image_id,)).fetchone()[0]
+    candidates = cursor.execute(
         """
-        SELECT id, device_id, image_path, timestamp, description_status, description_updated_at
+        SELECT id, phash, event_id, description, description_status
         FROM alarm_images
-        WHERE description_status IS NULL
-           OR description_status = 'pending'
-           OR (description_status = 'failed' AND (description_updated_at IS NULL OR description_updated_at < ?))
-        ORDER BY id ASC
-        LIMIT ?
+        WHERE device_id = ? AND timestamp BETWEEN ? AND ?
+          AND id != ? AND phash IS NOT NULL AND derived_from IS NULL
         """,
-        (retry_before_str, limit),
-    )
-    rows = cursor.fetchall()
-    conn.close()
+        (device_id, timestamp - window_ms, timestamp + window_ms, image_id),
+    ).fetchall()
+    best = None
+    for candidate in candidates:
+        if event_id is not None and candidate["event_id"] is not None and candidate["event_id"] != event_id:
+            continue
+        distance = hamming_distance(phash, candidate["phash"])
+        if distance <= LLM_DEDUP_MAX_DISTANCE and (best is None or (distance, candidate["id"]) < best[0]):
+            best = ((distance, candidate["id"]), candidate)
+    if best is None:
+        return
+    source = best[1]
+    if source["description_status"] == "done":
+        cursor.execute(
+            """
+            UPDATE alarm_images
+            SET derived_from = ?, description = ?, description_status = 'done', description_model = 'phash',
+                description_updated_at = ?, description_error = NULL
+            WHERE id = ?
+            """,
+            (source["id"], source["description"], datetime.now().strftime("%Y-%m-%d %H:%M:%S"), image_id),
+        )
+        _dedup.add("reused")
+    else:
+        cursor.execute("UPDATE alarm_images SET derived_from = ? WHERE id = ?", (source["id"], image_id))
+        _dedup.add("linked")
+
+
+def _image_phash(image_path):
+    path = Path(image_path)
+    if not path.is_absolute():
+        path = ROOT_DIR / path
+    phash = perceptual_hash(path)
+    _dedup.add("hashed" if phash is not None else "unhashable")
+    return phash
+
+
+def save_alarm_image(device_id, image_path, timestamp):
+    # Hash before taking the write lock; decoding the file is the slow part.
+    phash = _image_phash(image_path) if LLM_DEDUP_ENABLED else None
+    with _pool.writer() as conn:
+        cursor = conn.cursor()
+        _insert_alarm_image(cursor, device_id, image_path, timestamp, phash)
+
+
+def mark_alarm_image_description(image_id, description, model_name):
+    mark_alarm_images_description([image_id], description, model_name)
+
+
+def mark_alarm_images_description(image_ids, description, model_name):
+    """Store one description on every image of a group (and on their waiting duplicates)."""
+    with _pool.writer() as conn:
+        cursor = conn.cursor()
+        now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        cursor.executemany(
+            """
+            UPDATE alarm_images
+            SET description = ?,
+                description_status = 'done',
+                description_model = ?,
+                description_updated_at = ?,
+                description_error = NULL
+            WHERE id = ?
+            """,
+            [(description, model_name, now_str, image_id) for image_id in image_ids],
+        )
+        propagated = 0
+        for image_id in image_ids:
+            cursor.execute(
+                """
+                UPDATE alarm_images
+                SET description = ?,
+                    description_status = 'done',
+                    description_model = 'phash',
+                    description_updated_at = ?,
+                    description_error = NULL
+                WHERE derived_from = ?
+                """,
+                (description, now_str, image_id),
+            )
+            propagated += cursor.rowcount
+        _dedup.add("propagated", propagated)
+
+
+def mark_alarm_image_failed(image_id, error_msg, model_name):
+    with _pool.writer() as conn:
+        cursor = conn.cursor()
+        now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        cursor.execute(
+            """
+            UPDATE alarm_images
+            SET description_status = 'failed',
+                description_model = ?,
+                description_updated_at = ?,
+                description_error = ?
+            WHERE id = ?
+            """,
+            (model_name, now_str, error_msg, image_id),
+        )
+        # Waiting duplicates are analyzed on their own rather than waiting for the retry.
+        cursor.execute(
+            "UPDATE alarm_images SET derived_from = NULL WHERE derived_from = ? AND description_status != 'done'",
+            (image_id,),
+        )
+        _dedup.add("released", cursor.rowcount)
+
+
+def get_pending_alarm_images(limit=10):
+    with _pool.reader() as conn:
+        cursor = conn.cursor()
+        retry_before_str = (datetime.now() - timedelta(seconds=LLM_RETRY_INTERVAL_SEC)).strftime("%Y-%m-%d %H:%M:%S")
+        cursor.execute(
+            """
+            SELECT id, device_id, image_path, timestamp, event_id, description_status, description_updated_at
+            FROM alarm_images
+            WHERE derived_from IS NULL
+              AND (description_status IS NULL
+                   OR description_status = 'pending'
+                   OR (description_status = 'failed' AND (description_updated_at IS NULL OR description_updated_at < ?)))
+            ORDER BY id ASC
+            LIMIT ?
+            """,
+            (retry_before_str, limit),
+        )
+        rows = cursor.fetchall()
     return _rows_to_dicts(rows)
 
 
+def get_pending_alarm_image_bursts(limit=10, max_images=LLM_BURST_MAX_IMAGES, window_sec=LLM_BURST_WINDOW_SEC):
+    """Pending images grouped into up to ``limit`` bursts, oldest burst first.
+
+    A burst is one device's frames (from the same alarm event when linked)
+    no more than ``window_sec`` after its first frame, capped at
+    ``max_images``. Frames cut off by the fetch limit join a later burst.
+    """
+    max_images = max(1, max_images)
+    window_ms = window_sec * 1000
+    items = get_pending_alarm_images(limit=limit * max_images)
+    bursts = []
+    open_bursts = {}
+    for item in sorted(items, key=lambda row: (row["device_id"] or "", row["timestamp"] or 0, row["id"])):
+        key = (item["device_id"], item["event_id"])
+        burst = open_bursts.get(key)
+        if burst is None or len(burst) >= max_images or (item["timestamp"] or 0) - (burst[0]["timestamp"] or 0) > window_ms:
+            burst = open_bursts[key] = []
+            bursts.append(burst)
+        burst.append(item)
+    bursts.sort(key=lambda burst: min(row["id"] for row in burst))
+    return bursts[:limit]
+
+
+def get_pending_alarm_image_backlog():
+    """Return ``(count, oldest_timestamp_ms)`` of images awaiting (re)analysis."""
+    with _pool.reader() as conn:
+        retry_before_str = (datetime.now() - timedelta(seconds=LLM_RETRY_INTERVAL_SEC)).strftime("%Y-%m-%d %H:%M:%S")
+        row = conn.execute(
+            """
+            SELECT COUNT(*), MIN(timestamp)
+            FROM alarm_images
+            WHERE derived_from IS NULL
+              AND (description_status IS NULL
+                   OR description_status = 'pending'
+                   OR (description_status = 'failed' AND (description_updated_at IS NULL OR description_updated_at < ?)))
+            """,
+            (retry_before_str,),
+        ).fetchone()
+    return row[0], row[1]
+
+
 def get_device_images(device_id, limit=20):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT id, image_path, timestamp,
-               description, description_status, description_model, description_updated_at
-        FROM alarm_images
-        WHERE device_id = ?
-        ORDER BY timestamp DESC
-        LIMIT ?
-        """,
-        (device_id, limit),
-    )
-    rows = cursor.fetchall()
-    conn.close()
+    with _pool.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT id, image_path, timestamp,
+                   description, description_status, description_model, description_updated_at
+            FROM alarm_images
+            WHERE device_id = ?
+            ORDER BY timestamp DESC
+            LIMIT ?
+            """,
+            (device_id, limit),
+        )
+        rows = cursor.fetchall()
     return _rows_to_dicts(rows)
 
 
 def get_latest_image(device_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT image_path, timestamp,
-               description, description_status, description_model, description_updated_at
-        FROM alarm_images
-        WHERE device_id = ?
-        ORDER BY timestamp DESC
-        LIMIT 1
-        """,
-        (device_id,),
-    )
-    row = cursor.fetchone()
-    conn.close()
+    with _pool.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT image_path, timestamp,
+                   description, description_status, description_model, description_updated_at
+            FROM alarm_images
+            WHERE device_id = ?
+            ORDER BY timestamp DESC
+            LIMIT 1
+            """,
+            (device_id,),
+        )
+        row = cursor.fetchone()
     return dict(row) if row else None
 
 
+def search_alarm_images(query, start_ms=None, end_ms=None, device_id=None, cursor=None, limit=20):
+    """Rank alarm images by how well their AI description matches ``query`` (bm25).
+
+    Returns ``{"items", "next_cursor", "mode"}``; ``mode`` is ``"like"`` when a
+    term is too short for the trigram index.
+    """
+    conditions = []
+    params = []
+    if start_ms is not None:
+        conditions.append("ai.timestamp >= ?")
+        params.append(start_ms)
+    if end_ms is not None:
+        conditions.append("ai.timestamp < ?")
+        params.append(end_ms)
+    if device_id:
+        conditions.append("ai.device_id = ?")
+        params.append(device_id)
+    after_score, after_id = decode_cursor(cursor)
+    columns = "ai.id, ai.device_id, ai.image_path, ai.timestamp, ai.description, ai.description_status"
+    with _pool.reader() as conn:
+        has_fts = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'alarm_images_fts'").fetchone()
+        match = build_match_query(query)
+        if match and has_fts:
+            mode = "fts"
+            where_clause = " AND ".join(["alarm_images_fts MATCH ?"] + conditions)
+            sql = f"""
+                SELECT * FROM (
+                    SELECT {columns}, bm25(alarm_images_fts) AS score
+                    FROM alarm_images_fts JOIN alarm_images ai ON ai.id = alarm_images_fts.rowid
+                    WHERE {where_clause}
+                )
+            """
+            params = [match] + params
+        else:
+            mode = "like"
+            for pattern in like_patterns(query):
+                conditions.append("(ai.description LIKE ? ESCAPE '\\' OR ai.device_id LIKE ? ESCAPE '\\')")
+                params.extend([pattern, pattern])
+            where_clause = " AND ".join(conditions) if conditions else "1=1"
+            sql = f"SELECT * FROM (SELECT {columns}, 0.0 AS score FROM alarm_images ai WHERE {where_clause})"
+        if after_id is not None:
+            sql += " WHERE score > ? OR (score = ? AND id < ?)"
+            params.extend([after_score, after_score, after_id])
+        sql += " ORDER BY score ASC, id DESC LIMIT ?"
+        params.append(limit + 1)
+        rows = _rows_to_dicts(conn.execute(sql, params).fetchall())
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1]["score"], rows[-1]["id"]) if has_more and rows else None
+    return {"items": rows, "next_cursor": next_cursor, "mode": mode}
+
+
 def save_base64_image(device_id, base64_data, timestamp):
     try:
         if "," in base64_data:
             _, base64_data = base64_data.split(",", 1)
         image_bytes = base64.b64decode(base64_data)
-        safe_timestamp = timestamp.replace(":", "-").replace(" ", "_")
+        safe_timestamp = format_ms(timestamp, "%Y-%m-%d_%H-%M-%S")
         filename = f"{device_id}_{safe_timestamp}.jpg"
         filepath = ALARMS_IMAGE_DIR / filename
         filepath.write_bytes(image_bytes)
@@ -618,124 +1418,114 @@ def save_base64_image(device_id, base64_data, timestamp):
 
 
 def init_device_positions():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT device_id FROM devices")
-    devices = cursor.fetchall()
-    for dev in devices:
-        device_id = dev["device_id"]
-        cursor.execute("SELECT pos_x, pos_y FROM devices WHERE device_id = ?", (device_id,))
-        row = cursor.fetchone()
-        if row and (row["pos_x"] is None or row["pos_x"] == 0):
-            cursor.execute(
-                "UPDATE devices SET pos_x = ?, pos_y = ? WHERE device_id = ?",
-                (random.uniform(0, 1920), random.uniform(0, 1080), device_id),
-            )
-    conn.commit()
-    conn.close()
+    with _pool.writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT device_id FROM devices")
+        devices = cursor.fetchall()
+        for dev in devices:
+            device_id = dev["device_id"]
+            cursor.execute("SELECT pos_x, pos_y FROM devices WHERE device_id = ?", (device_id,))
+            row = cursor.fetchone()
+            if row and (row["pos_x"] is None or row["pos_x"] == 0):
+                cursor.execute(
+                    "UPDATE devices SET pos_x = ?, pos_y = ? WHERE device_id = ?",
+                    (random.uniform(0, 1920), random.uniform(0, 1080), device_id),
+                )
 
 
 def update_device_position(device_id, pos_x, pos_y):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE devices SET pos_x = ?, pos_y = ? WHERE device_id = ?", (pos_x, pos_y, device_id))
-    conn.commit()
-    conn.close()
+    save_device_positions([(pos_x, pos_y, device_id)])
+
+
+def save_device_positions(rows):
+    """Write ``(pos_x, pos_y, device_id)`` rows in one transaction."""
+    with _pool.writer() as conn:
+        conn.executemany("UPDATE devices SET pos_x = ?, pos_y = ? WHERE device_id = ?", rows)
 
 
 def get_all_devices_with_positions():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT device_id, alarm_status, online_status, pos_x, pos_y, last_seen, error_count, boot_time, update_time
-        FROM devices
-        """
-    )
-    rows = cursor.fetchall()
-    conn.close()
+    with _pool.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT device_id, alarm_status, online_status, pos_x, pos_y, last_seen, error_count, boot_time, update_time
+            FROM devices
+            """
+        )
+        rows = cursor.fetchall()
     return _rows_to_dicts(rows)
 
 
 def get_recent_alarms(limit=5):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT a.id, a.device_id, a.timestamp, a.alarm,
-               (SELECT image_path FROM alarm_images ai
-                WHERE ai.device_id = a.device_id
-                ORDER BY ai.timestamp DESC LIMIT 1) as image_path,
-               (SELECT description FROM alarm_images ai
-                WHERE ai.device_id = a.device_id
-                ORDER BY ai.timestamp DESC LIMIT 1) as image_description,
-               (SELECT description_status FROM alarm_images ai
-                WHERE ai.device_id = a.device_id
-                ORDER BY ai.timestamp DESC LIMIT 1) as image_description_status
-        FROM alarms a
-        WHERE a.alarm = 1
-        ORDER BY a.timestamp DESC
-        LIMIT ?
-        """,
-        (limit,),
-    )
-    rows = cursor.fetchall()
-    conn.close()
+    """Latest alarm raises with their most recent image, newest first."""
+    with _pool.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT e.id, e.device_id, e.timestamp, 1 AS alarm, e.session_id,
+                   ai.image_path,
+                   ai.description AS image_description,
+                   ai.description_status AS image_description_status
+            FROM alarm_events e
+            LEFT JOIN alarm_images ai ON ai.id = e.image_id
+            ORDER BY e.timestamp DESC
+            LIMIT ?
+            """,
+            (limit,),
+        )
+        rows = cursor.fetchall()
     return _rows_to_dicts(rows)
 
 
 def get_alarm_sessions(device_id, limit=20):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT id, device_id, start_time, end_time, duration_sec, status
-        FROM alarm_sessions
-        WHERE device_id = ?
-        ORDER BY id DESC
-        LIMIT ?
-        """,
-        (device_id, limit),
-    )
-    rows = cursor.fetchall()
-    conn.close()
+    with _pool.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT id, device_id, start_time, end_time, duration_sec, status
+            FROM alarm_sessions
+            WHERE device_id = ?
+            ORDER BY id DESC
+            LIMIT ?
+            """,
+            (device_id, limit),
+        )
+        rows = cursor.fetchall()
     return _rows_to_dicts(rows)
 
 
 def get_active_alarm_session(device_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT id, device_id, start_time, end_time, duration_sec, status
-        FROM alarm_sessions
-        WHERE device_id = ? AND status = 0
-        ORDER BY id DESC
-        LIMIT 1
-        """,
-        (device_id,),
-    )
-    row = cursor.fetchone()
-    conn.close()
+    with _pool.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT id, device_id, start_time, end_time, duration_sec, status
+            FROM alarm_sessions
+            WHERE device_id = ? AND status = 0
+            ORDER BY id DESC
+            LIMIT 1
+            """,
+            (device_id,),
+        )
+        row = cursor.fetchone()
     return dict(row) if row else None
 
 
 def get_alarm_duration_stats(device_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT COUNT(*) as total_sessions,
-               AVG(duration_sec) as avg_duration,
-               MAX(duration_sec) as max_duration,
-               SUM(duration_sec) as total_duration
-        FROM alarm_sessions
-        WHERE device_id = ? AND status = 1
-        """,
-        (device_id,),
-    )
-    row = cursor.fetchone()
-    conn.close()
+    with _pool.reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT COUNT(*) as total_sessions,
+                   AVG(duration_sec) as avg_duration,
+                   MAX(duration_sec) as max_duration,
+                   SUM(duration_sec) as total_duration
+            FROM alarm_sessions
+            WHERE device_id = ? AND status = 1
+            """,
+            (device_id,),
+        )
+        row = cursor.fetchone()
     if not row:
         return {"total_sessions": 0, "avg_duration": 0, "max_duration": 0, "total_duration": 0}
     return {
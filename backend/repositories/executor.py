@@ -0,0 +1,34 @@
+"""Async facade: run blocking repository work on a bounded DB thread pool."""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from config import DB_CALL_TIMEOUT_SEC, DB_EXECUTOR_WORKERS
+
+_executor = ThreadPoolExecutor(max_workers=max(1, DB_EXECUTOR_WORKERS), thread_name_prefix="db")
+
+
+class DBTimeoutError(TimeoutError):
+    """A repository call did not finish within its deadline."""
+
+
+async def run_db(func, *args, timeout=DB_CALL_TIMEOUT_SEC, **kwargs):
+    """Run ``func(*args, **kwargs)`` on the DB executor so the event loop never blocks on disk.
+
+    The caller stops waiting after ``timeout`` seconds; the worker thread
+    finishes the call in the background since SQLite work cannot be
+    interrupted safely.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+    try:
+        return await asyncio.wait_for(future, timeout=timeout)
+    except asyncio.TimeoutError as exc:
+        raise DBTimeoutError(f"{getattr(func, '__name__', func)} timed out after {timeout}s") from exc
+
+
+def shutdown(wait=True):
+    _executor.shutdown(wait=wait)
@@ -0,0 +1,96 @@
+"""Long-lived SQLite connections for the repository layer.
+
+One writer connection is shared behind a lock (SQLite only allows a single
+writer anyway) and every thread gets its own read-only connection. PRAGMAs
+are applied once per connection, and because connections are never closed
+between calls, ``sqlite3``'s per-connection statement cache keeps prepared
+statements around for reuse.
+"""
+
+from __future__ import annotations
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from config import (
+    DB_BUSY_TIMEOUT_MS,
+    DB_CACHE_SIZE_KB,
+    DB_CACHED_STATEMENTS,
+    DB_MMAP_SIZE_MB,
+    DB_SYNCHRONOUS,
+    DB_TEMP_STORE,
+)
+
+
+class ConnectionPool:
+    def __init__(self, path):
+        self.path = path
+        self._writer = None
+        self._writer_lock = threading.RLock()
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+
+    def _connect(self, read_only=False):
+        conn = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            cached_statements=DB_CACHED_STATEMENTS,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS};")
+        if not read_only:
+            # Must precede the first write to a new file; existing databases need a one-off VACUUM to switch.
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+            conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS};")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB};")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE_MB * 1024 * 1024};")
+        conn.execute(f"PRAGMA temp_store={DB_TEMP_STORE};")
+        if read_only:
+            conn.execute("PRAGMA query_only=ON;")
+        return conn
+
+    @contextmanager
+    def writer(self):
+        """Serialize writes on the shared writer; commit on success, roll back on error."""
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            conn = self._writer
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    @contextmanager
+    def reader(self):
+        """Yield this thread's read-only connection."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self._writer is None:
+                # Let the writer create the file and switch it to WAL first.
+                with self.writer():
+                    pass
+            conn = self._connect(read_only=True)
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        yield conn
+
+    def close_all(self):
+        with self._readers_lock:
+            readers, self._readers = self._readers, []
+        for conn in readers:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                pass
+        self._local = threading.local()
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
@@ -9,13 +9,22 @@ from pathlib import Path
 
 from fastapi import HTTPException, UploadFile
 
-from config import ALLOWED_IMAGE_EXTENSIONS, HISTORY_LIMIT, MAX_IMAGE_SIZE_MB, TREND_LIMIT
-from llm_client import analyze_alarm_image
-from logger import get_logs_by_page, log_event
+from config import ALLOWED_IMAGE_EXTENSIONS, HISTORY_LIMIT, MAX_IMAGE_SIZE_MB, OFFLINE_TIMEOUT_SEC, TREND_LIMIT
+from llm_client import analyze_alarm_image, analyze_alarm_images
+from logger import get_logs_by_page, log_event, search_logs
+from timeutil import format_fields, format_ms, now_ms, parse_ms
 from backend.paths import ALARMS_IMAGE_DIR, ROOT_DIR
 from backend.repositories import database as repo
+from backend.repositories.executor import run_db
+from backend.services.device_state import DeviceStateTable
 
 DEVICE_IDS = ["FORK-001", "FORK-002", "FORK-003"]
+POSITION_FIELDS = ("device_id", "alarm_status", "online_status", "pos_x", "pos_y", "last_seen", "error_count", "boot_time", "update_time")
+# Epoch-ms fields formatted to local time strings when building responses.
+DEVICE_TIME_FIELDS = ("boot_time", "last_seen", "update_time", "alarm_start_time")
+SESSION_TIME_FIELDS = ("start_time", "end_time")
+
+device_state = DeviceStateTable(repo.load_device_state, offline_timeout_ms=OFFLINE_TIMEOUT_SEC * 1000)
 
 
 def sanitize_device_id(device_id: str) -> str:
@@ -32,7 +41,7 @@ def allowed_image_file(filename: str) -> bool:
 
 
 def decorate_alarm_records(alarms, devices=None):
-    devices = devices or {d["device_id"]: d for d in repo.get_all_devices_with_positions()}
+    devices = devices or {d["device_id"]: d for d in device_state.devices()}
     for alarm in alarms:
         device = devices.get(alarm["device_id"], {})
         pos_x = device.get("pos_x", 0) or 0
@@ -43,15 +52,49 @@ def decorate_alarm_records(alarms, devices=None):
             alarm["zone"] = "B区" if pos_y < 500 else "D区"
         alarm["description"] = alarm.pop("image_description", None)
         alarm["description_status"] = alarm.pop("image_description_status", None)
+        format_fields(alarm, ("timestamp",))
     return alarms
 
 
-def get_latest_payload():
-    return repo.get_latest_data_with_stats()
+def get_latest_payload(device_ids=None):
+    """Device list plus fleet stats; ``device_ids`` limits the list (stats still cover every device)."""
+    entries = device_state.devices()
+    devices = entries if device_ids is None else [dev for dev in entries if dev["device_id"] in device_ids]
+    now = now_ms()
+    for dev in devices:
+        start_time = dev.get("alarm_start_time")
+        if dev.get("alarm_status") == 1 and start_time:
+            dev["current_duration_sec"] = max(0, (now - start_time) / 1000)
+        else:
+            dev["alarm_start_time"] = None
+            dev["current_duration_sec"] = None
+        format_fields(dev, DEVICE_TIME_FIELDS)
+    total = len(entries)
+    online = sum(1 for d in entries if d["online_status"] == 1)
+    alarm = sum(1 for d in entries if d["alarm_status"] == 1 and d["online_status"] == 1)
+    return {"devices": devices, "stats": {"total": total, "online": online, "alarm": alarm}}
 
 
-def get_logs_payload(page: int, page_size: int, level: str | None, device_id: str | None, category: str | None):
-    return get_logs_by_page(page, page_size, level, device_id, category)
+def get_logs_payload(page: int, page_size: int, level: str | None, device_id: str | None, category: str | None,
+                     before_id: int | None = None, after_id: int | None = None):
+    return get_logs_by_page(page, page_size, level, device_id, category, before_id=before_id, after_id=after_id)
+
+
+def search_payload(q: str, scope: str, start: str | None, end: str | None, device_id: str | None,
+                   category: str | None, cursor: str | None, limit: int):
+    start_ms = parse_ms(start) if start else None
+    end_ms = parse_ms(end) if end else None
+    if (start and start_ms is None) or (end and end_ms is None):
+        raise HTTPException(status_code=400, detail="时间格式错误，请使用 YYYY-MM-DD HH:MM:SS")
+    try:
+        if scope == "images":
+            result = repo.search_alarm_images(q, start_ms, end_ms, device_id, cursor, limit)
+            result["items"] = [format_fields(item, ("timestamp",)) for item in result["items"]]
+        else:
+            result = search_logs(q, format_ms(start_ms), format_ms(end_ms), category, device_id, cursor, limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的cursor")
+    return {"query": q, "scope": scope, **result}
 
 
 def get_device_history_payload(device_id: str):
@@ -63,7 +106,7 @@ def get_device_history_payload(device_id: str):
         alarm_value = 1 if item.get("alarm") == 1 else 0
         history.append(
             {
-                "timestamp": item.get("timestamp", ""),
+                "timestamp": format_ms(item.get("timestamp")) or "",
                 "alarm": alarm_value,
                 "alarm_status": alarm_value,
                 "event": "报警" if alarm_value == 1 else "正常",
@@ -80,26 +123,53 @@ def get_device_history_payload(device_id: str):
 
 
 def get_device_images_payload(device_id: str, limit: int):
-    return {"device_id": device_id, "images": repo.get_device_images(device_id, limit=limit)}
+    images = repo.get_device_images(device_id, limit=limit)
+    return {"device_id": device_id, "images": [format_fields(image, ("timestamp",)) for image in images]}
 
 
 def get_device_latest_image_payload(device_id: str):
-    return repo.get_latest_image(device_id) or {}
+    image = repo.get_latest_image(device_id)
+    return format_fields(image, ("timestamp",)) if image else {}
+
+
+def expire_offline_devices():
+    """Mark every device past its offline deadline offline in one transaction."""
+    return device_state.expire_offline(now_ms(), repo.set_devices_offline)
+
+
+def simulate_position_step(move_range: float):
+    """Random-walk every online device in memory (test/demo positions)."""
+    return device_state.positions.random_walk(move_range)
+
+
+def reload_positions():
+    """Pick up positions another process wrote to SQLite (``POSITION_MOVE_RANGE <= 0``)."""
+    device_state.positions.refresh(repo.get_all_devices_with_positions())
+
+
+def flush_positions():
+    """Write positions that moved since the last flush in one transaction."""
+    return device_state.positions.flush(repo.save_device_positions)
 
 
 def get_devices_payload():
-    return {"devices": repo.get_all_devices_with_positions()}
+    return {
+        "devices": [
+            format_fields({field: dev.get(field) for field in POSITION_FIELDS}, DEVICE_TIME_FIELDS)
+            for dev in device_state.devices()
+        ]
+    }
 
 
 def get_recent_alarms_payload(limit: int):
     alarms = repo.get_recent_alarms(limit=limit)
-    devices = {d["device_id"]: d for d in repo.get_all_devices_with_positions()}
+    devices = {d["device_id"]: d for d in device_state.devices()}
     return {"alarms": decorate_alarm_records(alarms, devices)}
 
 
 def get_history_payload(limit: int):
     alarms = repo.get_recent_alarms(limit=limit)
-    devices = {d["device_id"]: d for d in repo.get_all_devices_with_positions()}
+    devices = {d["device_id"]: d for d in device_state.devices()}
     return {"items": decorate_alarm_records(alarms, devices)}
 
 
@@ -113,11 +183,11 @@ def get_device_alarm_sessions_payload(device_id: str, limit: int):
     active = repo.get_active_alarm_session(device_id)
     current_duration = None
     if active:
-        start_dt = datetime.strptime(active["start_time"], "%Y-%m-%d %H:%M:%S")
-        current_duration = (datetime.now() - start_dt).total_seconds()
+        current_duration = (now_ms() - active["start_time"]) / 1000
+        format_fields(active, SESSION_TIME_FIELDS)
     return {
         "device_id": device_id,
-        "sessions": sessions,
+        "sessions": [format_fields(session, SESSION_TIME_FIELDS) for session in sessions],
         "stats": stats,
         "active_session": active,
         "current_duration_sec": round(current_duration, 1) if current_duration else None,
@@ -160,7 +230,7 @@ async def save_uploaded_images(device_id: str, image_files: list[UploadFile], ba
     except json.JSONDecodeError:
         raise HTTPException(status_code=400, detail="image_timestamps JSON解析失败")
 
-    image_urls = []
+    uploads = []
     max_size_bytes = MAX_IMAGE_SIZE_MB * 1024 * 1024
     for idx, image_file in enumerate(image_files):
         if not allowed_image_file(image_file.filename or ""):
@@ -169,17 +239,23 @@ async def save_uploaded_images(device_id: str, image_files: list[UploadFile], ba
         if len(content) > max_size_bytes:
             raise HTTPException(status_code=400, detail=f"文件大小超过{MAX_IMAGE_SIZE_MB}MB限制")
         ts = timestamps[idx]
-        ts_str = ts.strftime("%Y-%m-%d %H:%M:%S")
         safe_ts = ts.strftime("%Y-%m-%d_%H-%M-%S")
         ext = (image_file.filename or "jpg").rsplit(".", 1)[1].lower()
-        filename = f"{device_id}_{safe_ts}_{idx}.{ext}"
+        uploads.append((f"{device_id}_{safe_ts}_{idx}.{ext}", content, int(ts.timestamp() * 1000)))
+    image_urls = await run_db(_persist_uploaded_images, device_id, uploads)
+    return {"image_urls": image_urls}
+
+
+def _persist_uploaded_images(device_id: str, uploads: list[tuple[str, bytes, int]]):
+    image_urls = []
+    for filename, content, ts_ms in uploads:
         filepath = ALARMS_IMAGE_DIR / filename
         filepath.write_bytes(content)
         image_path = str(Path("images") / "alarms" / filename)
-        repo.save_alarm_image(device_id, image_path, ts_str)
+        repo.save_alarm_image(device_id, image_path, ts_ms)
         log_event("INFO", "device.image.uploaded", "biz", "api", "Image uploaded via HTTP", device_id=device_id, extra={"image_path": image_path})
         image_urls.append(f"/images/alarms/{filename}")
-    return {"image_urls": image_urls}
+    return image_urls
 
 
 def resolve_local_image_path(image_path: str) -> Path | None:
@@ -192,39 +268,83 @@ def resolve_local_image_path(image_path: str) -> Path | None:
     return None
 
 
-def analyze_pending_images_batch(limit: int = 10):
-    for item in repo.get_pending_alarm_images(limit=limit):
-        image_path = item.get("image_path", "")
-        image_id = item.get("id")
-        device_id = item.get("device_id")
-        local_path = resolve_local_image_path(image_path)
+def analyze_pending_image(item) -> bool:
+    """Describe one pending alarm image and store the result; returns ``True`` on success."""
+    image_path = item.get("image_path", "")
+    image_id = item.get("id")
+    device_id = item.get("device_id")
+    local_path = resolve_local_image_path(image_path)
+    if not local_path or not local_path.exists():
+        repo.mark_alarm_image_failed(image_id, "Image not found", "filesystem")
+        return False
+    try:
+        analysis = analyze_alarm_image(str(local_path))
+        repo.mark_alarm_image_description(image_id, analysis, "llm")
+        log_event("INFO", "llm.image.analysis.generated", "biz", "llm", f"AI分析：{analysis}", device_id=device_id, extra={"image_path": image_path})
+        return True
+    except Exception as exc:
+        repo.mark_alarm_image_failed(image_id, str(exc), "llm")
+        log_event("ERROR", "llm.image.analysis.failed", "ops", "llm", "Alarm image analysis failed", device_id=device_id, error=str(exc), extra={"image_path": image_path})
+        return False
+
+
+def analyze_pending_burst(items) -> bool:
+    """Describe a burst of pending images with one multi-image request; returns ``True`` on success."""
+    frames = []
+    for item in items:
+        local_path = resolve_local_image_path(item.get("image_path", ""))
         if not local_path or not local_path.exists():
-            repo.mark_alarm_image_failed(image_id, "Image not found", "filesystem")
+            repo.mark_alarm_image_failed(item.get("id"), "Image not found", "filesystem")
             continue
-        try:
-            analysis = analyze_alarm_image(str(local_path))
-            repo.mark_alarm_image_description(image_id, analysis, "llm")
-            log_event("INFO", "llm.image.analysis.generated", "biz", "llm", f"AI分析：{analysis}", device_id=device_id, extra={"image_path": image_path})
-        except Exception as exc:
-            repo.mark_alarm_image_failed(image_id, str(exc), "llm")
-            log_event("ERROR", "llm.image.analysis.failed", "ops", "llm", "Alarm image analysis failed", device_id=device_id, error=str(exc), extra={"image_path": image_path})
+        frames.append((item, local_path))
+    if not frames:
+        return False
+    if len(frames) == 1:
+        return analyze_pending_image(frames[0][0])
+    device_id = frames[0][0].get("device_id")
+    image_paths = [item.get("image_path", "") for item, _ in frames]
+    try:
+        analysis = analyze_alarm_images([str(local_path) for _, local_path in frames])
+        repo.mark_alarm_images_description([item.get("id") for item, _ in frames], analysis, "llm")
+        log_event("INFO", "llm.image.analysis.generated", "biz", "llm", f"AI分析：{analysis}", device_id=device_id, extra={"image_paths": image_paths})
+        return True
+    except Exception as exc:
+        for item, _ in frames:
+            repo.mark_alarm_image_failed(item.get("id"), str(exc), "llm")
+        log_event("ERROR", "llm.image.analysis.failed", "ops", "llm", "Alarm image burst analysis failed", device_id=device_id, error=str(exc), extra={"image_paths": image_paths})
+        return False
 
 
-def process_mqtt_payload(topic: str, payload: dict):
+def _normalize_image_path(image_url) -> str:
+    image_url = str(image_url)
+    return image_url[1:] if image_url.startswith("/") else image_url
+
+
+def parse_mqtt_payload(topic: str, payload: dict):
+    """Extract the fields the ingest writer needs; no DB access.
+
+    ``timestamp`` is parsed to epoch ms here, once, or ``None`` if absent/invalid.
+    """
     topic_parts = topic.split("/")
     device_id = topic_parts[2] if len(topic_parts) >= 3 else payload.get("device_id", "unknown")
     alarm = payload.get("alarm", 0)
-    timestamp = payload.get("timestamp", "")
-    changed = repo.update_device_data(device_id=device_id, alarm=alarm, mqtt_timestamp=timestamp)
+    timestamp = parse_ms(payload.get("timestamp"))
+    image_paths = []
     image_urls = payload.get("image_urls", [])
     if alarm == 1 and isinstance(image_urls, list):
-        for image_url in image_urls:
-            if not isinstance(image_url, str):
-                continue
-            image_path = image_url[1:] if image_url.startswith("/") else image_url
-            repo.save_alarm_image(device_id, image_path, timestamp)
+        image_paths = [_normalize_image_path(url) for url in image_urls if isinstance(url, str)]
     elif alarm == 1 and payload.get("image_url"):
-        image_url = str(payload["image_url"])
-        image_path = image_url[1:] if image_url.startswith("/") else image_url
-        repo.save_alarm_image(device_id, image_path, timestamp)
-    log_event("INFO", "mqtt.message.processed", "biz", "mqtt", "MQTT message processed and DB updated", device_id=device_id, topic=topic, extra={"changed": changed})
+        image_paths = [_normalize_image_path(payload["image_url"])]
+    return {"topic": topic, "device_id": device_id, "alarm": alarm, "timestamp": timestamp, "image_paths": image_paths}
+
+
+def process_mqtt_batch(messages: list[dict]):
+    """Persist parsed MQTT messages in one transaction; returns per-message changes."""
+    results = device_state.apply_batch(messages, repo.write_mqtt_batch)
+    for message, changed in zip(messages, results):
+        log_event("INFO", "mqtt.message.processed", "biz", "mqtt", "MQTT message processed and DB updated", device_id=message["device_id"], topic=message["topic"], extra={"changed": changed})
+    return results
+
+
+def process_mqtt_payload(topic: str, payload: dict):
+    process_mqtt_batch([parse_mqtt_payload(topic, payload)])
@@ -0,0 +1,234 @@
+"""Authoritative in-process device state table.
+
+The table is loaded once from SQLite and then owns transition detection
+(online/alarm edges and alarm sessions); the database only receives writes.
+It also keeps a min-heap of offline deadlines (``last_seen`` + timeout) so
+expired devices are found without scanning the fleet, and owns the
+``PositionStore`` that holds every device's map position. All times are
+epoch milliseconds.
+"""
+
+from __future__ import annotations
+
+import heapq
+import threading
+
+from timeutil import now_ms
+from backend.services.positions import PositionStore
+
+DEVICE_FIELDS = (
+    "id",
+    "device_id",
+    "alarm_status",
+    "error_count",
+    "boot_time",
+    "last_seen",
+    "online_status",
+    "update_time",
+)
+
+
+class DeviceStateTable:
+    def __init__(self, loader, offline_timeout_ms=None):
+        self._loader = loader
+        self.offline_timeout_ms = offline_timeout_ms
+        # _lock guards the table for in-memory work only and is what readers take, so
+        # devices()/get() stay safe on the event loop. Mutators also hold _write_lock
+        # across their SQLite write; it orders commits and is never taken by readers.
+        self._lock = threading.RLock()
+        self._write_lock = threading.RLock()
+        self._devices = {}
+        self._loaded = False
+        # Lazy deadline heap: every key of _deadlines has exactly one (deadline, device_id)
+        # entry in the heap, whose deadline is <= the current one. Heartbeats only bump the
+        # dict; a stale entry is re-pushed when it reaches the top. None = went offline.
+        self._deadline_heap = []
+        self._deadlines = {}
+        # pos_x/pos_y live here rather than in the entries; devices()/get() merge them back in.
+        self.positions = PositionStore()
+
+    def load(self):
+        """(Re)load state from the database: ``loader() -> (devices, active_sessions)``."""
+        with self._write_lock:
+            devices, active_sessions = self._loader()
+            active_map = {row["device_id"]: row["start_time"] for row in active_sessions}
+            table = {}
+            for row in devices:
+                entry = {field: row.get(field) for field in DEVICE_FIELDS}
+                entry["alarm_start_time"] = active_map.get(entry["device_id"])
+                table[entry["device_id"]] = entry
+            deadlines = {}
+            if self.offline_timeout_ms is not None:
+                deadlines = {
+                    device_id: entry["last_seen"] + self.offline_timeout_ms
+                    for device_id, entry in table.items()
+                    if entry["online_status"] == 1 and entry["last_seen"]
+                }
+            heap = [(deadline, device_id) for device_id, deadline in deadlines.items()]
+            heapq.heapify(heap)
+            with self._lock:
+                self._devices = table
+                self._deadlines = deadlines
+                self._deadline_heap = heap
+                self.positions.load(devices)
+                self._loaded = True
+
+    def _touch_deadline(self, device_id, last_seen):
+        if self.offline_timeout_ms is None:
+            return
+        deadline = last_seen + self.offline_timeout_ms
+        if device_id not in self._deadlines:
+            heapq.heappush(self._deadline_heap, (deadline, device_id))
+        self._deadlines[device_id] = deadline
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    def _transition(self, staged, device_id, alarm, event_ms, now):
+        """Apply one message to the working copy of ``device_id`` in ``staged``."""
+        entry = staged.get(device_id)
+        if entry is None:
+            current = self._devices.get(device_id)
+            entry = staged[device_id] = dict(current) if current is not None else None
+        changed = {}
+        plan = {"device_id": device_id, "alarm": alarm, "now": now, "session_open": None, "session_close": None}
+        if entry is None:
+            entry = {field: None for field in DEVICE_FIELDS}
+            entry.update(
+                device_id=device_id,
+                alarm_status=0,
+                error_count=0,
+                boot_time=now,
+                online_status=0,
+                alarm_start_time=None,
+            )
+            staged[device_id] = entry
+            changed["online_marked"] = True
+        elif entry["online_status"] != 1:
+            entry["boot_time"] = now
+            changed["online_marked"] = True
+        old_alarm = entry["alarm_status"] or 0
+        if old_alarm == 0 and alarm == 1:
+            entry["error_count"] = (entry["error_count"] or 0) + 1
+            entry["alarm_start_time"] = event_ms or now
+            changed["alarm_raised"] = True
+            plan["session_open"] = entry["alarm_start_time"]
+        if old_alarm == 1 and alarm == 0:
+            changed["alarm_cleared"] = True
+            start_time = entry["alarm_start_time"]
+            if start_time:
+                end_time = event_ms or now
+                plan["session_close"] = (end_time, (end_time - start_time) / 1000)
+            entry["alarm_start_time"] = None
+        # Heartbeats that change nothing may skip the raw alarms row (transitions storage mode).
+        plan["transition"] = bool(changed) or alarm != old_alarm
+        entry["alarm_status"] = alarm
+        entry["online_status"] = 1
+        entry["last_seen"] = now
+        entry["update_time"] = now
+        plan["device"] = {
+            "alarm_status": entry["alarm_status"],
+            "error_count": entry["error_count"],
+            "boot_time": entry["boot_time"],
+            "last_seen": entry["last_seen"],
+            "online_status": 1,
+            "update_time": entry["update_time"],
+        }
+        return plan, changed
+
+    def apply_batch(self, messages, writer):
+        """Run transitions for ``messages`` and persist them via ``writer(plans)``.
+
+        ``writer`` returns ``{device_id: row_id}``. Transitions are staged on
+        copies and only swapped into the table once the writer returns, so a
+        failed write leaves the table untouched and readers never wait on the
+        SQLite transaction.
+        """
+        self._ensure_loaded()
+        now = now_ms()
+        with self._write_lock:
+            staged = {}
+            plans = []
+            results = []
+            with self._lock:
+                for message in messages:
+                    plan, changed = self._transition(staged, message["device_id"], message["alarm"], message["timestamp"], now)
+                    plan["image_paths"] = message.get("image_paths") or []
+                    plan["timestamp"] = message["timestamp"] or now
+                    plans.append(plan)
+                    results.append(changed)
+            row_ids = writer(plans) or {}
+            with self._lock:
+                for device_id, entry in staged.items():
+                    if device_id in row_ids:
+                        entry["id"] = row_ids[device_id]
+                    self._devices[device_id] = entry
+                    self._touch_deadline(device_id, entry["last_seen"])
+                for message, changed in zip(messages, results):
+                    if changed.get("online_marked"):
+                        self.positions.set_online(message["device_id"], True)
+        return results
+
+    def next_deadline(self):
+        """Earliest pending offline deadline (may be stale-early), or ``None``."""
+        with self._lock:
+            return self._deadline_heap[0][0] if self._deadline_heap else None
+
+    def expire_offline(self, now, writer):
+        """Mark every device whose deadline is ``<= now`` offline with one ``writer(device_ids)`` call.
+
+        Returns ``[(device_id, offline_seconds)]``; each heap pop is O(log n).
+        """
+        self._ensure_loaded()
+        with self._write_lock:
+            with self._lock:
+                heap = self._deadline_heap
+                expired = []
+                while heap and heap[0][0] <= now:
+                    deadline, device_id = heapq.heappop(heap)
+                    current = self._deadlines.get(device_id)
+                    if current is None or device_id not in self._devices:
+                        self._deadlines.pop(device_id, None)
+                    elif current > deadline:
+                        heapq.heappush(heap, (current, device_id))
+                    else:
+                        expired.append((deadline, device_id))
+                if not expired:
+                    return []
+            try:
+                writer([device_id for _, device_id in expired])
+            except Exception:
+                with self._lock:
+                    for item in expired:
+                        heapq.heappush(heap, item)
+                raise
+            result = []
+            with self._lock:
+                for _, device_id in expired:
+                    del self._deadlines[device_id]
+                    entry = self._devices[device_id]
+                    entry["online_status"] = 0
+                    self.positions.set_online(device_id, False)
+                    result.append((device_id, (now - entry["last_seen"]) / 1000))
+            return result
+
+    def get(self, device_id):
+        self._ensure_loaded()
+        with self._lock:
+            entry = self._devices.get(device_id)
+            if entry is None:
+                return None
+            entry = dict(entry)
+        entry["pos_x"], entry["pos_y"] = self.positions.get(device_id)
+        return entry
+
+    def devices(self):
+        """Return a snapshot copy of every device entry, positions included."""
+        self._ensure_loaded()
+        with self._lock:
+            entries = [dict(entry) for entry in self._devices.values()]
+        positions = self.positions.snapshot()
+        for entry in entries:
+            entry["pos_x"], entry["pos_y"] = positions.get(entry["device_id"], (0.0, 0.0))
+        return entries
@@ -0,0 +1,165 @@
+"""Batched group-commit ingest queue for MQTT messages."""
+
+from __future__ import annotations
+
+import queue
+import threading
+import time
+
+from config import INGEST_BATCH_SIZE, INGEST_MAX_LINGER_MS, INGEST_QUEUE_MAXSIZE
+from logger import log_event
+
+_STOP = object()
+# At most one queue-full warning per interval; it reports how many messages were dropped since the last one.
+DROP_LOG_INTERVAL_SEC = 10
+
+
+class IngestQueue:
+    """Single writer thread that drains parsed messages and applies them in batches.
+
+    ``apply_batch(messages)`` must apply all messages in one transaction and
+    return one result per message. ``on_batch(messages, results)`` is invoked
+    on the writer thread after every successful commit.
+    """
+
+    def __init__(self, apply_batch, on_batch=None, batch_size=INGEST_BATCH_SIZE,
+                 max_linger_ms=INGEST_MAX_LINGER_MS, maxsize=INGEST_QUEUE_MAXSIZE):
+        self.apply_batch = apply_batch
+        self.on_batch = on_batch
+        self.batch_size = max(1, batch_size)
+        self.max_linger_sec = max(0, max_linger_ms) / 1000.0
+        self._queue = queue.Queue(maxsize=max(0, maxsize))
+        self._thread = None
+        self._last_drop_log = 0.0
+        self._unlogged_drops = 0
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "processed": 0,
+            "dropped": 0,
+            "failed": 0,
+            "batches": 0,
+            "max_queue_depth": 0,
+            "last_batch_size": 0,
+            "last_commit_ms": 0.0,
+            "max_commit_ms": 0.0,
+            "total_commit_ms": 0.0,
+        }
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Flush queued messages and stop the writer thread."""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def submit(self, message):
+        """Enqueue a parsed message without blocking; drops it when the queue is full.
+
+        Called on the MQTT network thread, which must never wait here or
+        keepalives stall and the backlog grows.
+        """
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            now = time.monotonic()
+            with self._stats_lock:
+                self._stats["dropped"] += 1
+                self._unlogged_drops += 1
+                if now - self._last_drop_log < DROP_LOG_INTERVAL_SEC:
+                    return False
+                self._last_drop_log = now
+                dropped, self._unlogged_drops = self._unlogged_drops, 0
+            log_event("WARNING", "mqtt.ingest.queue_full", "ops", "ingest", "Ingest queue full, messages dropped", device_id=message.get("device_id"), extra={"dropped": dropped, "interval_sec": DROP_LOG_INTERVAL_SEC})
+            return False
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self._stats["enqueued"] += 1
+            if depth > self._stats["max_queue_depth"]:
+                self._stats["max_queue_depth"] = depth
+        return True
+
+    def stats(self):
+        with self._stats_lock:
+            data = dict(self._stats)
+        total_ms = data.pop("total_commit_ms")
+        data["avg_commit_ms"] = round(total_ms / data["batches"], 3) if data["batches"] else 0.0
+        data["queue_depth"] = self._queue.qsize()
+        data["batch_size"] = self.batch_size
+        data["max_linger_ms"] = int(self.max_linger_sec * 1000)
+        return data
+
+    def _collect_batch(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_linger_sec
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch, stopping = self._collect_batch(first)
+            self._flush(batch)
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        try:
+            results = self.apply_batch(batch)
+        except Exception as exc:
+            log_event("ERROR", "mqtt.ingest.batch_failed", "ops", "ingest", "Ingest batch commit failed, retrying per message", error=str(exc), extra={"batch_size": len(batch)})
+            self._flush_one_by_one(batch)
+            return
+        self._record_commit(len(batch), (time.perf_counter() - started) * 1000)
+        self._notify(batch, results)
+
+    def _flush_one_by_one(self, batch):
+        for message in batch:
+            started = time.perf_counter()
+            try:
+                results = self.apply_batch([message])
+            except Exception as exc:
+                with self._stats_lock:
+                    self._stats["failed"] += 1
+                log_event("ERROR", "mqtt.message.persist_failed", "ops", "ingest", "Failed to persist MQTT message", device_id=message.get("device_id"), error=str(exc))
+                continue
+            self._record_commit(1, (time.perf_counter() - started) * 1000)
+            self._notify([message], results)
+
+    def _record_commit(self, size, elapsed_ms):
+        with self._stats_lock:
+            self._stats["processed"] += size
+            self._stats["batches"] += 1
+            self._stats["last_batch_size"] = size
+            self._stats["last_commit_ms"] = round(elapsed_ms, 3)
+            self._stats["total_commit_ms"] += elapsed_ms
+            if elapsed_ms > self._stats["max_commit_ms"]:
+                self._stats["max_commit_ms"] = round(elapsed_ms, 3)
+
+    def _notify(self, batch, results):
+        if self.on_batch is None:
+            return
+        try:
+            self.on_batch(batch, results)
+        except Exception as exc:
+            log_event("ERROR", "mqtt.ingest.callback_failed", "ops", "ingest", "Ingest batch callback failed", error=str(exc))
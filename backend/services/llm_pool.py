@@ -0,0 +1,208 @@
+"""Concurrent worker pool for alarm image analysis."""
+
+from __future__ import annotations
+
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from config import LLM_CONCURRENCY, LLM_POLL_INTERVAL_SEC, LLM_PROVIDER, LLM_RATE_LIMIT_PER_MIN, LLM_TIMEOUT_SEC
+from logger import log_event
+from timeutil import now_ms
+
+THROUGHPUT_WINDOW_SEC = 60
+
+
+class RateLimiter:
+    """Token bucket allowing ``rate_per_min`` acquisitions per minute (0 disables the limit)."""
+
+    def __init__(self, rate_per_min, burst=None):
+        self.rate_per_sec = max(0, rate_per_min) / 60.0
+        self.capacity = float(burst if burst is not None else max(1, rate_per_min // 6))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, stop_event):
+        """Block until a token is available; returns the seconds waited, or ``None`` if stopping."""
+        if not self.rate_per_sec:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_sec)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate_per_sec
+            if stop_event.wait(delay):
+                return None
+            waited += delay
+
+
+class ImageAnalysisPool:
+    """Dispatcher thread feeding pending images to ``concurrency`` analysis workers.
+
+    ``fetch_pending(limit)`` returns up to ``limit`` work units (an image row
+    or a burst of rows), ``analyze(unit)`` handles one unit with a single LLM
+    request and returns ``True`` on success, ``unit_ids(unit)`` lists the
+    image ids a unit covers, and ``backlog()`` returns ``(pending_count,
+    oldest_timestamp_ms)``. Every request first takes a token from the
+    provider's ``RateLimiter``.
+    """
+
+    def __init__(self, fetch_pending, analyze, backlog, unit_ids=lambda item: (item["id"],), provider=LLM_PROVIDER,
+                 concurrency=LLM_CONCURRENCY, rate_per_min=LLM_RATE_LIMIT_PER_MIN, poll_interval_sec=LLM_POLL_INTERVAL_SEC):
+        self.fetch_pending = fetch_pending
+        self.analyze = analyze
+        self.backlog = backlog
+        self.unit_ids = unit_ids
+        self.provider = provider
+        self.concurrency = max(1, concurrency)
+        self.poll_interval_sec = max(0.05, poll_interval_sec)
+        self.limiter = RateLimiter(rate_per_min)
+        self.rate_per_min = max(0, rate_per_min)
+        self._stop = threading.Event()
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._executor = None
+        self._thread = None
+        self._in_flight = set()
+        self._futures = set()
+        self._done = collections.deque()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "submitted": 0,
+            "images": 0,
+            "completed": 0,
+            "failed": 0,
+            "rate_limited_sec": 0.0,
+            "max_latency_ms": 0.0,
+            "total_latency_ms": 0.0,
+            "backlog": 0,
+            "oldest_pending_ms": None,
+        }
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="llm-worker")
+        self._thread = threading.Thread(target=self._run, name="llm-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=LLM_TIMEOUT_SEC):
+        """Stop dispatching and wait up to ``timeout`` for running requests to finish.
+
+        Callers close the shared HTTP clients right after, so anything still
+        running past the timeout is logged rather than silently cut off.
+        """
+        if self._thread is None:
+            return
+        deadline = time.monotonic() + timeout
+        self._stop.set()
+        self._thread.join(timeout=timeout)
+        self._thread = None
+        with self._stats_lock:
+            futures = set(self._futures)
+        _, running = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+        if running:
+            log_event("WARNING", "llm.image.analysis.stop_timeout", "ops", "llm", "LLM requests still running at shutdown", extra={"running": len(running)})
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+    def stats(self):
+        with self._stats_lock:
+            data = dict(self._stats)
+            in_flight = len(self._in_flight)
+            self._trim_done()
+            recent = len(self._done)
+        finished = data["completed"] + data["failed"]
+        total_ms = data.pop("total_latency_ms")
+        oldest = data.pop("oldest_pending_ms")
+        data["avg_latency_ms"] = round(total_ms / finished, 1) if finished else 0.0
+        data["rate_limited_sec"] = round(data["rate_limited_sec"], 3)
+        data["in_flight"] = in_flight
+        data["throughput_per_min"] = recent * 60 // THROUGHPUT_WINDOW_SEC
+        data["backlog_age_sec"] = round(max(0, now_ms() - oldest) / 1000, 1) if oldest else 0.0
+        data["provider"] = self.provider
+        data["concurrency"] = self.concurrency
+        data["rate_limit_per_min"] = self.rate_per_min
+        return data
+
+    def _trim_done(self):
+        cutoff = time.monotonic() - THROUGHPUT_WINDOW_SEC
+        while self._done and self._done[0] < cutoff:
+            self._done.popleft()
+
+    def _refresh_backlog(self):
+        pending, oldest = self.backlog()
+        with self._stats_lock:
+            self._stats["backlog"] = pending
+            self._stats["oldest_pending_ms"] = oldest
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._refresh_backlog()
+                with self._stats_lock:
+                    in_flight = set(self._in_flight)
+                units = [
+                    unit for unit in self.fetch_pending(self.concurrency + len(in_flight))
+                    if in_flight.isdisjoint(self.unit_ids(unit))
+                ]
+            except Exception as exc:
+                log_event("ERROR", "llm.image.analysis.loop_failed", "ops", "worker", "LLM dispatcher error", error=str(exc))
+                units = []
+            if not units:
+                self._stop.wait(self.poll_interval_sec)
+                continue
+            for unit in units:
+                if not self._dispatch(unit):
+                    return
+
+    def _dispatch(self, unit):
+        # Wait for a free worker, then for the provider's rate limit; both give way to stop().
+        while not self._slots.acquire(timeout=self.poll_interval_sec):
+            if self._stop.is_set():
+                return False
+        waited = self.limiter.acquire(self._stop)
+        if waited is None:
+            self._slots.release()
+            return False
+        ids = self.unit_ids(unit)
+        with self._stats_lock:
+            self._in_flight.update(ids)
+            self._stats["submitted"] += 1
+            self._stats["images"] += len(ids)
+            self._stats["rate_limited_sec"] += waited
+        future = self._executor.submit(self._work, unit)
+        with self._stats_lock:
+            self._futures.add(future)
+        future.add_done_callback(self._forget)
+        return True
+
+    def _forget(self, future):
+        with self._stats_lock:
+            self._futures.discard(future)
+
+    def _work(self, unit):
+        started = time.perf_counter()
+        try:
+            ok = self.analyze(unit)
+        except Exception as exc:
+            ok = False
+            log_event("ERROR", "llm.image.analysis.failed", "ops", "llm", "Alarm image analysis failed", error=str(exc), extra={"image_ids": list(self.unit_ids(unit))})
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            self._in_flight.difference_update(self.unit_ids(unit))
+            self._stats["completed" if ok else "failed"] += 1
+            self._stats["total_latency_ms"] += elapsed_ms
+            if elapsed_ms > self._stats["max_latency_ms"]:
+                self._stats["max_latency_ms"] = round(elapsed_ms, 1)
+            self._done.append(time.monotonic())
+            self._trim_done()
+        # Released after leaving _in_flight so the dispatcher never re-fetches a row still being written.
+        self._slots.release()
@@ -0,0 +1,170 @@
+"""In-memory device positions backed by NumPy arrays.
+
+Every device gets a fixed slot; coordinates, the online mask and a dirty
+mask are parallel arrays indexed by slot, so the position simulation is a
+handful of vectorized operations. SQLite is only written by ``flush`` with
+one ``executemany`` for every slot that moved since the last flush.
+
+``pack_frame`` serialises every slot for the binary ``position_frame``
+event. The frame layout is a ``FRAME_HEADER`` (format version, index
+generation, device count, scale) followed by ``count`` pairs of
+little-endian ``uint16`` x/y values, each multiplied by the scale. A
+device's position in the frame is its slot, and clients map slots back to
+device ids with ``index()``, which is resent whenever ``generation``
+changes.
+"""
+
+from __future__ import annotations
+
+import struct
+import threading
+
+import numpy as np
+
+MAP_WIDTH = 1920
+MAP_HEIGHT = 1080
+
+# Map quadrants, matching the zone labels in the Devices view (A区..D区).
+ZONES = ("A", "B", "C", "D")
+
+
+def zone_for(pos_x, pos_y):
+    """Quadrant of ``(pos_x, pos_y)``, or ``None`` for an unplaced device at the origin."""
+    if not pos_x and not pos_y:
+        return None
+    left = pos_x < MAP_WIDTH / 2
+    top = pos_y < MAP_HEIGHT / 2
+    return ZONES[(0 if top else 2) + (0 if left else 1)]
+
+
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct("<BHHB")
+# 0.1 px resolution keeps 1920 * 10 inside uint16.
+FRAME_SCALE = 10
+
+
+class PositionStore:
+    def __init__(self, capacity=64):
+        self._lock = threading.Lock()
+        self._slots = {}
+        self._ids = []
+        self._xy = np.zeros((capacity, 2), dtype=np.float64)
+        self._online = np.zeros(capacity, dtype=bool)
+        self._dirty = np.zeros(capacity, dtype=bool)
+        self._rng = np.random.default_rng()
+        self._generation = 0
+        self._stats = {"flushes": 0, "flushed_rows": 0}
+
+    def _slot(self, device_id):
+        slot = self._slots.get(device_id)
+        if slot is not None:
+            return slot
+        slot = len(self._ids)
+        if slot == len(self._xy):
+            capacity = 2 * len(self._xy)
+            self._xy = np.resize(self._xy, (capacity, 2))
+            self._online = np.resize(self._online, capacity)
+            self._dirty = np.resize(self._dirty, capacity)
+            self._xy[slot:] = 0
+            self._online[slot:] = False
+            self._dirty[slot:] = False
+        self._slots[device_id] = slot
+        self._ids.append(device_id)
+        self._generation += 1
+        return slot
+
+    def load(self, rows):
+        """Replace the store with ``rows`` of ``device_id``/``pos_x``/``pos_y``/``online_status``."""
+        with self._lock:
+            self._slots, self._ids = {}, []
+            self._generation += 1
+            self._xy[:] = 0
+            self._online[:] = False
+            self._dirty[:] = False
+            for row in rows:
+                slot = self._slot(row["device_id"])
+                self._xy[slot] = (row.get("pos_x") or 0, row.get("pos_y") or 0)
+                self._online[slot] = row.get("online_status") == 1
+
+    def refresh(self, rows):
+        """Take positions written by another process; slots are kept and nothing is marked dirty."""
+        with self._lock:
+            for row in rows:
+                self._xy[self._slot(row["device_id"])] = (row.get("pos_x") or 0, row.get("pos_y") or 0)
+
+    def set(self, device_id, pos_x, pos_y):
+        with self._lock:
+            slot = self._slot(device_id)
+            self._xy[slot] = (pos_x, pos_y)
+            self._dirty[slot] = True
+
+    def set_online(self, device_id, online):
+        with self._lock:
+            self._online[self._slot(device_id)] = online
+
+    def get(self, device_id):
+        with self._lock:
+            slot = self._slots.get(device_id)
+            return (0.0, 0.0) if slot is None else tuple(self._xy[slot].tolist())
+
+    def snapshot(self):
+        """``{device_id: (pos_x, pos_y)}`` for every known device."""
+        with self._lock:
+            return dict(zip(self._ids, map(tuple, self._xy[:len(self._ids)].tolist())))
+
+    def index(self):
+        """``(generation, device_ids)``; ``device_ids[slot]`` names each frame entry."""
+        with self._lock:
+            return self._generation & 0xFFFF, list(self._ids)
+
+    def pack_frame(self):
+        """Encode every slot as a compact binary ``position_frame``."""
+        with self._lock:
+            count = len(self._ids)
+            quantized = np.rint(self._xy[:count] * FRAME_SCALE).clip(0, 0xFFFF).astype("<u2")
+            header = FRAME_HEADER.pack(FRAME_VERSION, self._generation & 0xFFFF, count, FRAME_SCALE)
+        return header + quantized.tobytes()
+
+    def random_walk(self, move_range):
+        """Move every online device by up to ``move_range`` on each axis, clamped to the map."""
+        with self._lock:
+            count = len(self._ids)
+            online = self._online[:count]
+            moving = int(online.sum())
+            if not moving or move_range <= 0:
+                return 0
+            xy = self._xy[:count]
+            xy[online] += self._rng.uniform(-move_range, move_range, size=(moving, 2))
+            np.clip(xy[:, 0], 0, MAP_WIDTH, out=xy[:, 0])
+            np.clip(xy[:, 1], 0, MAP_HEIGHT, out=xy[:, 1])
+            self._dirty[:count] |= online
+            return moving
+
+    def flush(self, writer):
+        """Persist moved slots with ``writer([(pos_x, pos_y, device_id), ...])``; returns the row count."""
+        with self._lock:
+            slots = np.flatnonzero(self._dirty[:len(self._ids)])
+            if not len(slots):
+                return 0
+            rows = [(x, y, self._ids[slot]) for slot, (x, y) in zip(slots.tolist(), self._xy[slots].tolist())]
+            self._dirty[slots] = False
+        try:
+            writer(rows)
+        except Exception:
+            with self._lock:
+                self._dirty[slots] = True
+            raise
+        with self._lock:
+            self._stats["flushes"] += 1
+            self._stats["flushed_rows"] += len(rows)
+        return len(rows)
+
+    def stats(self):
+        with self._lock:
+            count = len(self._ids)
+            return {
+                "devices": count,
+                "online": int(self._online[:count].sum()),
+                "dirty": int(self._dirty[:count].sum()),
+                **self._stats,
+            }
@@ -0,0 +1,173 @@
+"""Retention, downsampling and archival for raw ``alarms`` rows.
+
+Rows older than ``RAW_RETENTION_DAYS`` are handled one local day at a time:
+the day is merged into the rollup tables, exported to a gzip-compressed
+JSONL file under ``ARCHIVE_DIR/alarms/YYYY-MM/`` and deleted in small
+transactions so the ingest writer can take the write lock between chunks.
+Minute rollups older than ``ROLLUP_MINUTE_RETENTION_DAYS`` are pruned the
+same way (hour/day rollups are kept), then freed pages are handed back with
+``PRAGMA incremental_vacuum``. That only works on files built with
+``auto_vacuum=INCREMENTAL``; every summary reports the file's mode and free
+page count, and a database created before the setting needs a one-off
+``VACUUM`` (see README).
+"""
+
+from __future__ import annotations
+
+import gzip
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from config import (
+    ARCHIVE_DIR,
+    RAW_RETENTION_DAYS,
+    RETENTION_CHUNK_PAUSE_MS,
+    RETENTION_CHUNK_SIZE,
+    RETENTION_VACUUM_PAGES,
+    ROLLUP_MINUTE_RETENTION_DAYS,
+)
+from logger import log_event
+from timeutil import format_ms
+from backend.repositories import database as repo
+
+
+def _local_midnight(ms):
+    day = datetime.fromtimestamp(ms / 1000).replace(hour=0, minute=0, second=0, microsecond=0)
+    return int(day.timestamp() * 1000)
+
+
+def _next_midnight(ms):
+    day = datetime.fromtimestamp(_local_midnight(ms) / 1000) + timedelta(days=1)
+    return int(day.timestamp() * 1000)
+
+
+class AlarmRetention:
+    """Runs one retention pass at a time; ``run`` is blocking and meant for a worker thread."""
+
+    def __init__(self, archive_dir=ARCHIVE_DIR, retention_days=RAW_RETENTION_DAYS,
+                 minute_retention_days=ROLLUP_MINUTE_RETENTION_DAYS, chunk_size=RETENTION_CHUNK_SIZE,
+                 chunk_pause_ms=RETENTION_CHUNK_PAUSE_MS, vacuum_pages=RETENTION_VACUUM_PAGES):
+        self.archive_dir = Path(archive_dir)
+        self.retention_days = max(1, retention_days)
+        self.minute_retention_days = max(self.retention_days, minute_retention_days)
+        self.chunk_size = max(1, chunk_size)
+        self.chunk_pause_sec = max(0, chunk_pause_ms) / 1000.0
+        self.vacuum_pages = max(1, vacuum_pages)
+        self._run_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "runs": 0,
+            "archived_rows": 0,
+            "pruned_rollup_rows": 0,
+            "vacuumed_pages": 0,
+            "last_run_at": None,
+            "last_run_ms": 0.0,
+            "last_cutoff": None,
+            "auto_vacuum": None,
+            "free_pages": None,
+        }
+        self._warned_auto_vacuum = False
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def wait_idle(self):
+        """Block until the current pass (if any) has returned."""
+        with self._run_lock:
+            pass
+
+    def archive_path(self, day_ms):
+        day = datetime.fromtimestamp(day_ms / 1000)
+        return self.archive_dir / "alarms" / day.strftime("%Y-%m") / f"alarms-{day.strftime('%Y-%m-%d')}.jsonl.gz"
+
+    def run(self, should_stop=lambda: False):
+        """One pass; ``should_stop()`` is polled between chunks. Returns a summary dict."""
+        with self._run_lock:
+            started = time.perf_counter()
+            today = _local_midnight(time.time() * 1000)
+            cutoff = int((datetime.fromtimestamp(today / 1000) - timedelta(days=self.retention_days)).timestamp() * 1000)
+            minute_cutoff = (datetime.fromtimestamp(today / 1000) - timedelta(days=self.minute_retention_days)).strftime("%Y-%m-%d")
+            summary = {
+                "cutoff": format_ms(cutoff),
+                "archived_rows": self._archive_before(cutoff, should_stop),
+                "pruned_rollup_rows": self._prune_minute_rollups(minute_cutoff, should_stop),
+            }
+            summary["auto_vacuum"], _ = repo.get_auto_vacuum()
+            summary["vacuumed_pages"] = self._vacuum(should_stop) if summary["auto_vacuum"] == "incremental" else 0
+            _, summary["free_pages"] = repo.get_auto_vacuum()
+            if summary["auto_vacuum"] != "incremental" and not self._warned_auto_vacuum:
+                self._warned_auto_vacuum = True
+                log_event(
+                    "WARNING", "system.retention.auto_vacuum_off", "ops", "worker",
+                    "auto_vacuum is not INCREMENTAL; deleted rows will not shrink alarm.db until a one-off VACUUM",
+                    extra={"auto_vacuum": summary["auto_vacuum"], "free_pages": summary["free_pages"]},
+                )
+            with self._stats_lock:
+                self._stats["runs"] += 1
+                self._stats["archived_rows"] += summary["archived_rows"]
+                self._stats["pruned_rollup_rows"] += summary["pruned_rollup_rows"]
+                self._stats["vacuumed_pages"] += summary["vacuumed_pages"]
+                self._stats["last_run_at"] = format_ms(int(time.time() * 1000))
+                self._stats["last_run_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                self._stats["last_cutoff"] = summary["cutoff"]
+                self._stats["auto_vacuum"] = summary["auto_vacuum"]
+                self._stats["free_pages"] = summary["free_pages"]
+            return summary
+
+    def _archive_before(self, cutoff_ms, should_stop):
+        total = 0
+        while not should_stop():
+            oldest = repo.get_oldest_alarm_timestamp()
+            if oldest is None or oldest >= cutoff_ms:
+                break
+            day_start = _local_midnight(oldest)
+            day_end = min(_next_midnight(oldest), cutoff_ms)
+            # Rollups are normally folded at ingest; this only fills in rows written around them.
+            for table, rows in repo.get_alarm_rollup_buckets(day_start, day_end).items():
+                for i in range(0, len(rows), self.chunk_size):
+                    repo.merge_alarm_rollups(table, rows[i:i + self.chunk_size])
+            total += self._archive_day(day_start, day_end, should_stop)
+        return total
+
+    def _archive_day(self, day_start, day_end, should_stop):
+        path = self.archive_path(day_start)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        total = 0
+        while not should_stop():
+            rows = repo.get_alarm_rows_before(day_end, self.chunk_size)
+            if not rows:
+                break
+            # Append mode adds a gzip member per chunk; readers see one concatenated stream.
+            with gzip.open(path, "at", encoding="utf-8") as fh:
+                fh.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+            repo.delete_alarm_rows([row["id"] for row in rows])
+            total += len(rows)
+            if len(rows) < self.chunk_size:
+                break
+            time.sleep(self.chunk_pause_sec)
+        return total
+
+    def _prune_minute_rollups(self, bucket, should_stop):
+        table, _ = repo.ROLLUP_TABLES["minute"]
+        total = 0
+        while not should_stop():
+            deleted = repo.delete_rollup_buckets_before(table, bucket, self.chunk_size)
+            total += deleted
+            if deleted < self.chunk_size:
+                break
+            time.sleep(self.chunk_pause_sec)
+        return total
+
+    def _vacuum(self, should_stop):
+        freed = 0
+        while not should_stop():
+            released, still_free = repo.incremental_vacuum(self.vacuum_pages)
+            freed += released
+            if still_free == 0 or released == 0:
+                break
+            time.sleep(self.chunk_pause_sec)
+        return freed
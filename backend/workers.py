@@ -4,27 +4,37 @@ from __future__ import annotations
 
 import asyncio
 import json
-import random
 import threading
-import time
 
 import paho.mqtt.client as mqtt
 
 from config import (
+    ALARM_STORAGE_MODE,
+    HEARTBEAT_FLUSH_INTERVAL_SEC,
     LLM_ENABLED,
-    LLM_POLL_INTERVAL_SEC,
     MQTT_BROKER,
     MQTT_PORT,
     MQTT_REQUIRED,
     MQTT_TOPIC,
-    OFFLINE_CHECK_INTERVAL_SEC,
     OFFLINE_TIMEOUT_SEC,
+    POSITION_FLUSH_INTERVAL_SEC,
     POSITION_MOVE_RANGE,
     POSITION_UPDATE_INTERVAL_SEC,
+    RETENTION_ENABLED,
+    RETENTION_INTERVAL_SEC,
 )
-from logger import log_event
+from image_prep import stats as image_prep_stats
+from llm_client import aclose_clients, client_stats, close_clients
+from logger import flush_logs, log_event, log_sink_stats
+from timeutil import now_ms
+from backend import metrics
+from backend.realtime import DeviceBroadcaster, PositionBroadcaster, RoomFanout
 from backend.repositories import database as repo
+from backend.repositories.executor import run_db, shutdown as shutdown_db_executor
 from backend.services import app_service
+from backend.services.ingest import IngestQueue
+from backend.services.llm_pool import ImageAnalysisPool
+from backend.services.retention import AlarmRetention
 
 
 class WorkerManager:
@@ -35,17 +45,53 @@ class WorkerManager:
         self.tasks = []
         self.mqtt_client = None
         self.mqtt_thread = None
+        self.ingest = IngestQueue(app_service.process_mqtt_batch, on_batch=self._on_ingest_batch)
+        self.fanout = RoomFanout(sio)
+        self.broadcaster = DeviceBroadcaster(sio, app_service.get_latest_payload, fanout=self.fanout)
+        self.position_broadcaster = PositionBroadcaster(
+            sio, app_service.device_state.positions, lambda: app_service.get_devices_payload()["devices"],
+            fanout=self.fanout,
+        )
+        self.retention = AlarmRetention()
+        self.llm_pool = ImageAnalysisPool(
+            repo.get_pending_alarm_image_bursts,
+            app_service.analyze_pending_burst,
+            repo.get_pending_alarm_image_backlog,
+            unit_ids=lambda burst: [item["id"] for item in burst],
+        )
 
     async def start(self):
-        repo.init_db()
-        repo.init_device_positions()
+        await run_db(repo.init_db, timeout=None)
+        await run_db(repo.init_device_positions, timeout=None)
+        await run_db(app_service.device_state.load, timeout=None)
         self.loop = asyncio.get_running_loop()
+        self.ingest.start()
+        metrics.register("ingest", self.ingest.stats)
+        metrics.register("broadcast", self.broadcaster.stats)
+        metrics.register("logs", log_sink_stats)
+        metrics.register("storage", repo.heartbeat_stats)
+        metrics.register("positions", app_service.device_state.positions.stats)
+        metrics.register("position_broadcast", self.position_broadcaster.stats)
+        metrics.register("fanout", self.fanout.stats)
         self.tasks = [
+            self.broadcaster.start(self.loop),
             asyncio.create_task(self._offline_check_loop(), name="offline-check"),
             asyncio.create_task(self._position_broadcast_loop(), name="position-broadcast"),
         ]
+        if POSITION_MOVE_RANGE > 0:
+            # Only the simulated walk owns positions; external writers must not be overwritten.
+            self.tasks.append(asyncio.create_task(self._position_flush_loop(), name="position-flush"))
+        if ALARM_STORAGE_MODE == "transitions":
+            self.tasks.append(asyncio.create_task(self._heartbeat_flush_loop(), name="heartbeat-flush"))
         if LLM_ENABLED:
-            self.tasks.append(asyncio.create_task(self._llm_analysis_loop(), name="llm-analysis"))
+            metrics.register("llm", self.llm_pool.stats)
+            metrics.register("llm_http", client_stats)
+            metrics.register("llm_images", image_prep_stats)
+            metrics.register("llm_dedup", repo.image_dedup_stats)
+            self.llm_pool.start()
+        if RETENTION_ENABLED:
+            metrics.register("retention", self.retention.stats)
+            self.tasks.append(asyncio.create_task(self._retention_loop(), name="alarm-retention"))
         self._start_mqtt()
 
     async def stop(self):
@@ -58,15 +104,26 @@ class WorkerManager:
                 pass
         if self.mqtt_thread and self.mqtt_thread.is_alive():
             self.mqtt_thread.join(timeout=5)
+        await asyncio.to_thread(self.ingest.stop)
+        await asyncio.to_thread(self.llm_pool.stop)
+        await asyncio.to_thread(close_clients)
+        await aclose_clients()
+        # The retention pass polls stop_event between chunks; let it finish before closing connections.
+        await asyncio.to_thread(self.retention.wait_idle)
+        await asyncio.to_thread(repo.flush_heartbeats)
+        await asyncio.to_thread(app_service.flush_positions)
         for task in self.tasks:
             task.cancel()
         if self.tasks:
             await asyncio.gather(*self.tasks, return_exceptions=True)
+        # Let in-flight run_db calls finish before their connections are closed.
+        await asyncio.to_thread(shutdown_db_executor, wait=True)
+        await asyncio.to_thread(flush_logs)
+        repo.get_pool().close_all()
 
-    def _emit_threadsafe(self, event, payload):
-        if self.loop is None:
-            return
-        asyncio.run_coroutine_threadsafe(self.sio.emit(event, payload), self.loop)
+    def _on_ingest_batch(self, messages, results):
+        urgent = any(changed.get("alarm_raised") or changed.get("alarm_cleared") for changed in results)
+        self.broadcaster.mark_dirty({message["device_id"] for message in messages}, urgent=urgent)
 
     def _start_mqtt(self):
         client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
@@ -82,8 +139,7 @@ class WorkerManager:
         def on_message(client, userdata, msg):
             try:
                 payload = json.loads(msg.payload.decode())
-                app_service.process_mqtt_payload(msg.topic, payload)
-                self._emit_threadsafe("device_update", app_service.get_latest_payload())
+                self.ingest.submit(app_service.parse_mqtt_payload(msg.topic, payload))
             except Exception as exc:
                 log_event("ERROR", "mqtt.message.parse_failed", "ops", "mqtt", "Failed to process MQTT message", topic=msg.topic, error=str(exc))
 
@@ -104,52 +160,66 @@ class WorkerManager:
     async def _offline_check_loop(self):
         while not self.stop_event.is_set():
             try:
-                await asyncio.sleep(OFFLINE_CHECK_INTERVAL_SEC)
-                devices = repo.get_all_devices()
-                now = time.time()
-                changed = False
-                for dev in devices:
-                    last_seen = dev.get("last_seen")
-                    if dev.get("online_status") != 1 or not last_seen:
-                        continue
-                    last_seen_ts = time.mktime(time.strptime(last_seen, "%Y-%m-%d %H:%M:%S"))
-                    if now - last_seen_ts > OFFLINE_TIMEOUT_SEC:
-                        repo.set_device_offline(dev["device_id"])
-                        changed = True
-                        log_event("WARNING", "device.status.offline_marked", "biz", "worker", "Device marked offline", device_id=dev["device_id"], extra={"offline_seconds": now - last_seen_ts})
-                if changed:
-                    await self.sio.emit("device_update", app_service.get_latest_payload())
+                # Sleep until the earliest deadline; a device first seen meanwhile expires
+                # no sooner than OFFLINE_TIMEOUT_SEC from now, so the cap never wakes late.
+                deadline = app_service.device_state.next_deadline()
+                wait_sec = OFFLINE_TIMEOUT_SEC if deadline is None else (deadline - now_ms()) / 1000
+                await asyncio.sleep(min(OFFLINE_TIMEOUT_SEC, max(0, wait_sec)))
+                expired = await run_db(app_service.expire_offline_devices)
+                for device_id, offline_seconds in expired:
+                    log_event("WARNING", "device.status.offline_marked", "biz", "worker", "Device marked offline", device_id=device_id, extra={"offline_seconds": offline_seconds})
+                if expired:
+                    self.broadcaster.mark_dirty([device_id for device_id, _ in expired])
             except asyncio.CancelledError:
                 raise
             except Exception as exc:
                 log_event("ERROR", "system.background.offline_check_failed", "ops", "worker", "Offline check loop error", error=str(exc))
+                await asyncio.sleep(1)
+
+    async def _heartbeat_flush_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                await asyncio.sleep(HEARTBEAT_FLUSH_INTERVAL_SEC)
+                await run_db(repo.flush_heartbeats)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                log_event("ERROR", "system.background.heartbeat_flush_failed", "ops", "worker", "Heartbeat flush loop error", error=str(exc))
 
     async def _position_broadcast_loop(self):
         while not self.stop_event.is_set():
             try:
                 await asyncio.sleep(POSITION_UPDATE_INTERVAL_SEC)
-                devices = repo.get_all_devices_with_positions()
                 if POSITION_MOVE_RANGE <= 0:
-                    await self.sio.emit("position_update", devices)
-                    continue
-                for dev in devices:
-                    if dev.get("online_status") != 1:
-                        continue
-                    pos_x = max(0, min(1920, (dev.get("pos_x") or 0) + random.uniform(-POSITION_MOVE_RANGE, POSITION_MOVE_RANGE)))
-                    pos_y = max(0, min(1080, (dev.get("pos_y") or 0) + random.uniform(-POSITION_MOVE_RANGE, POSITION_MOVE_RANGE)))
-                    repo.update_device_position(dev["device_id"], pos_x, pos_y)
-                await self.sio.emit("position_update", repo.get_all_devices_with_positions())
+                    # Positions come from another process (e.g. publish_test.py); SQLite is the source.
+                    await run_db(app_service.reload_positions)
+                else:
+                    # Memory only: the walk is a few array ops, SQLite sees it in _position_flush_loop.
+                    app_service.simulate_position_step(POSITION_MOVE_RANGE)
+                await self.position_broadcaster.broadcast()
             except asyncio.CancelledError:
                 raise
             except Exception as exc:
                 log_event("ERROR", "system.background.position_broadcast_failed", "ops", "worker", "Position broadcast loop error", error=str(exc))
 
-    async def _llm_analysis_loop(self):
+    async def _position_flush_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                await asyncio.sleep(POSITION_FLUSH_INTERVAL_SEC)
+                await run_db(app_service.flush_positions)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                log_event("ERROR", "system.background.position_flush_failed", "ops", "worker", "Position flush loop error", error=str(exc))
+
+    async def _retention_loop(self):
         while not self.stop_event.is_set():
             try:
-                await asyncio.sleep(LLM_POLL_INTERVAL_SEC)
-                await asyncio.to_thread(app_service.analyze_pending_images_batch)
+                await asyncio.sleep(RETENTION_INTERVAL_SEC)
+                summary = await asyncio.to_thread(self.retention.run, self.stop_event.is_set)
+                if summary["archived_rows"] or summary["pruned_rollup_rows"]:
+                    log_event("INFO", "system.retention.completed", "ops", "worker", "Alarm retention pass completed", extra=summary)
             except asyncio.CancelledError:
                 raise
             except Exception as exc:
-                log_event("ERROR", "llm.image.analysis.loop_failed", "ops", "worker", "LLM analysis loop error", error=str(exc))
+                log_event("ERROR", "system.background.retention_failed", "ops", "worker", "Alarm retention loop error", error=str(exc))
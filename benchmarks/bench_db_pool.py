@@ -0,0 +1,111 @@
+"""Per-call overhead of the repository layer: connection-per-call vs. pooled connections.
+
+Usage::
+
+    python benchmarks/bench_db_pool.py [iterations]
+
+Runs against a throwaway database in a temporary directory.
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+WORKDIR = tempfile.mkdtemp(prefix="forklift-bench-")
+os.chdir(WORKDIR)
+
+from config import DB_BUSY_TIMEOUT_MS, DB_PATH  # noqa: E402
+from backend.repositories import database as repo  # noqa: E402
+
+
+def _legacy_connection():
+    """The pre-pool pattern: open, set PRAGMAs, run one query, close."""
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS};")
+    return conn
+
+
+def legacy_get_latest_image(device_id):
+    conn = _legacy_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT image_path, timestamp,
+               description, description_status, description_model, description_updated_at
+        FROM alarm_images
+        WHERE device_id = ?
+        ORDER BY timestamp DESC
+        LIMIT 1
+        """,
+        (device_id,),
+    )
+    row = cursor.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+def legacy_update_device_position(device_id, pos_x, pos_y):
+    conn = _legacy_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE devices SET pos_x = ?, pos_y = ? WHERE device_id = ?", (pos_x, pos_y, device_id))
+    conn.commit()
+    conn.close()
+
+
+def seed():
+    repo.init_db()
+    with repo.get_pool().writer() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO devices (device_id, online_status) VALUES (?, 1)",
+            [(f"FORK-{i:03d}",) for i in range(50)],
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO alarm_images (device_id, image_path, timestamp) VALUES (?, ?, ?)",
+            [(f"FORK-{i % 50:03d}", f"images/alarms/{i}.jpg", 1767225600000 + i * 1000) for i in range(2000)],
+        )
+
+
+def measure(label, func, iterations):
+    started = time.perf_counter()
+    for i in range(iterations):
+        func(i)
+    elapsed = time.perf_counter() - started
+    per_call_us = elapsed / iterations * 1_000_000
+    print(f"{label:<36} {iterations:>7} calls  {per_call_us:>9.1f} us/call")
+    return per_call_us
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    seed()
+    print(f"database: {Path(WORKDIR) / DB_PATH}")
+    results = [
+        (
+            "read: get_latest_image",
+            measure("before (connect per call)", lambda i: legacy_get_latest_image(f"FORK-{i % 50:03d}"), iterations),
+            measure("after  (pooled reader)", lambda i: repo.get_latest_image(f"FORK-{i % 50:03d}"), iterations),
+        ),
+        (
+            "write: update_device_position",
+            measure("before (connect per call)", lambda i: legacy_update_device_position(f"FORK-{i % 50:03d}", i, i), iterations),
+            measure("after  (pooled writer)", lambda i: repo.update_device_position(f"FORK-{i % 50:03d}", i, i), iterations),
+        ),
+    ]
+    print()
+    for name, before, after in results:
+        print(f"{name:<32} speedup x{before / after:.1f}")
+    repo.get_pool().close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Write volume of the two raw alarm storage modes for a simulated healthy fleet.
+
+Usage::
+
+    python benchmarks/bench_heartbeat_storage.py [devices] [minutes]
+
+Every device sends a heartbeat every 5 s (like ``publish_test.py``) and
+raises a 15 s alarm once an hour. Each mode runs against its own
+throwaway database; the script reports ``alarms`` rows, rows changed
+(``total_changes``), write transactions and the time spent writing.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+WORKDIR = tempfile.mkdtemp(prefix="forklift-storage-")
+os.chdir(WORKDIR)
+
+from config import HEARTBEAT_FLUSH_INTERVAL_SEC  # noqa: E402
+from backend.repositories import database as repo  # noqa: E402
+from backend.services.device_state import DeviceStateTable  # noqa: E402
+
+HEARTBEAT_SEC = 5
+FLUSH_EVERY_TICKS = max(1, HEARTBEAT_FLUSH_INTERVAL_SEC // HEARTBEAT_SEC)
+ALARM_EVERY_TICKS = 3600 // HEARTBEAT_SEC
+
+
+def simulate(mode, devices, minutes):
+    workdir = Path(WORKDIR) / mode
+    workdir.mkdir()
+    os.chdir(workdir)
+    repo.ALARM_STORAGE_MODE = mode
+    repo.init_db()
+    state = DeviceStateTable(repo.load_device_state)
+    transactions = 0
+    with repo.get_pool().writer() as conn:
+        changes_before = conn.total_changes
+
+    def count_commits(sql):
+        nonlocal transactions
+        transactions += sql.strip().upper() == "BEGIN"
+
+    with repo.get_pool().writer() as conn:
+        conn.set_trace_callback(count_commits)
+    ticks = minutes * 60 // HEARTBEAT_SEC
+    started = time.perf_counter()
+    for tick in range(ticks):
+        messages = []
+        for i in range(devices):
+            alarm = 1 if (tick + i * 7) % ALARM_EVERY_TICKS < 3 else 0
+            messages.append({"device_id": f"FORK-{i:03d}", "alarm": alarm, "timestamp": None, "image_paths": []})
+        state.apply_batch(messages, repo.write_mqtt_batch)
+        if (tick + 1) % FLUSH_EVERY_TICKS == 0:
+            repo.flush_heartbeats()
+    repo.flush_heartbeats()
+    elapsed = time.perf_counter() - started
+    with repo.get_pool().writer() as conn:
+        conn.set_trace_callback(None)
+        changes = conn.total_changes - changes_before
+        raw_rows = conn.execute("SELECT COUNT(*) FROM alarms").fetchone()[0]
+        samples = conn.execute("SELECT SUM(samples) FROM alarm_rollup_minute").fetchone()[0]
+    repo.get_pool().close_all()
+    return {
+        "messages": ticks * devices,
+        "samples": samples,
+        "alarms_rows": raw_rows,
+        "rows_changed": changes,
+        "transactions": transactions,
+        "write_sec": elapsed,
+    }
+
+
+def main():
+    devices = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    minutes = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    print(f"{devices} devices, {minutes} min of 5 s heartbeats, database under {WORKDIR}")
+    results = {mode: simulate(mode, devices, minutes) for mode in ("all", "transitions")}
+    keys = ("messages", "samples", "alarms_rows", "rows_changed", "transactions", "write_sec")
+    print(f"\n{'':<14}" + "".join(f"{key:>14}" for key in keys))
+    for mode, result in results.items():
+        print(f"{mode:<14}" + "".join(
+            f"{result[key]:>14.2f}" if isinstance(result[key], float) else f"{result[key]:>14}" for key in keys
+        ))
+    before, after = results["all"], results["transitions"]
+    print(
+        f"\nalarms rows x{before['alarms_rows'] / max(1, after['alarms_rows']):.1f} fewer, "
+        f"rows changed x{before['rows_changed'] / max(1, after['rows_changed']):.1f} fewer, "
+        f"transactions x{before['transactions'] / max(1, after['transactions']):.1f} fewer"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""LLM calls needed for alarm bursts with and without perceptual-hash dedup.
+
+Usage::
+
+    python benchmarks/bench_image_dedup.py [bursts] [frames]
+
+Each burst is ``frames`` JPEGs of one synthetic scene, 1 s apart, with a
+few pixels of camera drift and sensor noise (like ``publish_test.py``
+uploads). Bursts go through ``save_alarm_image`` in a throwaway database.
+The pending queue is drained by a fake analyzer, and the script counts how
+many images it had to describe.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+WORKDIR = Path(tempfile.mkdtemp(prefix="forklift-dedup-"))
+os.chdir(WORKDIR)
+
+from backend.repositories import database as repo  # noqa: E402
+
+
+def scene(seed):
+    rng = np.random.default_rng(seed)
+    small = Image.fromarray((rng.random((60, 80, 3)) * 255).astype(np.uint8))
+    return np.asarray(small.resize((640, 480), Image.Resampling.BICUBIC).filter(ImageFilter.GaussianBlur(6))).astype(float)
+
+
+def write_bursts(bursts, frames):
+    rng = np.random.default_rng(0)
+    images = []
+    for burst in range(bursts):
+        base = scene(burst)
+        for frame in range(frames):
+            path = WORKDIR / f"FORK-001_{burst:04d}_{frame}.jpg"
+            pixels = np.roll(base, 3 * frame, axis=1) + rng.normal(0, 6, base.shape)
+            Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(path, quality=85)
+            images.append((str(path), burst * 120_000 + frame * 1000))
+    return images
+
+
+def simulate(mode, images):
+    repo.LLM_DEDUP_ENABLED = mode == "phash"
+    db_dir = WORKDIR / mode
+    db_dir.mkdir()
+    os.chdir(db_dir)
+    repo.init_db()
+    base_ts = int(time.time() * 1000)
+    started = time.perf_counter()
+    for path, offset in images:
+        repo.save_alarm_image("FORK-001", path, base_ts + offset)
+    save_ms = (time.perf_counter() - started) * 1000 / len(images)
+    calls = 0
+    while True:
+        pending = repo.get_pending_alarm_images(limit=50)
+        if not pending:
+            break
+        for item in pending:
+            calls += 1
+            repo.mark_alarm_image_description(item["id"], f"scene-{Path(item['image_path']).stem.split('_')[1]}", "llm")
+    with repo.get_pool().reader() as conn:
+        described, wrong = conn.execute(
+            """
+            SELECT COUNT(description),
+                   SUM(description != 'scene-' || substr(image_path, instr(image_path, 'FORK-001_') + 9, 4))
+            FROM alarm_images
+            """
+        ).fetchone()
+    repo.get_pool().close_all()
+    return {"images": len(images), "llm_calls": calls, "described": described, "mismatched": wrong or 0, "save_ms": save_ms}
+
+
+def main():
+    bursts = int(sys.argv[1]) if len(sys.argv) > 1 else 25
+    frames = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    images = write_bursts(bursts, frames)
+    print(f"{bursts} bursts x {frames} frames, files under {WORKDIR}")
+    results = {mode: simulate(mode, images) for mode in ("off", "phash")}
+    for mode, result in results.items():
+        print(
+            f"{mode:<8} images {result['images']:>5}  llm calls {result['llm_calls']:>5}  described {result['described']:>5}"
+            f"  mismatched {result['mismatched']:>3}  save {result['save_ms']:.2f} ms/image"
+        )
+    print(f"\nLLM calls x{results['off']['llm_calls'] / max(1, results['phash']['llm_calls']):.1f} fewer")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Bytes and latency per LLM call: original upload vs. the downscaled cached copy.
+
+Usage::
+
+    python benchmarks/bench_llm_image_prep.py [calls] [uplink_mbit]
+
+Writes a 4000x3000 camera-like JPEG to a throwaway directory and calls
+``analyze_alarm_image`` against a local stub of the Responses endpoint,
+first with ``LLM_IMAGE_PREPROCESS`` off and then on. The stub sleeps for
+the time the request body would take on an ``uplink_mbit`` link (default
+20), standing in for the upload to a hosted model.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+WORKDIR = Path(tempfile.mkdtemp(prefix="forklift-imgprep-"))
+UPLINK_BYTES_PER_SEC = (float(sys.argv[2]) if len(sys.argv) > 2 else 20.0) * 1_000_000 / 8
+received = []
+
+
+class StubResponses(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        size = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(size)
+        received.append(size)
+        time.sleep(size / UPLINK_BYTES_PER_SEC)
+        body = json.dumps({
+            "id": "resp_stub",
+            "object": "response",
+            "created_at": int(time.time()),
+            "model": "stub",
+            "status": "completed",
+            "output": [{
+                "type": "message",
+                "id": "msg_stub",
+                "role": "assistant",
+                "status": "completed",
+                "content": [{"type": "output_text", "text": "背对叉车", "annotations": []}],
+            }],
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), StubResponses)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+os.environ["OPENAI_API_KEY"] = "stub"
+os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+
+import image_prep  # noqa: E402
+import llm_client  # noqa: E402
+
+
+def make_photo(path):
+    rng = np.random.default_rng(7)
+    y, x = np.mgrid[0:3000, 0:4000]
+    base = np.stack([(x / 16) % 256, (y / 12) % 256, ((x + y) / 20) % 256], axis=-1)
+    noise = rng.normal(0, 18, size=base.shape)
+    Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8)).save(path, "JPEG", quality=92)
+
+
+def run(label, calls, preprocess):
+    llm_client.LLM_IMAGE_PREPROCESS = preprocess
+    received.clear()
+    timings = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        llm_client.analyze_alarm_image(str(WORKDIR / "alarm.jpg"))
+        timings.append((time.perf_counter() - started) * 1000)
+    steady = timings[1:] or timings
+    print(
+        f"{label:<24} {received[-1] / 1024:>10.0f} KiB/request  first {timings[0]:>8.1f} ms"
+        f"  steady {sum(steady) / len(steady):>8.1f} ms"
+    )
+    return received[-1], sum(steady) / len(steady)
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    make_photo(WORKDIR / "alarm.jpg")
+    print(f"4000x3000 JPEG of {(WORKDIR / 'alarm.jpg').stat().st_size / 1024:.0f} KiB, uplink {UPLINK_BYTES_PER_SEC * 8 / 1e6:.0f} Mbit/s, {calls} calls each")
+    before_bytes, before_ms = run("before (original)", calls, False)
+    after_bytes, after_ms = run("after  (downscaled)", calls, True)
+    print(f"\nrequest body x{before_bytes / after_bytes:.1f} smaller, steady latency {before_ms - after_ms:.0f} ms lower")
+    print(f"image_prep: {image_prep.stats()}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Image analysis throughput: one-at-a-time batch loop vs. ``ImageAnalysisPool``.
+
+Usage::
+
+    python benchmarks/bench_llm_pool.py [images] [latency_ms] [concurrency]
+
+Starts a local stub of the OpenAI Responses endpoint and points
+``llm_client`` at it. The stub sleeps ``latency_ms`` per request plus
+``PER_IMAGE_MS`` per attached image. The same pending ``alarm_images`` rows
+(bursts of 4 frames, 1 s apart) are drained three ways:
+- the old sequential loop;
+- the pool with one request per frame;
+- the pool with one request per burst.
+The rate limit is disabled. Databases and images live in a throwaway
+directory.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+WORKDIR = tempfile.mkdtemp(prefix="forklift-llm-")
+os.chdir(WORKDIR)
+LATENCY_SEC = (int(sys.argv[2]) if len(sys.argv) > 2 else 300) / 1000.0
+CONCURRENCY = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+PER_IMAGE_MS = 40
+FRAMES_PER_BURST = 4
+
+
+class StubResponses(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        images = self.rfile.read(int(self.headers.get("Content-Length", 0))).count(b'"input_image"')
+        time.sleep(LATENCY_SEC + images * PER_IMAGE_MS / 1000.0)
+        body = json.dumps({
+            "id": "resp_stub",
+            "object": "response",
+            "created_at": int(time.time()),
+            "model": "stub",
+            "status": "completed",
+            "output": [{
+                "type": "message",
+                "id": "msg_stub",
+                "role": "assistant",
+                "status": "completed",
+                "content": [{"type": "output_text", "text": "低头作业", "annotations": []}],
+            }],
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), StubResponses)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+os.environ["OPENAI_API_KEY"] = "stub"
+os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+# The shared HTTP client sizes its connection pool from this.
+os.environ["LLM_CONCURRENCY"] = str(CONCURRENCY)
+
+from llm_client import analyze_alarm_image, analyze_alarm_images, client_stats  # noqa: E402
+from backend.repositories import database as repo  # noqa: E402
+from backend.services.llm_pool import ImageAnalysisPool  # noqa: E402
+
+
+def seed(count):
+    images = []
+    for i in range(count):
+        images.append(Path(WORKDIR) / f"alarm_{i}.jpg")
+        images[-1].write_bytes(b"\xff\xd8\xff\xe0" + bytes(4096))
+    now = int(time.time() * 1000)
+    with repo.get_pool().writer() as conn:
+        conn.execute("DELETE FROM alarm_images")
+        conn.executemany(
+            "INSERT INTO alarm_images (device_id, image_path, timestamp, description_status) VALUES (?, ?, ?, 'pending')",
+            [
+                (f"FORK-{i // FRAMES_PER_BURST % 3 + 1:03d}", str(image), now + (i // FRAMES_PER_BURST) * 60_000 + i % FRAMES_PER_BURST * 1000)
+                for i, image in enumerate(images)
+            ],
+        )
+
+
+def analyze(item):
+    repo.mark_alarm_image_description(item["id"], analyze_alarm_image(item["image_path"]), "llm")
+    return True
+
+
+def analyze_burst(burst):
+    analysis = analyze_alarm_images([item["image_path"] for item in burst])
+    repo.mark_alarm_images_description([item["id"] for item in burst], analysis, "llm")
+    return True
+
+
+def sequential(count):
+    # The pre-pool loop: up to 10 images per poll, one request at a time.
+    while True:
+        items = repo.get_pending_alarm_images(limit=10)
+        if not items:
+            return
+        for item in items:
+            analyze(item)
+
+
+def pooled(count, concurrency, bursts=False):
+    if bursts:
+        pool = ImageAnalysisPool(repo.get_pending_alarm_image_bursts, analyze_burst, repo.get_pending_alarm_image_backlog,
+                                 unit_ids=lambda burst: [item["id"] for item in burst],
+                                 concurrency=concurrency, rate_per_min=0, poll_interval_sec=0.05)
+    else:
+        pool = ImageAnalysisPool(repo.get_pending_alarm_images, analyze, repo.get_pending_alarm_image_backlog,
+                                 concurrency=concurrency, rate_per_min=0, poll_interval_sec=0.05)
+    pool.start()
+    while repo.get_pending_alarm_image_backlog()[0] or pool.stats()["in_flight"]:
+        time.sleep(0.01)
+    pool.stop()
+    return pool.stats()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    concurrency = CONCURRENCY
+    repo.init_db()
+    print(f"{count} images, stub latency {LATENCY_SEC * 1000:.0f} ms, concurrency {concurrency}, database under {WORKDIR}")
+
+    seed(count)
+    started = time.perf_counter()
+    sequential(count)
+    before = time.perf_counter() - started
+    print(f"{'before (sequential loop)':<28} {before:>8.2f} s  {count / before * 60:>8.0f} images/min")
+
+    alarms = count / FRAMES_PER_BURST
+    seed(count)
+    started = time.perf_counter()
+    stats = pooled(count, concurrency)
+    after = time.perf_counter() - started
+    print(f"{'after  (pool, per frame)':<28} {after:>8.2f} s  {count / after * 60:>8.0f} images/min  {stats['submitted']:>4} requests")
+
+    seed(count)
+    started = time.perf_counter()
+    burst_stats = pooled(count, concurrency, bursts=True)
+    burst = time.perf_counter() - started
+    print(f"{'after  (pool, per burst)':<28} {burst:>8.2f} s  {count / burst * 60:>8.0f} images/min  {burst_stats['submitted']:>4} requests")
+    print(
+        f"\npool speedup x{before / after:.1f}, bursts x{before / burst:.1f}; "
+        f"amortized time per alarm {before / alarms * 1000:.0f} / {after / alarms * 1000:.0f} / {burst / alarms * 1000:.0f} ms, "
+        f"failed {stats['failed'] + burst_stats['failed']}"
+    )
+    print(f"http client: {client_stats()}")
+    server.shutdown()
+    repo.get_pool().close_all()
+
+
+if __name__ == "__main__":
+    main()
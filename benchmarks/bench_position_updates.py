@@ -0,0 +1,84 @@
+"""Position simulation cost: per-device UPDATEs vs. the NumPy store + batched flush.
+
+Usage::
+
+    python benchmarks/bench_position_updates.py [devices] [ticks]
+
+Both sides move every online device once per tick. The legacy side mirrors
+the old worker (Python ``random`` per device, one pooled-writer transaction
+per device); the new side runs ``PositionStore.random_walk`` every tick and
+flushes with one ``executemany`` every ``POSITION_FLUSH_INTERVAL_SEC``.
+"""
+
+from __future__ import annotations
+
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+WORKDIR = tempfile.mkdtemp(prefix="forklift-positions-")
+os.chdir(WORKDIR)
+
+from config import POSITION_FLUSH_INTERVAL_SEC, POSITION_MOVE_RANGE, POSITION_UPDATE_INTERVAL_SEC  # noqa: E402
+from backend.repositories import database as repo  # noqa: E402
+from backend.services.positions import PositionStore  # noqa: E402
+
+FLUSH_EVERY_TICKS = max(1, POSITION_FLUSH_INTERVAL_SEC // POSITION_UPDATE_INTERVAL_SEC)
+
+
+def seed(devices):
+    with repo.get_pool().writer() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO devices (device_id, online_status, pos_x, pos_y) VALUES (?, 1, 100, 100)",
+            [(f"FORK-{i:05d}",) for i in range(devices)],
+        )
+        return [dict(row) for row in conn.execute("SELECT device_id, online_status, pos_x, pos_y FROM devices")]
+
+
+def legacy(rows, ticks):
+    for _ in range(ticks):
+        for dev in rows:
+            dev["pos_x"] = max(0, min(1920, dev["pos_x"] + random.uniform(-POSITION_MOVE_RANGE, POSITION_MOVE_RANGE)))
+            dev["pos_y"] = max(0, min(1080, dev["pos_y"] + random.uniform(-POSITION_MOVE_RANGE, POSITION_MOVE_RANGE)))
+            repo.update_device_position(dev["device_id"], dev["pos_x"], dev["pos_y"])
+
+
+def batched(rows, ticks):
+    store = PositionStore()
+    store.load(rows)
+    for tick in range(ticks):
+        store.random_walk(POSITION_MOVE_RANGE)
+        if (tick + 1) % FLUSH_EVERY_TICKS == 0:
+            store.flush(repo.save_device_positions)
+    store.flush(repo.save_device_positions)
+    return store.stats()
+
+
+def main():
+    devices = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    ticks = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    repo.init_db()
+    rows = seed(devices)
+    print(f"{devices} online devices, {ticks} ticks, flush every {FLUSH_EVERY_TICKS} ticks, database under {WORKDIR}")
+
+    started = time.perf_counter()
+    legacy([dict(row) for row in rows], ticks)
+    before = time.perf_counter() - started
+    print(f"{'before (per-device UPDATE)':<32} {before * 1000 / ticks:>10.2f} ms/tick  {devices * ticks:>8} transactions")
+
+    started = time.perf_counter()
+    stats = batched(rows, ticks)
+    after = time.perf_counter() - started
+    print(f"{'after  (NumPy walk + executemany)':<32} {after * 1000 / ticks:>10.2f} ms/tick  {stats['flushes']:>8} transactions")
+    print(f"\nspeedup x{before / after:.0f}")
+    repo.get_pool().close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Month-view trend latency: aggregating raw ``alarms`` rows vs. reading the rollups.
+
+Usage::
+
+    python benchmarks/bench_trend_rollups.py [samples_per_device_per_day]
+
+Seeds a year of history for three devices into a throwaway database.
+"""
+
+from __future__ import annotations
+
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+WORKDIR = tempfile.mkdtemp(prefix="forklift-bench-")
+os.chdir(WORKDIR)
+
+from backend.repositories import database as repo  # noqa: E402
+
+DEVICE_IDS = ["FORK-001", "FORK-002", "FORK-003"]
+
+
+def seed(per_day):
+    repo.init_db()
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    rows = []
+    for day in range(365):
+        base = today - timedelta(days=day)
+        for device_id in DEVICE_IDS:
+            for _ in range(per_day):
+                ts = base + timedelta(seconds=random.randrange(86400))
+                rows.append((device_id, 1 if random.random() < 0.2 else 0, int(ts.timestamp() * 1000)))
+    with repo.get_pool().writer() as conn:
+        conn.executemany("INSERT INTO alarms (device_id, alarm, timestamp) VALUES (?, ?, ?)", rows)
+    repo.rebuild_alarm_rollups()
+    return len(rows)
+
+
+def raw_month_trend():
+    """The pre-rollup query: group raw rows by day."""
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    start = int((today - timedelta(days=29)).timestamp() * 1000)
+    end = int((today + timedelta(days=1)).timestamp() * 1000)
+    placeholders = ",".join(["?"] * len(DEVICE_IDS))
+    with repo.get_pool().reader() as conn:
+        return conn.execute(
+            f"""
+            SELECT device_id, date(timestamp / 1000, 'unixepoch', 'localtime') AS day, COUNT(*) AS alarm_count
+            FROM alarms
+            WHERE device_id IN ({placeholders})
+              AND timestamp >= ? AND timestamp < ?
+              AND alarm = 1
+            GROUP BY device_id, day
+            """,
+            tuple(DEVICE_IDS) + (start, end),
+        ).fetchall()
+
+
+def measure(label, func, iterations=20):
+    func()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    per_call_ms = (time.perf_counter() - started) / iterations * 1000
+    print(f"{label:<32} {per_call_ms:>9.2f} ms/call")
+    return per_call_ms
+
+
+def main():
+    per_day = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rows = seed(per_day)
+    print(f"database: {Path(WORKDIR) / repo.DB_PATH} ({rows} alarm rows)")
+    before = measure("before (raw alarms, month)", raw_month_trend)
+    after = measure("after  (day rollup, month)", lambda: repo.get_alarm_trend_multi_device("month", DEVICE_IDS))
+    measure("after  (hour rollup, day)", lambda: repo.get_alarm_trend_multi_device("day", DEVICE_IDS))
+    print(f"\nmonth view speedup x{before / after:.1f}")
+    repo.get_pool().close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -33,12 +33,74 @@ MQTT_TOPIC = _get_str("MQTT_TOPIC", "factory/forklift/+/alarm")
 # 开发环境默认允许 MQTT 不可用时继续启动 Web，便于纯前端/接口联调。
 MQTT_REQUIRED = _get_bool("MQTT_REQUIRED", False)
 
+# ==============================
+# MQTT 入库队列配置
+# ==============================
+# on_message 只做解析和入队，由独立写线程批量落库（多条消息合并为一个事务提交）。
+INGEST_BATCH_SIZE = _get_int("INGEST_BATCH_SIZE", 200)
+# 攒批最长等待时间（毫秒）：队列不满一批时，最多等这么久就提交。
+INGEST_MAX_LINGER_MS = _get_int("INGEST_MAX_LINGER_MS", 50)
+INGEST_QUEUE_MAXSIZE = _get_int("INGEST_QUEUE_MAXSIZE", 10000)
+# 原始 alarms 记录存储模式：all（每条消息一行）/ transitions（只存状态跃迁，
+# 普通心跳只累加进分钟级汇总计数，与设备 last_seen 一起最多缓冲 HEARTBEAT_FLUSH_INTERVAL_SEC 秒后批量落盘）
+# transitions 需显式开启：开启后不再写心跳原始行，/api/device/{id}/history 改为返回按分钟汇总的记录
+# （多出 samples / alarm_count 字段），rebuild_rollups.py 也无法再从原始记录重建这段时间的汇总
+ALARM_STORAGE_MODE = _get_str("ALARM_STORAGE_MODE", "all")
+HEARTBEAT_FLUSH_INTERVAL_SEC = _get_int("HEARTBEAT_FLUSH_INTERVAL_SEC", 60)
+
+# ==============================
+# 日志写入配置
+# ==============================
+# log_event 只负责入队，由后台线程批量写入日志文件与 all_logs 表。
+LOG_QUEUE_MAXSIZE = _get_int("LOG_QUEUE_MAXSIZE", 10000)
+LOG_BATCH_SIZE = _get_int("LOG_BATCH_SIZE", 500)
+# 攒批最长等待时间（毫秒）
+LOG_FLUSH_INTERVAL_MS = _get_int("LOG_FLUSH_INTERVAL_MS", 200)
+# 队列满时的策略：drop（丢弃并计数，WARNING 及以上级别先等待 LOG_OVERFLOW_WAIT_MS）/ block（阻塞直到有空位）
+LOG_OVERFLOW_POLICY = _get_str("LOG_OVERFLOW_POLICY", "drop")
+LOG_OVERFLOW_WAIT_MS = _get_int("LOG_OVERFLOW_WAIT_MS", 100)
+
+# ==============================
+# 实时推送配置
+# ==============================
+# device_update 合并推送窗口（毫秒）：窗口内多次变更只推送一次；报警跃迁不受此限制，立即推送。
+BROADCAST_INTERVAL_MS = _get_int("BROADCAST_INTERVAL_MS", 500)
+
 # ==============================
 # 数据库配置
 # ==============================
 DB_PATH = "alarm.db"
+# 日志库单独存放，日志写入不与报警入库争抢同一个 SQLite 写锁
+LOG_DB_PATH = _get_str("LOG_DB_PATH", "alarm_logs.db")
 # SQLite 写锁冲突等待时长（毫秒）：给并发写入一点缓冲时间，减少瞬时锁冲突报错。
 DB_BUSY_TIMEOUT_MS = 5000
+# 连接池 PRAGMA（每个长连接只设置一次）
+DB_SYNCHRONOUS = _get_str("DB_SYNCHRONOUS", "NORMAL")
+DB_CACHE_SIZE_KB = _get_int("DB_CACHE_SIZE_KB", 16384)
+DB_MMAP_SIZE_MB = _get_int("DB_MMAP_SIZE_MB", 256)
+DB_TEMP_STORE = _get_str("DB_TEMP_STORE", "MEMORY")
+# 每个连接缓存的预编译语句数量
+DB_CACHED_STATEMENTS = _get_int("DB_CACHED_STATEMENTS", 256)
+# 异步路由/后台任务访问数据库使用的专用线程池大小与单次调用超时（秒）
+DB_EXECUTOR_WORKERS = _get_int("DB_EXECUTOR_WORKERS", 4)
+DB_CALL_TIMEOUT_SEC = _get_int("DB_CALL_TIMEOUT_SEC", 10)
+
+# ==============================
+# 数据保留 / 归档配置
+# ==============================
+# 原始 alarms 明细保留天数：更早的记录先合并进汇总表，再按天导出为 gzip 压缩的 JSONL 归档文件，最后分块删除。
+# 会删除原始明细，默认关闭；已有数据的部署需显式设置 RETENTION_ENABLED=1 才会启用
+RETENTION_ENABLED = _get_bool("RETENTION_ENABLED", False)
+RAW_RETENTION_DAYS = _get_int("RAW_RETENTION_DAYS", 7)
+# 分钟级汇总保留天数，更早的只保留小时/天级汇总
+ROLLUP_MINUTE_RETENTION_DAYS = _get_int("ROLLUP_MINUTE_RETENTION_DAYS", 30)
+RETENTION_INTERVAL_SEC = _get_int("RETENTION_INTERVAL_SEC", 3600)
+# 每个删除事务的行数与事务间的停顿（毫秒），保证入库写线程在块之间能拿到写锁
+RETENTION_CHUNK_SIZE = _get_int("RETENTION_CHUNK_SIZE", 2000)
+RETENTION_CHUNK_PAUSE_MS = _get_int("RETENTION_CHUNK_PAUSE_MS", 50)
+# 每次 incremental_vacuum 回收的页数
+RETENTION_VACUUM_PAGES = _get_int("RETENTION_VACUUM_PAGES", 1000)
+ARCHIVE_DIR = _get_str("ARCHIVE_DIR", "archive")
 
 # ==============================
 # 鉴权配置
@@ -51,7 +113,6 @@ AUTH_ENABLED = False
 # ==============================
 # 设备离线检测配置
 # ==============================
-OFFLINE_CHECK_INTERVAL_SEC = _get_int("OFFLINE_CHECK_INTERVAL_SEC", 5)
 OFFLINE_TIMEOUT_SEC = _get_int("OFFLINE_TIMEOUT_SEC", 10)
 
 # ==============================
@@ -64,7 +125,10 @@ TREND_LIMIT = 20
 # 设备位置模拟配置（仅用于测试）
 # ==============================
 POSITION_UPDATE_INTERVAL_SEC = _get_int("POSITION_UPDATE_INTERVAL_SEC", 5)
+# <= 0 时服务端不模拟移动，而是每次广播前从数据库读取其他进程（如 publish_test.py）写入的位置，也不再写回
 POSITION_MOVE_RANGE = _get_int("POSITION_MOVE_RANGE", 20)
+# 模拟移动时位置在内存中更新，每隔 POSITION_FLUSH_INTERVAL_SEC 秒批量写回数据库
+POSITION_FLUSH_INTERVAL_SEC = _get_int("POSITION_FLUSH_INTERVAL_SEC", 10)
 
 # ==============================
 # 图片上传配置
@@ -84,3 +148,20 @@ LLM_TIMEOUT_SEC = _get_int("LLM_TIMEOUT_SEC", 20)
 LLM_MAX_RETRIES = _get_int("LLM_MAX_RETRIES", 2)
 LLM_POLL_INTERVAL_SEC = _get_int("LLM_POLL_INTERVAL_SEC", 5)
 LLM_RETRY_INTERVAL_SEC = _get_int("LLM_RETRY_INTERVAL_SEC", 60)
+# 并发分析的图片数，以及对 LLM_PROVIDER 的每分钟请求上限（0 表示不限速）
+LLM_CONCURRENCY = _get_int("LLM_CONCURRENCY", 4)
+LLM_RATE_LIMIT_PER_MIN = _get_int("LLM_RATE_LIMIT_PER_MIN", 60)
+# 发送前缩放到最长边 LLM_IMAGE_MAX_EDGE 像素并重新编码（jpeg / webp），结果缓存在原图目录的 .llm/ 下
+LLM_IMAGE_PREPROCESS = _get_bool("LLM_IMAGE_PREPROCESS", True)
+LLM_IMAGE_MAX_EDGE = _get_int("LLM_IMAGE_MAX_EDGE", 1024)
+LLM_IMAGE_FORMAT = _get_str("LLM_IMAGE_FORMAT", "jpeg").lower()
+LLM_IMAGE_QUALITY = _get_int("LLM_IMAGE_QUALITY", 80)
+# 连拍去重：保存图片时计算感知哈希，同一设备 LLM_DEDUP_WINDOW_SEC 秒内汉明距离不超过
+# LLM_DEDUP_MAX_DISTANCE 的图片直接复用已分析图片的描述，不再单独调用 LLM
+LLM_DEDUP_ENABLED = _get_bool("LLM_DEDUP_ENABLED", True)
+LLM_DEDUP_MAX_DISTANCE = _get_int("LLM_DEDUP_MAX_DISTANCE", 8)
+LLM_DEDUP_WINDOW_SEC = _get_int("LLM_DEDUP_WINDOW_SEC", 30)
+# 连拍合并请求：同一设备（同一次报警）LLM_BURST_WINDOW_SEC 秒内的待分析图片最多 LLM_BURST_MAX_IMAGES 张
+# 合并为一次多图请求，分析结果写回组内每张图片（设为 1 则逐张分析）
+LLM_BURST_MAX_IMAGES = _get_int("LLM_BURST_MAX_IMAGES", 4)
+LLM_BURST_WINDOW_SEC = _get_int("LLM_BURST_WINDOW_SEC", 10)
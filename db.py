@@ -6,9 +6,13 @@ import sqlite3
 import json
 import os
 import base64
+import threading
 from datetime import datetime, timedelta
 
-from config import DB_PATH, HISTORY_LIMIT, TREND_LIMIT, DB_BUSY_TIMEOUT_MS, LLM_RETRY_INTERVAL_SEC
+from config import (
+    DB_PATH, HISTORY_LIMIT, TREND_LIMIT, DB_BUSY_TIMEOUT_MS, LLM_RETRY_INTERVAL_SEC,
+    DB_SYNCHRONOUS, DB_CACHE_SIZE_KB, DB_MMAP_SIZE_MB, DB_TEMP_STORE, DB_CACHED_STATEMENTS,
+)
 
 # 图片存储目录
 IMAGE_DIR = "images/alarms"
@@ -27,17 +31,45 @@ def _is_safe_image_path(image_path):
     return abs_path.startswith(IMAGE_BASE_DIR + os.sep)
 
 
+class _PersistentConnection(sqlite3.Connection):
+    """长连接：调用方仍按旧习惯 close()，这里只回滚未提交事务，连接保留复用。"""
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+
+_local = threading.local()
+
+
 def get_db_connection():
-    """获取数据库连接，设置 row_factory 为 Row 以便通过键名访问"""
-    conn = sqlite3.connect(DB_PATH)
+    """获取当前线程复用的数据库连接，设置 row_factory 为 Row 以便通过键名访问"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        return conn
+    conn = sqlite3.connect(DB_PATH, factory=_PersistentConnection, cached_statements=DB_CACHED_STATEMENTS)
     conn.row_factory = sqlite3.Row
+    # PRAGMA 只在建连时设置一次，之后的调用直接复用连接和预编译语句缓存。
     # 使用 WAL 让读写并发更友好，读请求不会轻易被写事务阻塞。
     conn.execute("PRAGMA journal_mode=WAL;")
     # 设置 busy_timeout 后，遇到锁竞争会等待一段时间，降低 database is locked 概率。
     conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS};")
+    conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS};")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB};")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE_MB * 1024 * 1024};")
+    conn.execute(f"PRAGMA temp_store={DB_TEMP_STORE};")
+    _local.conn = conn
     return conn
 
 
+def close_db_connection():
+    """真正关闭当前线程的长连接（例如需要删除/替换数据库文件前）。"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        _local.conn = None
+        sqlite3.Connection.close(conn)
+
+
 def init_db():
     """初始化数据库表结构"""
     conn = get_db_connection()
@@ -0,0 +1,43 @@
+// 设备状态增量同步：连接后请求一次全量快照（带版本号），之后只接收变更的设备记录。
+// 若收到的增量 base_version 与本地版本不连续，则重新请求快照。
+export function subscribeDeviceUpdates(socket, { onSnapshot, onDelta }) {
+  let version = null
+
+  const requestSync = () => {
+    version = null
+    socket.emit('device_sync')
+  }
+
+  socket.on('connect', requestSync)
+
+  socket.on('device_snapshot', (payload) => {
+    version = payload.version
+    onSnapshot?.(payload)
+  })
+
+  socket.on('device_delta', (payload) => {
+    if (version === null) return
+    if (payload.base_version !== version) {
+      requestSync()
+      return
+    }
+    version = payload.version
+    onDelta?.(payload)
+  })
+
+  if (socket.connected) requestSync()
+  return { resync: requestSync }
+}
+
+export function mergeDevices(list, updates) {
+  const next = [...list]
+  updates.forEach((dev) => {
+    const index = next.findIndex(d => d.device_id === dev.device_id)
+    if (index !== -1) {
+      next[index] = { ...next[index], ...dev }
+    } else {
+      next.push(dev)
+    }
+  })
+  return next
+}
@@ -0,0 +1,51 @@
+// 设备位置二进制通道：连接后发送 position_sync，服务端先推送设备索引字典（position_index），
+// 之后每个位置周期只推送一帧 position_frame：
+//   头部 <BHHB>：格式版本、索引代号、设备数、坐标缩放倍数
+//   之后按槽位顺序排列的 uint16 小端 x/y（实际坐标 = 数值 / 缩放倍数）
+// 帧中的索引代号与本地字典不一致时重新请求同步。
+const FRAME_VERSION = 1
+const HEADER_SIZE = 6
+
+export function subscribePositionFrames(socket, onPositions) {
+  let generation = null
+  let deviceIds = []
+
+  const requestSync = () => {
+    generation = null
+    socket.emit('position_sync')
+  }
+
+  socket.on('connect', requestSync)
+
+  socket.on('position_index', (payload) => {
+    generation = payload.generation
+    deviceIds = payload.devices || []
+  })
+
+  socket.on('position_frame', (buffer) => {
+    if (generation === null) return
+    const bytes = buffer instanceof ArrayBuffer ? new Uint8Array(buffer) : new Uint8Array(buffer.buffer, buffer.byteOffset, buffer.byteLength)
+    const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength)
+    if (bytes.byteLength < HEADER_SIZE || view.getUint8(0) !== FRAME_VERSION) return
+    const frameGeneration = view.getUint16(1, true)
+    const count = view.getUint16(3, true)
+    const scale = view.getUint8(5) || 1
+    if (frameGeneration !== generation || count > deviceIds.length) {
+      requestSync()
+      return
+    }
+    const positions = []
+    for (let slot = 0; slot < count; slot++) {
+      const offset = HEADER_SIZE + slot * 4
+      positions.push({
+        device_id: deviceIds[slot],
+        pos_x: view.getUint16(offset, true) / scale,
+        pos_y: view.getUint16(offset + 2, true) / scale
+      })
+    }
+    onPositions(positions)
+  })
+
+  if (socket.connected) requestSync()
+  return { resync: requestSync }
+}
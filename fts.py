@@ -0,0 +1,42 @@
+"""
+全文检索辅助函数（SQLite FTS5 + trigram 分词）
+"""
+
+# trigram 分词只能索引不少于 3 个字符的子串
+MIN_TRIGRAM_CHARS = 3
+
+
+def _terms(query):
+    return [term for term in (query or "").split() if term]
+
+
+def build_match_query(query):
+    """
+    把用户输入转换为 FTS5 MATCH 表达式：每个词按短语原样匹配，多个词需同时命中
+    任一词短于 3 个字符时返回 None，由调用方改用 LIKE
+    """
+    terms = _terms(query)
+    if not terms or any(len(term) < MIN_TRIGRAM_CHARS for term in terms):
+        return None
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def like_patterns(query):
+    """每个词对应一个 LIKE 模式（转义字符为反斜杠）"""
+    return [
+        "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        for term in _terms(query)
+    ]
+
+
+def encode_cursor(score, row_id):
+    """分页游标：上一页最后一条的 (相关度, id)"""
+    return f"{score!r}:{row_id}"
+
+
+def decode_cursor(cursor):
+    """解析游标，空游标返回 (None, None)，格式错误抛出 ValueError"""
+    if not cursor:
+        return None, None
+    score, row_id = cursor.rsplit(":", 1)
+    return float(score), int(row_id)
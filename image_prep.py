@@ -0,0 +1,119 @@
+"""
+发送给 LLM 前的图片预处理：按最长边缩放并重新编码为 JPEG / WebP
+结果缓存在原图同目录的 .llm/ 子目录中，原图更新后自动重新生成
+另提供 64 位感知哈希（pHash），用于识别同一连拍中几乎相同的帧
+"""
+
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from config import LLM_IMAGE_FORMAT, LLM_IMAGE_MAX_EDGE, LLM_IMAGE_QUALITY
+
+CACHE_DIR_NAME = ".llm"
+_FORMATS = {"jpeg": ("JPEG", ".jpg", "image/jpeg"), "webp": ("WEBP", ".webp", "image/webp")}
+
+# pHash：32x32 灰度图做二维 DCT，取左上 8x8 低频系数与中位数比较得到 64 位
+PHASH_SIZE = 32
+PHASH_LOW = 8
+_DCT = np.cos(np.pi * np.outer(np.arange(PHASH_LOW), 2 * np.arange(PHASH_SIZE) + 1) / (2 * PHASH_SIZE))
+
+_stats_lock = threading.Lock()
+_stats = {
+    "prepared": 0,
+    "cache_hits": 0,
+    "fallbacks": 0,
+    "original_bytes": 0,
+    "sent_bytes": 0,
+    "total_prep_ms": 0.0,
+}
+
+
+def _record(**values):
+    with _stats_lock:
+        for key, value in values.items():
+            _stats[key] += value
+
+
+def cache_path(image_path, max_edge=LLM_IMAGE_MAX_EDGE, fmt=LLM_IMAGE_FORMAT, quality=LLM_IMAGE_QUALITY):
+    """缓存文件路径，文件名包含缩放与编码参数，参数变化时不会误用旧缓存"""
+    path = Path(image_path)
+    _, suffix, _ = _FORMATS[fmt]
+    return path.parent / CACHE_DIR_NAME / f"{path.stem}.{max_edge}q{quality}{suffix}"
+
+
+def _encode(source, target, max_edge, fmt, quality):
+    pil_format, _, _ = _FORMATS[fmt]
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        if max_edge > 0:
+            image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(target.name + ".tmp")
+        image.save(tmp, pil_format, quality=quality, optimize=True)
+    tmp.replace(target)
+
+
+def prepare_image(image_path, max_edge=LLM_IMAGE_MAX_EDGE, fmt=LLM_IMAGE_FORMAT, quality=LLM_IMAGE_QUALITY):
+    """
+    返回 (实际发送的文件路径, MIME 类型)
+    缩放后反而更大、或原图无法解码时回退为原图（MIME 为 None，由调用方按扩展名推断）
+    """
+    source = Path(image_path)
+    if fmt not in _FORMATS:
+        return source, None
+    _, _, mime = _FORMATS[fmt]
+    target = cache_path(source, max_edge, fmt, quality)
+    original_size = source.stat().st_size
+    try:
+        if target.exists() and target.stat().st_mtime >= source.stat().st_mtime:
+            _record(cache_hits=1)
+        else:
+            started = time.perf_counter()
+            _encode(source, target, max_edge, fmt, quality)
+            _record(prepared=1, total_prep_ms=(time.perf_counter() - started) * 1000)
+    except (OSError, ValueError):
+        _record(fallbacks=1, original_bytes=original_size, sent_bytes=original_size)
+        return source, None
+    sent_size = target.stat().st_size
+    if sent_size >= original_size:
+        _record(original_bytes=original_size, sent_bytes=original_size)
+        return source, None
+    _record(original_bytes=original_size, sent_bytes=sent_size)
+    return target, mime
+
+
+def stats():
+    with _stats_lock:
+        data = dict(_stats)
+    total_ms = data.pop("total_prep_ms")
+    data["avg_prep_ms"] = round(total_ms / data["prepared"], 1) if data["prepared"] else 0.0
+    data["saved_bytes"] = data["original_bytes"] - data["sent_bytes"]
+    data["saved_ratio"] = round(data["saved_bytes"] / data["original_bytes"], 3) if data["original_bytes"] else 0.0
+    data["max_edge"] = LLM_IMAGE_MAX_EDGE
+    data["format"] = LLM_IMAGE_FORMAT
+    data["quality"] = LLM_IMAGE_QUALITY
+    return data
+
+
+def perceptual_hash(image_path):
+    """64 位感知哈希，转为有符号整数以便直接存入 SQLite INTEGER；无法解码时返回 None"""
+    try:
+        with Image.open(image_path) as image:
+            gray = ImageOps.exif_transpose(image).convert("L").resize((PHASH_SIZE, PHASH_SIZE), Image.Resampling.LANCZOS)
+    except (OSError, ValueError):
+        return None
+    coeffs = (_DCT @ np.asarray(gray, dtype=np.float64) @ _DCT.T).ravel()
+    # 直流分量只反映整体亮度，不参与中位数
+    bits = coeffs > np.median(coeffs[1:])
+    value = int.from_bytes(np.packbits(bits).tobytes(), "big")
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def hamming_distance(a, b):
+    return ((a ^ b) & 0xFFFFFFFFFFFFFFFF).bit_count()
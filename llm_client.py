@@ -1,14 +1,142 @@
-"""LLM client helpers for alarm image analysis."""
+"""LLM client helpers for alarm image analysis.
 
+HTTP clients are created once per process and shared: one keep-alive
+``OpenAI`` client, one ``requests.Session`` for the relay, and their async
+counterparts for callers on the event loop. Each pool holds up to
+``LLM_CONCURRENCY`` connections, and ``client_stats()`` reports how many
+requests reused one.
+"""
+
+import asyncio
 import base64
 import mimetypes
 import re
+import threading
 from urllib.parse import urlparse
 
+import httpx
 import requests
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+from requests.adapters import HTTPAdapter
+
+from config import LLM_CONCURRENCY, LLM_IMAGE_PREPROCESS, LLM_MODEL, OPENAI_API_KEY, OPENAI_BASE_URL, LLM_TIMEOUT_SEC
+from image_prep import prepare_image
+
+_clients_lock = threading.Lock()
+_clients = {}
+_stats = {}
+
+
+class _ConnectionCounter:
+    """httpcore trace hook counting requests and newly opened TCP connections."""
+
+    def __init__(self, name):
+        self.stats = _stats.setdefault(name, {"requests": 0, "connections": 0})
+        self._lock = threading.Lock()
+
+    def __call__(self, event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            key = "connections"
+        elif event_name in ("http11.send_request_headers.started", "http2.send_request_headers.started"):
+            key = "requests"
+        else:
+            return
+        with self._lock:
+            self.stats[key] += 1
+
+    async def trace_async(self, event_name, info):
+        self(event_name, info)
+
+    def hook(self, request):
+        request.extensions["trace"] = self
+
+    async def hook_async(self, request):
+        request.extensions["trace"] = self.trace_async
 
-from config import LLM_MODEL, OPENAI_API_KEY, OPENAI_BASE_URL, LLM_TIMEOUT_SEC
+
+def _http_limits():
+    size = max(1, LLM_CONCURRENCY)
+    return httpx.Limits(max_connections=size, max_keepalive_connections=size)
+
+
+def _get_client(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+
+def _openai_client():
+    counter = _ConnectionCounter("openai")
+    return OpenAI(
+        api_key=OPENAI_API_KEY,
+        base_url=OPENAI_BASE_URL or None,
+        timeout=LLM_TIMEOUT_SEC,
+        http_client=httpx.Client(limits=_http_limits(), event_hooks={"request": [counter.hook]}),
+    )
+
+
+def _async_openai_client():
+    counter = _ConnectionCounter("openai_async")
+    return AsyncOpenAI(
+        api_key=OPENAI_API_KEY,
+        base_url=OPENAI_BASE_URL or None,
+        timeout=LLM_TIMEOUT_SEC,
+        http_client=httpx.AsyncClient(limits=_http_limits(), event_hooks={"request": [counter.hook_async]}),
+    )
+
+
+def _relay_session():
+    session = requests.Session()
+    # pool_block keeps at most LLM_CONCURRENCY sockets open instead of discarding extras after each burst.
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, LLM_CONCURRENCY), pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _async_relay_client():
+    counter = _ConnectionCounter("relay_async")
+    return httpx.AsyncClient(limits=_http_limits(), timeout=LLM_TIMEOUT_SEC, event_hooks={"request": [counter.hook_async]})
+
+
+def client_stats():
+    """Requests sent, connections opened and the reuse ratio for each client created so far."""
+    result = {name: dict(stats) for name, stats in _stats.items()}
+    session = _clients.get("relay")
+    if session is not None:
+        pools = []
+        # Both schemes are mounted on the same adapter.
+        for adapter in {id(adapter): adapter for adapter in session.adapters.values()}.values():
+            manager = adapter.poolmanager
+            pools.extend(manager.pools[key] for key in manager.pools.keys())
+        result["relay"] = {
+            "requests": sum(pool.num_requests for pool in pools),
+            "connections": sum(pool.num_connections for pool in pools),
+        }
+    for stats in result.values():
+        stats["reuse_ratio"] = round(1 - stats["connections"] / stats["requests"], 3) if stats["requests"] else 0.0
+    return result
+
+
+def close_clients():
+    """Close the sync clients (async ones are closed by ``aclose_clients``)."""
+    with _clients_lock:
+        for name in ("openai", "relay"):
+            client = _clients.pop(name, None)
+            if client is not None:
+                client.close()
+
+
+async def aclose_clients():
+    with _clients_lock:
+        clients = [_clients.pop(name, None) for name in ("openai_async", "relay_async")]
+    for client in clients:
+        if client is not None:
+            await client.close() if isinstance(client, AsyncOpenAI) else await client.aclose()
 
 
 def _guess_mime_type(image_path):
@@ -30,9 +158,10 @@ def _is_bitexing_base_url(base_url):
     return hostname.endswith("bitexingai.com")
 
 
-def _build_alarm_prompt():
+def _build_alarm_prompt(frames=1):
+    subject = "这是一张报警图片" if frames == 1 else f"这是同一次报警按时间顺序连拍的{frames}张图片"
     return (
-        "你是一名叉车作业安全分析助手。已知这是一张报警图片，"
+        f"你是一名叉车作业安全分析助手。已知{subject}，"
         "报警原因固定为“行人离叉车过近”，且摄像头安装在叉车上。"
         "请只输出一句中文短语，20个字以内，概括行人为什么没有及时注意到叉车。"
         "优先概括为：低头作业、背对叉车、被货物遮挡、通道视线受阻、正在搬运等。"
@@ -58,10 +187,9 @@ def _extract_chat_completion_text(payload):
     return ""
 
 
-def _analyze_with_bitexing_relay(data_url):
+def _relay_request(data_urls):
     if not OPENAI_BASE_URL:
         raise RuntimeError("OPENAI_BASE_URL is not set")
-
     url = OPENAI_BASE_URL.rstrip("/") + "/chat/completions"
     payload = {
         "model": LLM_MODEL,
@@ -69,8 +197,8 @@ def _analyze_with_bitexing_relay(data_url):
             {
                 "role": "user",
                 "content": [
-                    {"type": "text", "text": _build_alarm_prompt()},
-                    {"type": "image_url", "image_url": data_url},
+                    {"type": "text", "text": _build_alarm_prompt(len(data_urls))},
+                    *({"type": "image_url", "image_url": data_url} for data_url in data_urls),
                 ],
             }
         ],
@@ -81,62 +209,109 @@ def _analyze_with_bitexing_relay(data_url):
         "Authorization": f"Bearer {OPENAI_API_KEY}",
         "Content-Type": "application/json",
     }
-    response = requests.post(url, headers=headers, json=payload, timeout=LLM_TIMEOUT_SEC)
-    if response.status_code == 468:
-        raise RuntimeError("Relay blocked image request (HTTP 468)")
-    if response.status_code >= 400:
-        raise RuntimeError(f"Relay request failed ({response.status_code}): {response.text[:300]}")
+    return url, headers, payload
 
-    payload = response.json()
-    text = _extract_chat_completion_text(payload)
+
+def _relay_result(status_code, text, payload_factory):
+    if status_code == 468:
+        raise RuntimeError("Relay blocked image request (HTTP 468)")
+    if status_code >= 400:
+        raise RuntimeError(f"Relay request failed ({status_code}): {text[:300]}")
+    text = _extract_chat_completion_text(payload_factory())
     if not text:
         raise RuntimeError("Empty response from relay chat completions")
     return _shorten_analysis_text(text)
 
 
-def analyze_alarm_image(image_path):
-    """
-    Call the multimodal model to analyze why the pedestrian may not have
-    noticed the forklift in an alarm image.
-    """
+def _analyze_with_bitexing_relay(data_urls):
+    url, headers, payload = _relay_request(data_urls)
+    response = _get_client("relay", _relay_session).post(url, headers=headers, json=payload, timeout=LLM_TIMEOUT_SEC)
+    return _relay_result(response.status_code, response.text, response.json)
+
+
+async def _analyze_with_bitexing_relay_async(data_urls):
+    url, headers, payload = _relay_request(data_urls)
+    response = await _get_client("relay_async", _async_relay_client).post(url, headers=headers, json=payload)
+    return _relay_result(response.status_code, response.text, response.json)
+
+
+def _image_data_url(image_path):
     if not OPENAI_API_KEY:
         raise RuntimeError("OPENAI_API_KEY is not set")
-
+    mime = None
+    if LLM_IMAGE_PREPROCESS:
+        # Send the downscaled cached copy; falls back to the original if it cannot be decoded.
+        image_path, mime = prepare_image(image_path)
     with open(image_path, "rb") as f:
         image_bytes = f.read()
-
-    mime = _guess_mime_type(image_path)
+    mime = mime or _guess_mime_type(str(image_path))
     b64 = base64.b64encode(image_bytes).decode("ascii")
-    data_url = f"data:{mime};base64,{b64}"
-    prompt = _build_alarm_prompt()
+    return f"data:{mime};base64,{b64}"
 
-    if OPENAI_BASE_URL and _is_bitexing_base_url(OPENAI_BASE_URL):
-        return _analyze_with_bitexing_relay(data_url)
 
-    client = OpenAI(
-        api_key=OPENAI_API_KEY,
-        base_url=OPENAI_BASE_URL or None,
-        timeout=LLM_TIMEOUT_SEC,
-    )
-    response = client.responses.create(
-        model=LLM_MODEL,
-        input=[
-            {
-                "role": "user",
-                "content": [
-                    {"type": "input_text", "text": prompt},
-                    {"type": "input_image", "image_url": data_url},
-                ],
-            }
-        ],
-    )
+def _responses_input(data_urls):
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "input_text", "text": _build_alarm_prompt(len(data_urls))},
+                *({"type": "input_image", "image_url": data_url} for data_url in data_urls),
+            ],
+        }
+    ]
+
 
+def _responses_result(response):
     text = (response.output_text or "").strip()
     if not text:
         raise RuntimeError("Empty response from LLM")
     return _shorten_analysis_text(text)
 
 
+def _uses_relay():
+    return bool(OPENAI_BASE_URL and _is_bitexing_base_url(OPENAI_BASE_URL))
+
+
+def analyze_alarm_images(image_paths):
+    """
+    Call the multimodal model to analyze why the pedestrian may not have
+    noticed the forklift. ``image_paths`` are the frames of one alarm burst
+    in time order; they go out in a single request and share one answer.
+    """
+    data_urls = [_image_data_url(image_path) for image_path in image_paths]
+    if not data_urls:
+        raise ValueError("no images to analyze")
+    if _uses_relay():
+        return _analyze_with_bitexing_relay(data_urls)
+    client = _get_client("openai", _openai_client)
+    return _responses_result(client.responses.create(model=LLM_MODEL, input=_responses_input(data_urls)))
+
+
+async def analyze_alarm_images_async(image_paths):
+    """Event-loop variant of :func:`analyze_alarm_images` on the shared async clients.
+
+    Reading, decoding and downscaling the images runs in a worker thread so
+    the loop only awaits the request. The async clients belong to the loop
+    that first uses them.
+    """
+    data_urls = await asyncio.to_thread(lambda: [_image_data_url(image_path) for image_path in image_paths])
+    if not data_urls:
+        raise ValueError("no images to analyze")
+    if _uses_relay():
+        return await _analyze_with_bitexing_relay_async(data_urls)
+    client = _get_client("openai_async", _async_openai_client)
+    return _responses_result(await client.responses.create(model=LLM_MODEL, input=_responses_input(data_urls)))
+
+
+def analyze_alarm_image(image_path):
+    """Single-frame form of :func:`analyze_alarm_images`."""
+    return analyze_alarm_images([image_path])
+
+
+async def analyze_alarm_image_async(image_path):
+    return await analyze_alarm_images_async([image_path])
+
+
 def describe_image(image_path):
     """Backward-compatible alias for older callers."""
     return analyze_alarm_image(image_path)
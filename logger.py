@@ -1,17 +1,33 @@
-import logging
+import atexit
 import json
+import logging
 import os
+import queue
 import sqlite3
-from datetime import datetime
+import sys
+import threading
+import time
 
-# 从根目录配置导入DB_PATH
+# 从根目录配置导入DB_PATH / LOG_DB_PATH
 try:
-    from config import DB_PATH
+    from config import (
+        DB_BUSY_TIMEOUT_MS, DB_PATH, LOG_BATCH_SIZE, LOG_DB_PATH, LOG_FLUSH_INTERVAL_MS,
+        LOG_OVERFLOW_POLICY, LOG_OVERFLOW_WAIT_MS, LOG_QUEUE_MAXSIZE,
+    )
+    from fts import build_match_query, decode_cursor, encode_cursor, like_patterns
+    from timeutil import format_ms, now_ms, parse_ms
 except ImportError:
     # 兼容单独运行此脚本的情况
-    import sys
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    from config import DB_PATH
+    from config import (
+        DB_BUSY_TIMEOUT_MS, DB_PATH, LOG_BATCH_SIZE, LOG_DB_PATH, LOG_FLUSH_INTERVAL_MS,
+        LOG_OVERFLOW_POLICY, LOG_OVERFLOW_WAIT_MS, LOG_QUEUE_MAXSIZE,
+    )
+    from fts import build_match_query, decode_cursor, encode_cursor, like_patterns
+    from timeutil import format_ms, now_ms, parse_ms
+
+# 日志写入线程自身出错时不能再走 log_event（会写回同一个队列），改用标准 logging 报告
+_internal_log = logging.getLogger(__name__)
 
 # =========================
 # 日志存储配置
@@ -21,20 +37,13 @@ os.makedirs(LOG_DIR, exist_ok=True)
 LOG_FILE = os.path.join(LOG_DIR, "ops.log")
 READABLE_LOG_FILE = os.path.join(LOG_DIR, "readable.log")
 
-# =========================
-# logger 对象
-# =========================
-logger = logging.getLogger("forklift")
-logger.setLevel(logging.DEBUG)  # DEBUG 级别可在开发时打开
-file_handler = logging.FileHandler(LOG_FILE, encoding="utf-8")
-formatter = logging.Formatter('%(message)s')
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
+# 只等待、不丢弃的级别（drop 策略下队列满时先等待 LOG_OVERFLOW_WAIT_MS）
+IMPORTANT_LEVELS = {"WARNING", "ERROR", "CRITICAL"}
 
 
-def append_readable_log(ts, level, event, category, module, message, device_id=None,
-                        request_id=None, sid=None, topic=None, error=None, extra=None):
-    """追加一份便于直接阅读的纯文本日志。"""
+def format_readable_line(ts, level, event, category, module, message, device_id=None,
+                         request_id=None, sid=None, topic=None, error=None, extra=None):
+    """生成一行便于直接阅读的纯文本日志。"""
     parts = [
         f"[{ts}]",
         level,
@@ -55,20 +64,214 @@ def append_readable_log(ts, level, event, category, module, message, device_id=N
         line += f" | error={error}"
     if extra:
         line += f" | extra={json.dumps(extra, ensure_ascii=False, sort_keys=True)}"
+    return line
+
+
+def _format_json_line(ts, level, event, category, module, message, device_id=None,
+                      request_id=None, sid=None, topic=None, error=None, extra=None):
+    log_data = {
+        "ts": ts,
+        "level": level,
+        "event": event,
+        "category": category,
+        "module": module,
+        "message": message
+    }
+    if device_id:
+        log_data["device_id"] = device_id
+    if request_id:
+        log_data["request_id"] = request_id
+    if sid:
+        log_data["sid"] = sid
+    if topic:
+        log_data["topic"] = topic
+    if error:
+        log_data["error"] = str(error)
+    if extra:
+        log_data.update(extra)
+    return json.dumps(log_data, ensure_ascii=False)
 
-    with open(READABLE_LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(line + "\n")
 
 # =========================
-# Biz 日志入库
+# 异步批量写入
 # =========================
-def save_log(ts, level, event, category, device_id, message, extra=None):
+_STOP = object()
+
+
+class LogSink:
     """
-    保存日志到 SQLite 数据库（支持 ops/biz/sec 所有分类）
+    后台日志写入线程
+    log_event 只把记录放入有界队列；本线程攒批后通过常开的文件句柄写 ops.log / readable.log，
+    并用一个长连接 executemany 写入日志库（LOG_DB_PATH）的 all_logs 表（每批一次提交）。
+    本线程是日志库唯一的写入者。
     """
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
+
+    def __init__(self, maxsize=LOG_QUEUE_MAXSIZE, batch_size=LOG_BATCH_SIZE,
+                 flush_interval_ms=LOG_FLUSH_INTERVAL_MS, overflow_policy=LOG_OVERFLOW_POLICY,
+                 overflow_wait_ms=LOG_OVERFLOW_WAIT_MS):
+        self._queue = queue.Queue(maxsize=max(0, maxsize))
+        self.batch_size = max(1, batch_size)
+        self.flush_interval_sec = max(0, flush_interval_ms) / 1000.0
+        self.overflow_policy = overflow_policy if overflow_policy in ("drop", "block") else "drop"
+        self.overflow_wait_sec = max(0, overflow_wait_ms) / 1000.0
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"enqueued": 0, "written": 0, "dropped": 0, "failed": 0, "batches": 0, "migration_failed": 0}
+
+    def ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="log-sink", daemon=True)
+                self._thread.start()
+
+    def submit(self, record, level="INFO"):
+        """入队一条日志记录；队列满时按 overflow_policy 处理，返回是否入队成功。"""
+        self.ensure_started()
+        try:
+            if self.overflow_policy == "block":
+                self._queue.put(record)
+            elif level in IMPORTANT_LEVELS and self.overflow_wait_sec > 0:
+                self._queue.put(record, timeout=self.overflow_wait_sec)
+            else:
+                self._queue.put_nowait(record)
+        except queue.Full:
+            with self._stats_lock:
+                self._stats["dropped"] += 1
+            return False
+        with self._stats_lock:
+            self._stats["enqueued"] += 1
+        return True
+
+    def flush(self, timeout=5.0):
+        """等待此前入队的日志全部落盘。"""
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def stop(self, timeout=5.0):
+        """写完剩余日志并停止后台线程。"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        thread.join(timeout=timeout)
+        self._thread = None
+
+    def stats(self):
+        with self._stats_lock:
+            data = dict(self._stats)
+        data["queue_depth"] = self._queue.qsize()
+        data["overflow_policy"] = self.overflow_policy
+        return data
+
+    def _collect_batch(self, first):
+        batch, markers = [], []
+        item = first
+        deadline = time.monotonic() + self.flush_interval_sec
+        while True:
+            if item is _STOP:
+                return batch, markers, True
+            if isinstance(item, threading.Event):
+                # flush 标记：立即写出当前批次
+                markers.append(item)
+                return batch, markers, False
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                return batch, markers, False
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                return batch, markers, False
+
+    def _run(self):
+        ops_file = open(LOG_FILE, "a", encoding="utf-8")
+        readable_file = open(READABLE_LOG_FILE, "a", encoding="utf-8")
+        conn = None
+        try:
+            conn = _connect_log_db()
+            try:
+                _migrate_legacy_logs(conn)
+            except sqlite3.Error as exc:
+                with self._stats_lock:
+                    self._stats["migration_failed"] += 1
+                _internal_log.error("log sink: legacy log migration failed: %s", exc)
+            stopping = False
+            while not stopping:
+                batch, markers, stopping = self._collect_batch(self._queue.get())
+                if batch:
+                    try:
+                        self._write(batch, ops_file, readable_file, conn)
+                    except Exception as exc:
+                        with self._stats_lock:
+                            self._stats["failed"] += len(batch)
+                        _internal_log.error("log sink: failed to write %d log records: %s", len(batch), exc)
+                for marker in markers:
+                    marker.set()
+        finally:
+            ops_file.close()
+            readable_file.close()
+            if conn is not None:
+                conn.close()
+
+    def _write(self, batch, ops_file, readable_file, conn):
+        rows = []
+        counters = {}
+        for args, kwargs in batch:
+            ops_file.write(_format_json_line(*args, **kwargs) + "\n")
+            readable_file.write(format_readable_line(*args, **kwargs) + "\n")
+            ts, level, event, category, _module, message = args
+            extra = kwargs.get("extra")
+            rows.append((ts, level, event, category, kwargs.get("device_id"), message,
+                         json.dumps(extra, ensure_ascii=False) if extra else None))
+            key = _counter_key(category, level, kwargs.get("device_id"))
+            counters[key] = counters.get(key, 0) + 1
+        ops_file.flush()
+        readable_file.flush()
+        try:
+            conn.executemany("""
+                INSERT INTO all_logs (ts, level, event, category, device_id, message, extra)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            conn.executemany("""
+                INSERT INTO log_counters (category, level, device_id, count)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(category, level, device_id) DO UPDATE SET count = count + excluded.count
+            """, [key + (count,) for key, count in counters.items()])
+            conn.commit()
+        except sqlite3.Error as exc:
+            conn.rollback()
+            with self._stats_lock:
+                self._stats["failed"] += len(rows)
+            _internal_log.error("log sink: failed to write %d log rows to SQLite: %s", len(rows), exc)
+            return
+        with self._stats_lock:
+            self._stats["written"] += len(rows)
+            self._stats["batches"] += 1
+
+
+LOG_TABLES = {
+    "all_logs": ("ts", "level", "event", "category", "device_id", "message", "extra"),
+    "biz_logs": ("ts", "level", "event", "device_id", "message", "extra"),
+}
+
+
+def _ensure_log_schema(conn):
+    counters_exist = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='log_counters'"
+    ).fetchone()
+    conn.execute("""
         CREATE TABLE IF NOT EXISTS all_logs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             ts TEXT,
@@ -80,15 +283,183 @@ def save_log(ts, level, event, category, device_id, message, extra=None):
             extra TEXT
         )
     """)
-    cursor.execute("""
-        INSERT INTO all_logs (ts, level, event, category, device_id, message, extra)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, (ts, level, event, category, device_id, message, json.dumps(extra, ensure_ascii=False) if extra else None))
-    conn.commit()
-    conn.close()
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS biz_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts TEXT,
+            level TEXT,
+            event TEXT,
+            device_id TEXT,
+            message TEXT,
+            extra TEXT
+        )
+    """)
+    # 分页筛选用的组合索引（均以 id 结尾，支持按 id 游标翻页）
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_all_logs_category_level ON all_logs(category, level, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_all_logs_level ON all_logs(level, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_all_logs_device ON all_logs(device_id, id)")
+    # 按 (分类, 级别, 设备) 增量维护的条数计数，分页总数直接汇总此表，无需 COUNT(*) 全表
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS log_counters (
+            category TEXT NOT NULL,
+            level TEXT NOT NULL,
+            device_id TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (category, level, device_id)
+        ) WITHOUT ROWID
+    """)
+    if not counters_exist:
+        _rebuild_log_counters(conn)
+    _ensure_log_fts(conn)
+
+
+def _ensure_log_fts(conn):
+    """
+    all_logs 的全文索引（FTS5 trigram 分词，中文可按任意 3 字以上子串检索），由触发器与 all_logs 保持同步。
+    当前 SQLite 未编译 FTS5 时跳过，搜索退化为 LIKE。
+    """
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name='all_logs_fts'").fetchone():
+        return
+    try:
+        conn.execute("""
+            CREATE VIRTUAL TABLE all_logs_fts USING fts5(
+                message, event, device_id,
+                content='all_logs', content_rowid='id', tokenize='trigram'
+            )
+        """)
+    except sqlite3.OperationalError:
+        return
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS all_logs_fts_ai AFTER INSERT ON all_logs BEGIN
+            INSERT INTO all_logs_fts (rowid, message, event, device_id)
+            VALUES (new.id, new.message, new.event, new.device_id);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS all_logs_fts_ad AFTER DELETE ON all_logs BEGIN
+            INSERT INTO all_logs_fts (all_logs_fts, rowid, message, event, device_id)
+            VALUES ('delete', old.id, old.message, old.event, old.device_id);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS all_logs_fts_au AFTER UPDATE ON all_logs BEGIN
+            INSERT INTO all_logs_fts (all_logs_fts, rowid, message, event, device_id)
+            VALUES ('delete', old.id, old.message, old.event, old.device_id);
+            INSERT INTO all_logs_fts (rowid, message, event, device_id)
+            VALUES (new.id, new.message, new.event, new.device_id);
+        END
+    """)
+    conn.execute("INSERT INTO all_logs_fts (all_logs_fts) VALUES ('rebuild')")
+
+
+def _rebuild_log_counters(conn):
+    """根据 all_logs 全量重建 log_counters。"""
+    conn.execute("DELETE FROM log_counters")
+    conn.execute("""
+        INSERT INTO log_counters (category, level, device_id, count)
+        SELECT COALESCE(category, ''), COALESCE(level, ''), COALESCE(device_id, ''), COUNT(*)
+        FROM all_logs
+        GROUP BY 1, 2, 3
+    """)
+
+
+def _counter_key(category, level, device_id):
+    return (category or "", level or "", device_id or "")
+
+
+def _local_log_ts(ts):
+    """
+    旧版日志的 ts 是 UTC ISO 字符串（如 2024-05-01T08:00:00.123456Z），转为本地 'YYYY-MM-DD HH:MM:SS'
+    已是本地格式的原样返回
+    """
+    if not ts or "T" not in ts:
+        return ts
+    ms = parse_ms(ts)
+    return format_ms(ms) if ms is not None else ts
+
+
+def _migrate_legacy_logs(conn):
+    """
+    一次性迁移：把旧版写在报警库（DB_PATH）中的 all_logs / biz_logs 行搬到日志库，
+    然后删除报警库中的这两张表。写入线程在处理第一批日志前执行本迁移，旧行按原 id 顺序写入；
+    若日志库中已有记录，则按时间合并重排。
+    ts 在复制时统一转为本地时间格式，时间范围筛选与游标分页按字符串比较才能排对。
+    """
+    if not os.path.exists(DB_PATH) or os.path.abspath(DB_PATH) == os.path.abspath(LOG_DB_PATH):
+        return
+    conn.create_function("local_log_ts", 1, _local_log_ts, deterministic=True)
+    conn.execute("ATTACH DATABASE ? AS legacy", (DB_PATH,))
+    try:
+        for table, columns in LOG_TABLES.items():
+            exists = conn.execute(
+                "SELECT 1 FROM legacy.sqlite_master WHERE type='table' AND name=?", (table,)
+            ).fetchone()
+            if not exists:
+                continue
+            column_list = ", ".join(columns)
+            select_list = ", ".join("local_log_ts(ts) AS ts" if column == "ts" else column for column in columns)
+            if conn.execute(f"SELECT 1 FROM main.{table} LIMIT 1").fetchone():
+                # 日志库已有记录（例如上次迁移失败后写入线程照常写了新日志）：旧行直接追加会拿到比新行更大的 id，
+                # 按 id 游标分页就会乱序。这里按时间把两边合并后整表重写，id 顺序重新与时间一致
+                conn.execute(f"""
+                    CREATE TEMP TABLE merged_logs AS
+                    SELECT {column_list} FROM (
+                        SELECT {select_list}, 0 AS src, id AS src_id FROM legacy.{table}
+                        UNION ALL
+                        SELECT {column_list}, 1, id FROM main.{table}
+                    )
+                    ORDER BY ts, src, src_id
+                """)
+                conn.execute(f"DELETE FROM main.{table}")
+                conn.execute(
+                    f"INSERT INTO main.{table} ({column_list}) SELECT {column_list} FROM temp.merged_logs ORDER BY rowid"
+                )
+                conn.execute("DROP TABLE temp.merged_logs")
+            else:
+                conn.execute(
+                    f"INSERT INTO main.{table} ({column_list}) SELECT {select_list} FROM legacy.{table} ORDER BY id"
+                )
+            conn.execute(f"DROP TABLE legacy.{table}")
+            if table == "all_logs":
+                _rebuild_log_counters(conn)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("DETACH DATABASE legacy")
+
+
+def _connect_log_db(read_only=False):
+    conn = sqlite3.connect(LOG_DB_PATH)
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS};")
+    if not read_only:
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        _ensure_log_schema(conn)
+        conn.commit()
+    return conn
+
+
+_sink = LogSink()
+atexit.register(_sink.stop)
+
+
+def flush_logs(timeout=5.0):
+    """等待已入队日志写完（用于关闭前或需要立即查询日志的场景）。"""
+    return _sink.flush(timeout)
+
+
+def shutdown_logs(timeout=5.0):
+    """写完剩余日志并停止后台写入线程。"""
+    _sink.stop(timeout)
+
+
+def log_sink_stats():
+    return _sink.stats()
 
 def get_latest_biz_logs(limit=100):
-    conn = sqlite3.connect(DB_PATH)
+    conn = _connect_log_db(read_only=True)
     cursor = conn.cursor()
     # 检查表是否存在以防首次运行报错
     cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='biz_logs'")
@@ -112,25 +483,65 @@ def get_latest_biz_logs(limit=100):
         })
     return logs
 
-def get_logs_by_page(page=1, page_size=20, level=None, device_id=None, category=None):
+def _log_row_to_dict(r):
+    return {
+        "id": r[0],
+        "ts": r[1],
+        "level": r[2],
+        "event": r[3],
+        "category": r[4],
+        "device_id": r[5],
+        "message": r[6],
+        "extra": json.loads(r[7]) if r[7] else {}
+    }
+
+
+def _table_exists(cursor, name):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,))
+    return cursor.fetchone() is not None
+
+
+def _count_logs(cursor, level=None, device_id=None, category=None):
+    """从 log_counters 汇总筛选条件下的总条数。"""
+    conditions = []
+    params = []
+    if level:
+        conditions.append("level = ?")
+        params.append(level)
+    if device_id:
+        conditions.append("device_id = ?")
+        params.append(device_id)
+    if category:
+        conditions.append("category = ?")
+        params.append(category)
+    where_clause = " AND ".join(conditions) if conditions else "1=1"
+    cursor.execute(f"SELECT COALESCE(SUM(count), 0) FROM log_counters WHERE {where_clause}", params)
+    return cursor.fetchone()[0]
+
+
+def get_logs_by_page(page=1, page_size=20, level=None, device_id=None, category=None,
+                     before_id=None, after_id=None):
     """
-    分页查询日志（支持 ops/biz/sec 所有分类）
+    分页查询日志（支持 ops/biz/sec 所有分类），按 id 倒序（最新的在前）
+    推荐使用游标翻页：before_id 取上一页最后一条的 id（下一页），after_id 取第一条的 id（上一页）；
+    两者都未提供时按 page 定位（兼容旧接口，深页较慢）。
     :param page: 页码（从1开始）
     :param page_size: 每页条数
     :param level: 日志级别筛选（可选，如 INFO/WARNING/ERROR）
     :param device_id: 设备ID筛选（可选）
     :param category: 分类筛选（可选，ops/biz/sec）
-    :return: {logs: 日志列表, total: 总条数, total_pages: 总页数}
+    :param before_id: 只返回 id 小于该值的日志（可选）
+    :param after_id: 只返回 id 大于该值的日志（可选）
+    :return: {logs, total, total_pages, next_before_id, prev_after_id, has_more}
     """
-    conn = sqlite3.connect(DB_PATH)
+    conn = _connect_log_db(read_only=True)
     cursor = conn.cursor()
-    
+
     # 检查表是否存在
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='all_logs'")
-    if not cursor.fetchone():
+    if not _table_exists(cursor, "all_logs"):
         conn.close()
-        return {"logs": [], "total": 0, "total_pages": 0}
-    
+        return {"logs": [], "total": 0, "total_pages": 0, "next_before_id": None, "prev_after_id": None, "has_more": False}
+
     # 构建 WHERE 条件
     conditions = []
     params = []
@@ -143,97 +554,140 @@ def get_logs_by_page(page=1, page_size=20, level=None, device_id=None, category=
     if category:
         conditions.append("category = ?")
         params.append(category)
-    
+
+    # 多取一条用于判断是否还有下一页/上一页
+    if after_id is not None:
+        conditions.append("id > ?")
+        params.append(after_id)
+        order, offset = "ASC", 0
+    else:
+        if before_id is not None:
+            conditions.append("id < ?")
+            params.append(before_id)
+            offset = 0
+        else:
+            offset = (max(1, page) - 1) * page_size
+        order = "DESC"
     where_clause = " AND ".join(conditions) if conditions else "1=1"
-    
-    # 查询总条数
-    cursor.execute(f"SELECT COUNT(*) FROM all_logs WHERE {where_clause}", params)
-    total = cursor.fetchone()[0]
-    
-    # 计算总页数
-    total_pages = (total + page_size - 1) // page_size if total > 0 else 0
-    
-    # 分页查询日志（按ID倒序，最新的在前）
-    offset = (page - 1) * page_size
-    query = f"""
+    cursor.execute(f"""
         SELECT * FROM all_logs
         WHERE {where_clause}
-        ORDER BY id DESC
+        ORDER BY id {order}
         LIMIT ? OFFSET ?
-    """
-    cursor.execute(query, params + [page_size, offset])
-    
+    """, params + [page_size + 1, offset])
     rows = cursor.fetchall()
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if after_id is not None:
+        rows.reverse()
+
+    total = _count_logs(cursor, level, device_id, category) if _table_exists(cursor, "log_counters") else 0
     conn.close()
-    
-    logs = []
-    for r in rows:
-        logs.append({
-            "id": r[0],
-            "ts": r[1],
-            "level": r[2],
-            "event": r[3],
-            "category": r[4],
-            "device_id": r[5],
-            "message": r[6],
-            "extra": json.loads(r[7]) if r[7] else {}
-        })
-    
+
+    logs = [_log_row_to_dict(r) for r in rows]
     return {
         "logs": logs,
         "total": total,
-        "total_pages": total_pages
+        "total_pages": (total + page_size - 1) // page_size if total > 0 else 0,
+        "next_before_id": logs[-1]["id"] if logs else None,
+        "prev_after_id": logs[0]["id"] if logs else None,
+        # after_id 翻页时表示更新的方向是否还有数据，其余情况表示更旧的方向
+        "has_more": has_more,
     }
 
 
+def search_logs(query, start=None, end=None, category=None, device_id=None, cursor=None, limit=20):
+    """
+    全文检索日志（message / event / device_id），按相关度（bm25）排序
+    :param query: 关键词，空白分隔的多个词需同时命中
+    :param start: 起始时间（含），本地时间字符串 'YYYY-MM-DD HH:MM:SS'
+    :param end: 结束时间（不含）
+    :param category: 分类筛选（可选）
+    :param device_id: 设备ID筛选（可选）
+    :param cursor: 上一页返回的 next_cursor
+    :return: {items, next_cursor, mode}；mode 为 fts 或 like（关键词短于 3 个字时无法走 trigram 索引）
+    """
+    conn = _connect_log_db(read_only=True)
+    db_cursor = conn.cursor()
+    if not _table_exists(db_cursor, "all_logs"):
+        conn.close()
+        return {"items": [], "next_cursor": None, "mode": "fts"}
+    conditions = []
+    params = []
+    if start:
+        conditions.append("l.ts >= ?")
+        params.append(start)
+    if end:
+        conditions.append("l.ts < ?")
+        params.append(end)
+    if category:
+        conditions.append("l.category = ?")
+        params.append(category)
+    if device_id:
+        conditions.append("l.device_id = ?")
+        params.append(device_id)
+    after_score, after_id = decode_cursor(cursor)
+    match = build_match_query(query)
+    if match and _table_exists(db_cursor, "all_logs_fts"):
+        mode = "fts"
+        where_clause = " AND ".join(["all_logs_fts MATCH ?"] + conditions)
+        sql = f"""
+            SELECT * FROM (
+                SELECT l.*, bm25(all_logs_fts) AS score
+                FROM all_logs_fts JOIN all_logs l ON l.id = all_logs_fts.rowid
+                WHERE {where_clause}
+            )
+        """
+        params = [match] + params
+    else:
+        mode = "like"
+        for pattern in like_patterns(query):
+            conditions.append("(l.message LIKE ? ESCAPE '\\' OR l.event LIKE ? ESCAPE '\\' OR l.device_id LIKE ? ESCAPE '\\')")
+            params.extend([pattern] * 3)
+        where_clause = " AND ".join(conditions) if conditions else "1=1"
+        sql = f"SELECT * FROM (SELECT l.*, 0.0 AS score FROM all_logs l WHERE {where_clause})"
+    if after_id is not None:
+        sql += " WHERE score > ? OR (score = ? AND id < ?)"
+        params.extend([after_score, after_score, after_id])
+    sql += " ORDER BY score ASC, id DESC LIMIT ?"
+    params.append(limit + 1)
+    rows = db_cursor.execute(sql, params).fetchall()
+    conn.close()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    items = []
+    for r in rows:
+        item = _log_row_to_dict(r)
+        item["score"] = r[8]
+        items.append(item)
+    next_cursor = encode_cursor(rows[-1][8], rows[-1][0]) if has_more and rows else None
+    return {"items": items, "next_cursor": next_cursor, "mode": mode}
+
+
 # 兼容旧接口别名
-def get_biz_logs_by_page(page=1, page_size=20, level=None, device_id=None):
+def get_biz_logs_by_page(page=1, page_size=20, level=None, device_id=None, before_id=None, after_id=None):
     """兼容旧接口：默认查询 biz 日志"""
-    return get_logs_by_page(page, page_size, level, device_id, category="biz")
+    return get_logs_by_page(page, page_size, level, device_id, category="biz", before_id=before_id, after_id=after_id)
 
 # =========================
 # 统一日志接口
 # =========================
 def log_event(level, event, category, module, message, device_id=None, request_id=None,
               sid=None, topic=None, error=None, extra=None):
-    ts = datetime.utcnow().isoformat() + "Z"
-    log_data = {
-        "ts": ts,
-        "level": level,
-        "event": event,
-        "category": category,
-        "module": module,
-        "message": message
-    }
-    if device_id:
-        log_data["device_id"] = device_id
-    if request_id:
-        log_data["request_id"] = request_id
-    if sid:
-        log_data["sid"] = sid
-    if topic:
-        log_data["topic"] = topic
-    if error:
-        log_data["error"] = str(error)
-    if extra:
-        log_data.update(extra)
-
-    # 写到日志文件
-    getattr(logger, level.lower(), logger.info)(json.dumps(log_data, ensure_ascii=False))
-    append_readable_log(
-        ts,
+    """记录一条日志：只入队，由后台线程写入 ops.log / readable.log 与 all_logs 表（ops/biz/sec）。"""
+    # 与业务数据使用同一时钟与本地时间格式，避免 UTC/本地时间混用
+    ts = format_ms(now_ms())
+    _sink.submit(
+        (
+            (ts, level, event, category, module, message),
+            {
+                "device_id": device_id,
+                "request_id": request_id,
+                "sid": sid,
+                "topic": topic,
+                "error": error,
+                "extra": extra,
+            },
+        ),
         level,
-        event,
-        category,
-        module,
-        message,
-        device_id=device_id,
-        request_id=request_id,
-        sid=sid,
-        topic=topic,
-        error=error,
-        extra=extra,
     )
-
-    # 所有分类日志都写入 SQLite（ops/biz/sec）
-    save_log(ts, level, event, category, device_id, message, extra)
@@ -0,0 +1,22 @@
+"""Rebuild the alarm rollup tables from the raw ``alarms`` history."""
+
+from __future__ import annotations
+
+import time
+
+from backend.repositories import database as repo
+
+
+def main():
+    repo.init_db()
+    started = time.perf_counter()
+    counts = repo.rebuild_alarm_rollups()
+    elapsed = time.perf_counter() - started
+    for granularity, rows in counts.items():
+        print(f"{granularity:<7} {rows:>9} buckets")
+    print(f"rebuilt in {elapsed:.2f}s")
+    repo.get_pool().close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -20,7 +20,10 @@ from urllib.request import urlopen
 import db
 
 ROOT = Path(__file__).resolve().parent
-DB_FILES = ("alarm.db", "alarm.db-shm", "alarm.db-wal")
+DB_FILES = (
+    "alarm.db", "alarm.db-shm", "alarm.db-wal",
+    "alarm_logs.db", "alarm_logs.db-shm", "alarm_logs.db-wal",
+)
 
 
 @dataclass
@@ -186,6 +189,7 @@ def rebuild_demo_database() -> None:
     image_primary, image_secondary = ensure_demo_assets()
     remove_database_files()
     db.init_db()
+    db.close_db_connection()
 
     now = datetime.now().replace(second=0, microsecond=0)
     today = now.replace(hour=8, minute=0)
@@ -0,0 +1,62 @@
+"""Alarm events must own the images their raise carries."""
+
+import os
+import tempfile
+import unittest
+
+from backend.repositories import database as repo
+from backend.services.device_state import DeviceStateTable
+
+
+class UploadThenRaiseTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+        repo.get_pool().close_all()
+        repo.init_db()
+        self.state = DeviceStateTable(repo.load_device_state)
+
+    def tearDown(self):
+        repo.get_pool().close_all()
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def send(self, alarm, timestamp, image_paths=()):
+        message = {"device_id": "FORK-003", "alarm": alarm, "timestamp": timestamp, "image_paths": list(image_paths)}
+        self.state.apply_batch([message], repo.write_mqtt_batch)
+
+    def test_frames_uploaded_before_raise_belong_to_that_raise(self):
+        base = 1_700_000_000_000
+        self.send(1, base, ["images/alarms/FORK-003_first.png"])
+        self.send(0, base + 5_000)
+        # publish_test.simulate_publish: the burst is uploaded first, then the raise lists it.
+        frames = [f"images/alarms/FORK-003_up_{i}.png" for i in range(4)]
+        for i, path in enumerate(frames):
+            repo.save_alarm_image("FORK-003", path, base + 60_000 + i * 1000)
+        self.send(1, base + 65_000, frames)
+
+        with repo.get_pool().reader() as conn:
+            events = conn.execute("SELECT id, image_id FROM alarm_events ORDER BY id").fetchall()
+            owners = {
+                row["image_path"]: row["event_id"]
+                for row in conn.execute("SELECT image_path, event_id FROM alarm_images")
+            }
+        first, second = events
+        self.assertEqual({owners[path] for path in frames}, {second["id"]})
+        self.assertEqual(owners["images/alarms/FORK-003_first.png"], first["id"])
+
+        recent = {row["id"]: row["image_path"] for row in repo.get_recent_alarms()}
+        self.assertEqual(recent[second["id"]], "images/alarms/FORK-003_up_3.png")
+        self.assertEqual(recent[first["id"]], "images/alarms/FORK-003_first.png")
+
+    def test_raise_relinks_an_existing_image(self):
+        base = 1_700_000_000_000
+        repo.save_alarm_image("FORK-003", "images/alarms/FORK-003_late.png", base + 90_000)
+        self.send(1, base + 100_000, ["images/alarms/FORK-003_late.png"])
+        (event,) = repo.get_recent_alarms()
+        self.assertEqual(event["image_path"], "images/alarms/FORK-003_late.png")
+
+
+if __name__ == "__main__":
+    unittest.main()
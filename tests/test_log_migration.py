@@ -0,0 +1,80 @@
+"""Logs moved out of the alarm database must stay searchable by time range."""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import logger
+from timeutil import format_ms, parse_ms
+
+
+class LegacyLogMigrationTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def write_legacy_logs(self, rows):
+        legacy = sqlite3.connect(logger.DB_PATH)
+        legacy.execute(
+            """
+            CREATE TABLE all_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts TEXT, level TEXT, event TEXT, category TEXT, device_id TEXT, message TEXT, extra TEXT
+            )
+            """
+        )
+        legacy.executemany(
+            "INSERT INTO all_logs (ts, level, event, category, device_id, message) VALUES (?, 'INFO', ?, 'biz', 'FORK-001', ?)",
+            rows,
+        )
+        legacy.commit()
+        legacy.close()
+
+    def test_migrated_utc_rows_match_local_date_range(self):
+        self.write_legacy_logs([
+            ("2024-05-01T08:00:00.123456Z", "device.alarm.raised", "legacy forklift alarm"),
+            ("2024-05-03T08:00:00.000000Z", "device.alarm.raised", "legacy forklift alarm later"),
+        ])
+
+        conn = logger._connect_log_db()
+        logger._migrate_legacy_logs(conn)
+        conn.close()
+
+        local = format_ms(parse_ms("2024-05-01T08:00:00.123456Z"))
+        start = format_ms(parse_ms("2024-05-01T07:00:00Z"))
+        end = format_ms(parse_ms("2024-05-01T09:00:00Z"))
+        result = logger.search_logs("forklift", start=start, end=end)
+        self.assertEqual([item["ts"] for item in result["items"]], [local])
+        self.assertEqual(result["items"][0]["message"], "legacy forklift alarm")
+
+    def test_legacy_rows_sort_before_rows_already_in_log_db(self):
+        self.write_legacy_logs([
+            ("2024-05-01T08:00:00.000000Z", "device.alarm.raised", "legacy first"),
+            ("2024-05-01T09:00:00.000000Z", "device.alarm.cleared", "legacy second"),
+        ])
+        # A previous migration attempt failed and the sink kept writing newer rows.
+        conn = logger._connect_log_db()
+        conn.execute(
+            "INSERT INTO all_logs (ts, level, event, category, device_id, message) VALUES (?, 'INFO', 'system.started', 'biz', 'FORK-001', 'after upgrade')",
+            (format_ms(parse_ms("2024-06-01T08:00:00Z")),),
+        )
+        conn.commit()
+        logger._migrate_legacy_logs(conn)
+        rows = conn.execute("SELECT id, ts, message FROM all_logs ORDER BY id").fetchall()
+        conn.close()
+
+        self.assertEqual([message for _, _, message in rows], ["legacy first", "legacy second", "after upgrade"])
+        self.assertEqual([ts for _, ts, _ in rows], sorted(ts for _, ts, _ in rows))
+        newest_first = logger.get_logs_by_page(page_size=10, category="biz")["logs"]
+        self.assertEqual([item["message"] for item in newest_first], ["after upgrade", "legacy second", "legacy first"])
+        self.assertEqual(len(logger.search_logs("legacy")["items"]), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
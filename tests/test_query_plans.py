@@ -0,0 +1,75 @@
+"""Alarm history/trend/event reads must be index searches, never full table scans."""
+
+import os
+import tempfile
+import unittest
+
+from backend.repositories import database as repo
+
+DEVICE_IDS = ["FORK-001", "FORK-002"]
+TABLES = ("alarms", "alarm_events") + tuple(table for table, _ in repo.ROLLUP_TABLES.values())
+INDEXED = ("USING INDEX", "USING COVERING INDEX", "USING PRIMARY KEY", "USING INTEGER PRIMARY KEY")
+
+QUERIES = [
+    ("get_device_history_raw", lambda: repo.get_device_history_raw(DEVICE_IDS[0])),
+    ("get_device_alarm_trend", lambda: repo.get_device_alarm_trend(DEVICE_IDS[0])),
+    ("get_device_alarm_hourly_today", lambda: repo.get_device_alarm_hourly_today(DEVICE_IDS[0])),
+    ("get_alarm_hourly_today_yesterday", repo.get_alarm_hourly_today_yesterday),
+    ("get_alarm_trend_multi_device(day)", lambda: repo.get_alarm_trend_multi_device("day", DEVICE_IDS)),
+    ("get_alarm_trend_multi_device(week)", lambda: repo.get_alarm_trend_multi_device("week", DEVICE_IDS)),
+    ("get_alarm_trend_multi_device(month)", lambda: repo.get_alarm_trend_multi_device("month", DEVICE_IDS)),
+    ("get_recent_alarms", lambda: repo.get_recent_alarms(500)),
+]
+
+
+class QueryPlanTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+        repo.get_pool().close_all()
+        repo.init_db()
+        self._mode = repo.ALARM_STORAGE_MODE
+
+    def tearDown(self):
+        repo.ALARM_STORAGE_MODE = self._mode
+        repo.get_pool().close_all()
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def capture_sql(self, conn, func):
+        """Run ``func`` and return the expanded SELECTs it issued against ``TABLES``."""
+        statements = []
+
+        def trace(sql):
+            if sql.lstrip().upper().startswith("SELECT") and any(table in sql for table in TABLES):
+                statements.append(sql)
+
+        conn.set_trace_callback(trace)
+        try:
+            func()
+        finally:
+            conn.set_trace_callback(None)
+        return statements
+
+    def assert_indexed(self, conn, name, func):
+        statements = self.capture_sql(conn, func)
+        self.assertTrue(statements, f"{name}: no query captured")
+        for sql in statements:
+            plan = [row["detail"] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+            with self.subTest(query=name, plan=plan):
+                for detail in plan:
+                    if detail.startswith(("SCAN", "SEARCH")):
+                        self.assertTrue(any(marker in detail for marker in INDEXED), detail)
+                self.assertFalse([detail for detail in plan if detail.split(" USING")[0] in {f"SCAN {t}" for t in TABLES}])
+
+    def test_queries_use_indexes(self):
+        for mode in ("all", "transitions"):
+            repo.ALARM_STORAGE_MODE = mode
+            with repo.get_pool().reader() as conn:
+                for name, func in QUERIES:
+                    self.assert_indexed(conn, f"{name} [{mode}]", func)
+
+
+if __name__ == "__main__":
+    unittest.main()
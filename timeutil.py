@@ -0,0 +1,51 @@
+"""
+统一时间工具
+
+数据库与内存中的事件时间统一使用 epoch 毫秒整数（int），
+只在入库前解析一次，在接口边界（REST / Socket.IO 响应）才格式化为本地时间字符串。
+"""
+
+import time
+from datetime import datetime
+
+# 对外展示的本地时间格式
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def now_ms():
+    """当前时间（epoch 毫秒）"""
+    return time.time_ns() // 1_000_000
+
+
+def parse_ms(value):
+    """
+    将外部传入的时间解析为 epoch 毫秒，无法解析时返回 None
+    支持：本地时间字符串 'YYYY-MM-DD HH:MM:SS'、ISO 8601（可带时区）、epoch 秒或毫秒数字
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        # 小于 1e11 视为秒（1e11 秒约为 5138 年）
+        return int(value * 1000) if value < 1e11 else int(value)
+    text = str(value).strip()
+    if not text:
+        return None
+    try:
+        return int(datetime.fromisoformat(text).timestamp() * 1000)
+    except ValueError:
+        return None
+
+
+def format_ms(ms, fmt=TIME_FORMAT):
+    """epoch 毫秒 -> 本地时间字符串；None 原样返回"""
+    if ms is None:
+        return None
+    return datetime.fromtimestamp(ms / 1000).strftime(fmt)
+
+
+def format_fields(record, fields):
+    """就地把 record 中的毫秒时间字段格式化为字符串，返回 record"""
+    for field in fields:
+        if field in record:
+            record[field] = format_ms(record[field])
+    return record